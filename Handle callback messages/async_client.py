@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio front end for the EWrapper / EClient programs of this repository.
+
+The TWS socket is still read by the client thread (EClient.run), but the callbacks resolve
+Futures which are delivered onto the asyncio event loop. A strategy awaits the results instead of
+blocking on Event.wait() or time.sleep(), so hundreds of requests can be fanned out from one
+coroutine without a thread per waiter:
+
+    async def main():
+        client = AsyncClient('127.0.0.1', 7497, 0)
+        await client.connect()
+        dfs = await asyncio.gather(*[client.historical_bars(c, '', '5 D', '5 mins') for c in contracts])
+        details = await client.contract_details(contract)
+        statuses = await client.place_bracket(contract, 'BUY', 100, 30, 40, 20)
+        client.disconnect()
+
+    asyncio.run(main())
+"""
+# Imports used in the program
+from ibapi.client import Contract
+from ibapi.order import Order
+from ibapi.utils import iswrapper
+
+from threading import Lock
+from concurrent.futures import Future
+
+import asyncio
+import datetime
+
+from request_router import RequestRouter, IBError, is_warning
+from callback_logger import start_logging
+
+class OrderRouter(RequestRouter):
+    ''' RequestRouter which also returns a Future per placed order '''
+
+    def __init__(self, addr, port, client_id):
+        self.orders = {} # orderId : Future, resolved with the first orderStatus showing the order is working
+        self.order_id_lock = Lock()
+        RequestRouter.__init__(self, addr, port, client_id)
+
+    def next_order_id(self):
+        ''' Allocate the next order id locally, starting from nextValidId '''
+        return self.next_order_ids(1)
+
+    def next_order_ids(self, count):
+        ''' Reserve count consecutive order ids in one step, e.g. for a bracket. Returns the first '''
+        with self.order_id_lock:
+            order_id = self.orderId
+            self.orderId += count
+        return order_id
+
+    def place_order(self, contract, order):
+        ''' placeOrder. The Future resolves to the first orderStatus of the order as a dict. Cancelling it cancels the order at TWS '''
+        future = Future()
+        self.orders[order.orderId] = future
+        future.add_done_callback(lambda f: self._order_done(order.orderId, f))
+        self.placeOrder(order.orderId, contract, order)
+        return future
+
+    def _order_done(self, order_id, future):
+        self.orders.pop(order_id, None)
+        if future.cancelled(): # e.g. a timeout while awaiting it. Do not leave the order working untracked
+            self.cancelOrder(order_id)
+
+    @iswrapper
+    def orderStatus(self, orderId, status, filled, remaining, avgFillPrice, permId, parentId, lastFillPrice, clientId, whyHeld, mktCapPrice):
+        ''' Callback for the submitted order '''
+        future = self.orders.get(orderId)
+        if future is None or future.done():
+            return
+        order_status = {'orderId': orderId, 'status': status, 'filled': filled, 'remaining': remaining,
+                        'avgFillPrice': avgFillPrice, 'permId': permId, 'parentId': parentId}
+        if status in ('PreSubmitted', 'Submitted', 'Filled'):
+            future.set_result(order_status)
+        elif status in ('Cancelled', 'ApiCancelled', 'Inactive'):
+            future.set_exception(IBError(orderId, None, 'Order {}'.format(status)))
+
+    @iswrapper
+    def connectionClosed(self):
+        ''' The requests and the orders in flight will never be answered. Their Futures fail with ConnectionError '''
+        for order_id, future in list(self.orders.items()):
+            if not future.done():
+                future.set_exception(ConnectionError('Connection to TWS closed with order {} in flight'.format(order_id)))
+        RequestRouter.connectionClosed(self)
+
+    @iswrapper
+    def error(self, req_id, code, msg):
+        ''' Called if an error occurs. Errors of an order fail its Future. 399 is only an order warning '''
+        future = self.orders.get(req_id)
+        if future is not None and not future.done() and not is_warning(code) and code != 399:
+            future.set_exception(IBError(req_id, code, msg))
+        else:
+            RequestRouter.error(self, req_id, code, msg)
+
+def bracket_order(parent_order_id, action, quantity, limit_price, take_profit_limit_price, stop_loss_price):
+    ''' Parent LMT order with a take profit LMT and a stop loss STP child. Only the last child transmits '''
+    parent = Order()
+    parent.orderId = parent_order_id
+    parent.action = action
+    parent.orderType = "LMT"
+    parent.totalQuantity = quantity
+    parent.lmtPrice = limit_price
+    parent.transmit = False
+
+    take_profit = Order()
+    take_profit.orderId = parent_order_id + 1
+    take_profit.action = "SELL" if action == "BUY" else "BUY"
+    take_profit.orderType = "LMT"
+    take_profit.totalQuantity = quantity
+    take_profit.lmtPrice = take_profit_limit_price
+    take_profit.parentId = parent_order_id
+    take_profit.transmit = False
+
+    stop_loss = Order()
+    stop_loss.orderId = parent_order_id + 2
+    stop_loss.action = "SELL" if action == "BUY" else "BUY"
+    stop_loss.orderType = "STP"
+    stop_loss.auxPrice = stop_loss_price
+    stop_loss.totalQuantity = quantity
+    stop_loss.parentId = parent_order_id
+    stop_loss.transmit = True # activates all its predecessors
+    return [parent, take_profit, stop_loss]
+
+class AsyncClient:
+    ''' Awaitable requests on one TWS connection '''
+
+    def __init__(self, addr, port, client_id):
+        self.addr = addr
+        self.port = port
+        self.client_id = client_id
+        self.router = None
+
+    async def connect(self, timeout=10):
+        ''' Connect to TWS and wait for nextValidId '''
+        loop = asyncio.get_running_loop()
+        self.router = OrderRouter(self.addr, self.port, self.client_id)
+        connected = await loop.run_in_executor(None, self.router.nextValidId_available.wait, timeout)
+        if not connected:
+            raise TimeoutError('nextValidId not received within {} seconds. Is TWS running?'.format(timeout))
+        return self
+
+    def disconnect(self):
+        self.router.disconnect()
+
+    @staticmethod
+    async def _await(future, timeout):
+        ''' Await a concurrent Future on the running loop. On timeout the request is cancelled at TWS '''
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    async def historical_bars(self, contract, end_date_time, duration, bar_size, what_to_show='TRADES', use_rth=1, timeout=60):
+        ''' reqHistoricalData. Returns a DataFrame with columns ['Date', 'Open', 'High', 'Low', 'Close', 'Volume'] '''
+        future = self.router.historical_data(contract, end_date_time, duration, bar_size, what_to_show, use_rth)
+        return await self._await(future, timeout)
+
+    async def contract_details(self, contract, timeout=30):
+        ''' reqContractDetails. Returns a list of ContractDetails '''
+        return await self._await(self.router.contract_details(contract), timeout)
+
+    async def account_summary(self, tags, group='All', timeout=30):
+        ''' reqAccountSummary. Returns a list of dicts with keys account, tag, value, currency '''
+        return await self._await(self.router.account_summary(tags, group), timeout)
+
+    async def place_bracket(self, contract, action, quantity, limit_price, take_profit_limit_price, stop_loss_price, timeout=30):
+        ''' Place a bracket order. Returns the first orderStatus of the parent, take profit and stop loss orders '''
+        parent_order_id = self.router.next_order_ids(3) # the children use the next 2 ids
+        bracket = bracket_order(parent_order_id, action, quantity, limit_price, take_profit_limit_price, stop_loss_price)
+        futures = [asyncio.wrap_future(self.router.place_order(contract, o)) for o in bracket]
+        try:
+            return await asyncio.wait_for(asyncio.gather(*futures), timeout)
+        except asyncio.TimeoutError: # the orders not yet working are cancelled at TWS by place_order
+            if not futures[0].cancelled(): # the parent is working. Cancelling it also cancels the children
+                self.router.cancelOrder(parent_order_id)
+            raise
+
+async def main():
+    start_logging() # the callbacks log through a background writer thread
+    client = AsyncClient('127.0.0.1', 7497, 0)
+    await client.connect()
+
+    contracts = []
+    for symbol in ['RELIANCE', 'INFY', 'TCS', 'HDFCBANK', 'ICICIBANK']:
+        contract = Contract()
+        contract.symbol = symbol
+        contract.secType = 'STK'
+        contract.exchange = 'NSE'
+        contract.currency = 'INR'
+        contracts.append(contract)
+
+    # Fan out all the requests at once
+    now = datetime.datetime.now().strftime("%Y%m%d %H:%M:%S")
+    results = await asyncio.gather(*[client.historical_bars(c, now, '5 D', '5 mins') for c in contracts],
+                                   *[client.contract_details(c) for c in contracts], return_exceptions=True)
+    for contract, bars, details in zip(contracts, results[:len(contracts)], results[len(contracts):]):
+        if isinstance(bars, Exception) or isinstance(details, Exception):
+            print('{}: {} {}'.format(contract.symbol, bars if isinstance(bars, Exception) else '', details if isinstance(details, Exception) else ''))
+        else:
+            print('{}: conId {}, {} bars, last close {}'.format(contract.symbol, details[0].contract.conId, len(bars), bars['Close'].iloc[-1]))
+
+    client.disconnect()
+
+if __name__ == '__main__':
+    asyncio.run(main())
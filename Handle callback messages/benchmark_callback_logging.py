@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the dispatch of TWS messages to the EWrapper callbacks with print() against callback_logger.
+
+A burst of tickPrice and orderStatus messages is decoded by the ibapi Decoder and dispatched to a
+wrapper, as on the EReader thread of EClient.run, once per mode:
+
+    off      : the callbacks do no output
+    print    : print(...format(...)) in the callbacks, as before
+    logging  : log.info(...) through the queue, written by the background writer thread
+    filtered : log.debug(...) below the level, i.e. the output filtered out
+
+Printed per mode: the dispatch throughput (messages per second on the callback thread) and, for
+logging, the time for the writer thread to drain the queue.
+
+Usage :
+    python benchmark_callback_logging.py [number of messages] [output file]
+
+Without an output file the print and log lines go to the console, which is what stalls the callbacks.
+"""
+# Imports used in the program
+from callback_logger import get_logger, start_logging, stop_logging, INFO
+
+from ibapi.wrapper import EWrapper
+from ibapi.decoder import Decoder
+from ibapi import comm
+
+import time
+import sys
+
+SERVER_VERSION = 151
+log = get_logger(__name__)
+
+class BenchWrapper(EWrapper):
+    ''' The tickPrice, tickSize and orderStatus callbacks, with the output of one mode '''
+
+    def __init__(self, mode, file=None):
+        EWrapper.__init__(self)
+        self.mode = mode
+        self.file = file if file is not None else sys.stdout
+        self.count = 0
+
+    def tickPrice(self, reqId, tickType, price, attrib):
+        self.count += 1
+        if self.mode == 'print':
+            print('Tick Price. ReqId: {}, TickType: {}, Price: {}'.format(reqId, tickType, price), file=self.file)
+        elif self.mode == 'logging':
+            log.info('Tick Price. ReqId: %s, TickType: %s, Price: %s', reqId, tickType, price)
+        elif self.mode == 'filtered':
+            log.debug('Tick Price. ReqId: %s, TickType: %s, Price: %s', reqId, tickType, price)
+
+    def tickSize(self, reqId, tickType, size):
+        self.count += 1
+        if self.mode == 'print':
+            print('Tick Size. ReqId: {}, TickType: {}, Size: {}'.format(reqId, tickType, size), file=self.file)
+        elif self.mode == 'logging':
+            log.info('Tick Size. ReqId: %s, TickType: %s, Size: %s', reqId, tickType, size)
+        elif self.mode == 'filtered':
+            log.debug('Tick Size. ReqId: %s, TickType: %s, Size: %s', reqId, tickType, size)
+
+    def orderStatus(self, orderId, status, filled, remaining, avgFillPrice, permId, parentId, lastFillPrice, clientId, whyHeld, mktCapPrice):
+        self.count += 1
+        if self.mode == 'print':
+            print('Status of Order: {}, Filled Positions: {}, Remaining Positions: {}, OrderId: {}, permId: {}'.format(
+                status, filled, remaining, orderId, permId), file=self.file)
+        elif self.mode == 'logging':
+            log.info('Status of Order: %s, Filled Positions: %s, Remaining Positions: %s, OrderId: %s, permId: %s', status, filled, remaining, orderId, permId)
+        elif self.mode == 'filtered':
+            log.debug('Status of Order: %s, Filled Positions: %s, Remaining Positions: %s, OrderId: %s, permId: %s', status, filled, remaining, orderId, permId)
+
+def make_messages(count):
+    ''' The payloads of count messages, 4 tickPrice for every orderStatus, as read from the socket '''
+    messages = []
+    for i in range(count):
+        if i % 5 == 4:
+            fields = [3, 1000 + i, 'Submitted', 0.0, 75.0, 0.0, 2000000 + i, 0, 0.0, 0, '', 0.0] # orderStatus
+        else:
+            fields = [1, 6, 1 + i % 10, 1 + i % 2, 11500.0 + (i % 40) * 0.05, 25 * (1 + i % 9), 0] # tickPrice, followed by its tickSize
+        messages.append(('\0'.join(map(str, fields)) + '\0').encode())
+    return messages
+
+def dispatch(messages, wrapper):
+    ''' Decode and dispatch the messages as EClient.run does. Returns the seconds taken '''
+    decoder = Decoder(wrapper, SERVER_VERSION)
+    t0 = time.perf_counter()
+    for msg in messages:
+        decoder.interpret(comm.read_fields(msg))
+    return time.perf_counter() - t0
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    file_name = sys.argv[2] if len(sys.argv) > 2 else None
+    messages = make_messages(count)
+
+    results = []
+    for mode in ['off', 'print', 'logging', 'filtered']:
+        drain = 0.0
+        if mode == 'print':
+            out = open(file_name, 'a', encoding='utf-8') if file_name else sys.stdout
+            wrapper = BenchWrapper(mode, out)
+            elapsed = dispatch(messages, wrapper)
+            t0 = time.perf_counter()
+            out.flush()
+            drain = time.perf_counter() - t0
+            if file_name:
+                out.close()
+        else:
+            start_logging(INFO, file_name=file_name, console=file_name is None)
+            wrapper = BenchWrapper(mode)
+            elapsed = dispatch(messages, wrapper)
+            t0 = time.perf_counter()
+            stop_logging() # waits until the writer thread has written every queued record
+            drain = time.perf_counter() - t0
+        results.append((mode, wrapper.count, elapsed, drain))
+
+    print('\nDispatch of {} messages ({} callbacks) to {}:'.format(count, results[0][1], file_name or 'the console'))
+    for mode, callbacks, elapsed, drain in results:
+        print('{:<9} {:>10.0f} messages/sec on the callback thread ({:7.1f} microsec per message), output drained {:.3f} sec later'.format(
+            mode, count / elapsed, elapsed / count * 1e6, drain))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Record / replay of the TWS API callback stream.
+
+Recording: recording(wrapper_class, file_name) returns a subclass of any EWrapper subclass which
+writes every callback it receives (historicalData, orderStatus, execDetails, position, openOrder,
+error, ...) with its arguments and its time to a binary callback log, before handling it as usual:
+
+    RecordingNiftyORB = recording(NiftyORB, 'nifty_orb_session.cblog')
+    client = RecordingNiftyORB('127.0.0.1', 7497, 1) # used exactly as NiftyORB
+    ...
+    client.disconnect() # flushes the log
+    client.callback_log.close()
+
+Replay: replay(file_name, wrapper, speed) calls the same callbacks with the same arguments, in the same
+order, on any EWrapper subclass, without TWS. speed None is as fast as possible, 1.0 is the recorded
+pace (wall clock), 10.0 is ten times faster:
+
+    replay('nifty_orb_session.cblog', client, speed=None)
+
+Only the callbacks made by the TWS API are recorded. A callback called from within another callback
+(e.g. self.error(...) from historicalData) is not, as the replay of the outer callback makes it again.
+
+Log format: b'IBCBLOG1', the length (uint32) and pickle of the header {'names', 'start_time'}, then one
+record per callback: seconds since the start (float64), index of the callback in names (uint16),
+length (uint32) and pickle of (args, kwargs). A record cut short by a crash is ignored on reading.
+
+Usage :
+    python callback_log.py <log file> [speed]
+Prints the callbacks in the log and replays them into a plain EWrapper, with the time and memory taken.
+"""
+# Imports used in the program
+from ibapi.wrapper import EWrapper
+
+from collections import Counter
+
+import threading
+import tracemalloc
+import inspect
+import pickle
+import struct
+import time
+import sys
+
+MAGIC = b'IBCBLOG1'
+LENGTH = struct.Struct('<I')
+RECORD = struct.Struct('<dHI') # seconds since the start, callback index, length of the pickled arguments
+
+def callback_names():
+    ''' Names of the EWrapper callbacks, in a fixed order '''
+    return sorted(name for name, _ in inspect.getmembers(EWrapper, inspect.isfunction)
+                  if not name.startswith('_') and name != 'logAnswer')
+
+class CallbackLogWriter:
+    ''' Appends callback records to a callback log. Safe to write from the client thread and the main thread '''
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.names = callback_names()
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.lock = threading.Lock()
+        self.local = threading.local() # depth of the callbacks in progress, per thread
+        self.count = 0
+        self.file = open(file_name, 'wb')
+        header = pickle.dumps({'names': self.names, 'start_time': time.time()}, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.write(MAGIC + LENGTH.pack(len(header)) + header)
+        self.start = time.monotonic()
+
+    def write(self, name, args, kwargs):
+        ''' Record one callback. The arguments are pickled now, before the callback can change them '''
+        offset = time.monotonic() - self.start
+        payload = pickle.dumps((args, kwargs), protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            if self.file.closed: # callbacks after close() are not recorded
+                return
+            self.file.write(RECORD.pack(offset, self.index[name], len(payload)) + payload)
+            self.count += 1
+
+    def flush(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+                print('Callbacks recorded: {} to {}'.format(self.count, self.file_name))
+
+def read_callback_log(file_name):
+    ''' Yields (seconds since the start, callback name, args, kwargs) for every record of a callback log '''
+    with open(file_name, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a callback log'.format(file_name))
+        (length,) = LENGTH.unpack(f.read(LENGTH.size))
+        names = pickle.loads(f.read(length))['names']
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            offset, index, length = RECORD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length: # last record cut short
+                return
+            args, kwargs = pickle.loads(payload)
+            yield offset, names[index], args, kwargs
+
+def _recording_callback(name, method):
+    ''' Wrap one callback method of the wrapper class to record its top level calls '''
+    def callback(self, *args, **kwargs):
+        log = self.callback_log
+        depth = getattr(log.local, 'depth', 0)
+        if depth == 0:
+            log.write(name, args, kwargs)
+        log.local.depth = depth + 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            log.local.depth = depth
+    callback.__name__ = name
+    callback.__doc__ = method.__doc__
+    return callback
+
+def recording(wrapper_class, file_name):
+    ''' Subclass of wrapper_class (an EWrapper subclass) which records every callback to the callback log file_name '''
+    def __init__(self, *args, **kwargs):
+        self.callback_log = CallbackLogWriter(file_name) # before wrapper_class.__init__, which may already connect
+        wrapper_class.__init__(self, *args, **kwargs)
+
+    namespace = {'__init__': __init__}
+    for name in callback_names():
+        namespace[name] = _recording_callback(name, getattr(wrapper_class, name))
+    if hasattr(wrapper_class, 'disconnect'): # An EClient as well: flush the log after connectionClosed. A reconnect records on
+        def disconnect(self):
+            wrapper_class.disconnect(self)
+            self.callback_log.flush()
+        namespace['disconnect'] = disconnect
+    return type('Recording' + wrapper_class.__name__, (wrapper_class,), namespace)
+
+def replay(file_name, wrapper, speed=None):
+    '''
+    Call the callbacks of the log on wrapper, in the recorded order, on the calling thread.
+    speed None replays as fast as possible, else at speed times the recorded pace. Returns the number of callbacks
+    '''
+    count = 0
+    start = time.monotonic()
+    for offset, name, args, kwargs in read_callback_log(file_name):
+        if speed:
+            delay = start + offset / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        getattr(wrapper, name)(*args, **kwargs)
+        count += 1
+    return count
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python callback_log.py <log file> [speed]')
+        return
+    file_name = sys.argv[1]
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    counts = Counter()
+    duration = 0.0
+    for offset, name, args, kwargs in read_callback_log(file_name):
+        counts[name] += 1
+        duration = offset
+    print('Callbacks: {} over {:.1f} sec of session'.format(sum(counts.values()), duration))
+    for name, count in counts.most_common():
+        print('   {}: {}'.format(name, count))
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    count = replay(file_name, EWrapper(), speed)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('Replayed {} callbacks in {:.3f} sec ({:.1f} microsec per callback), peak memory {:.1f} KB'.format(
+        count, elapsed, elapsed / max(count, 1) * 1e6, peak / 1024))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Non blocking logging for the EWrapper callbacks.
+
+A print() in a callback writes to the console on the EReader dispatch thread, so a slow console
+stalls the decoding of the next messages. Here a callback only puts a tuple (time, level, logger,
+thread, message, arguments, fields) on a queue. One background writer thread formats the records
+and writes them in batches, one write per batch instead of one per line:
+
+    log = get_logger(__name__)
+    start_logging() # once, in main. INFO and above to the console
+    log.info('Status of Order: %s, Filled Positions: %s', status, filled) # in a callback. Formatted later, by the writer thread
+    log.info('Order filled', order_id=order_id, price=price) # structured fields, written as order_id=.. price=..
+    log.debug('...') # below the level: returns after one comparison, nothing is queued or formatted
+    stop_logging() # writes what is still queued. Also called at exit
+
+start_logging(level, file_name, structured) also writes to a file, one JSON object per line with
+structured=True (time, level, logger, thread, message and the fields).
+
+Before start_logging (e.g. a class of a program used from another script) the records are written
+at once on the calling thread, as print did, so nothing is lost or queued without a writer.
+The levels are those of the logging module: DEBUG, INFO, WARNING, ERROR.
+"""
+# Imports used
+from logging import DEBUG, INFO, WARNING, ERROR, getLevelName
+from threading import Thread, current_thread
+
+import atexit
+import queue
+import json
+import time
+import sys
+import os
+
+CONSOLE_FORMAT = '{time} {message}'
+FILE_FORMAT = '{time} {level} {logger} [{thread}] {message}'
+BATCH_SIZE = 1000 # records written per write() at most
+
+class LogState:
+    ''' Level and destination of the records, shared by all the loggers '''
+
+    def __init__(self):
+        self.level = INFO
+        self.writer = None # LogWriter of start_logging. None writes at once on the calling thread
+        self.put = self.write_now
+
+    def write_now(self, record):
+        sys.stdout.write(format_record(record, CONSOLE_FORMAT) + '\n')
+
+state = LogState()
+loggers = {} # name : CallbackLogger
+
+class CallbackLogger:
+    ''' The logging methods of one module. Same call signatures as a logging.Logger, plus keyword fields '''
+    __slots__ = ['name']
+
+    def __init__(self, name):
+        self.name = name
+
+    def isEnabledFor(self, level):
+        return level >= state.level
+
+    def log(self, level, msg, *args, **fields):
+        if level >= state.level:
+            state.put((time.time(), level, self.name, current_thread().name, msg, args, fields))
+
+    def debug(self, msg, *args, **fields):
+        if DEBUG >= state.level:
+            state.put((time.time(), DEBUG, self.name, current_thread().name, msg, args, fields))
+
+    def info(self, msg, *args, **fields):
+        if INFO >= state.level:
+            state.put((time.time(), INFO, self.name, current_thread().name, msg, args, fields))
+
+    def warning(self, msg, *args, **fields):
+        if WARNING >= state.level:
+            state.put((time.time(), WARNING, self.name, current_thread().name, msg, args, fields))
+
+    def error(self, msg, *args, **fields):
+        if ERROR >= state.level:
+            state.put((time.time(), ERROR, self.name, current_thread().name, msg, args, fields))
+
+def message_text(msg, args):
+    ''' msg % args, formatted only when written '''
+    if not args:
+        return str(msg)
+    try:
+        return msg % args
+    except (TypeError, ValueError):
+        return '{} {}'.format(msg, args)
+
+second_text = [None, ''] # the last second formatted, and its text. Only the writer thread formats
+
+def time_text(t):
+    ''' HH:MM:SS.mmm of an epoch time '''
+    second = int(t)
+    if second != second_text[0]:
+        second_text[0], second_text[1] = second, time.strftime('%H:%M:%S', time.localtime(second))
+    return '{}.{:03d}'.format(second_text[1], int((t - second) * 1000))
+
+def format_record(record, line_format):
+    ''' One line of text of a record '''
+    t, level, name, thread, msg, args, fields = record
+    message = message_text(msg, args)
+    if fields:
+        message = message + ' ' + ' '.join('{}={}'.format(key, value) for key, value in fields.items())
+    return line_format.format(time=time_text(t), level=getLevelName(level), logger=name, thread=thread, message=message)
+
+def format_json(record):
+    ''' One JSON object of a record, with its fields '''
+    t, level, name, thread, msg, args, fields = record
+    entry = {'time': time.strftime('%Y-%m-%d ', time.localtime(t)) + time_text(t), 'level': getLevelName(level),
+             'logger': name, 'thread': thread, 'message': message_text(msg, args)}
+    entry.update(fields)
+    return json.dumps(entry, default=str)
+
+class LogWriter:
+    ''' The background thread which formats and writes the queued records '''
+
+    def __init__(self, outputs):
+        self.outputs = outputs # list of (stream, function record -> line)
+        self.records = queue.SimpleQueue() # unbounded: a put never blocks the callback
+        self.thread = Thread(target=self.run, name='LogWriter', daemon=True)
+
+    def run(self):
+        while True:
+            batch = [self.records.get()] # block thread until a record is queued
+            try:
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self.records.get_nowait())
+            except queue.Empty:
+                pass
+            done = batch[-1] is None # stop marker, queued last by stop
+            if done:
+                batch.pop()
+            for stream, format_line in self.outputs:
+                stream.write(''.join([format_line(record) + '\n' for record in batch]))
+                stream.flush()
+            if done:
+                return
+
+    def stop(self):
+        self.records.put(None)
+        self.thread.join()
+
+def get_logger(name):
+    ''' Logger of a module. __main__ is named after the script '''
+    if name == '__main__':
+        name = os.path.splitext(os.path.basename(sys.argv[0]))[0] or name
+    logger = loggers.get(name)
+    if logger is None:
+        logger = loggers[name] = CallbackLogger(name)
+    return logger
+
+def error_level(code):
+    ''' Log level of a TWS error code. 2100 - 2199 are notifications, e.g. 2104 Market data farm connection is OK '''
+    return INFO if 2100 <= code < 2200 else ERROR
+
+def start_logging(level=INFO, file_name=None, structured=False, console=True):
+    ''' Start the writer thread. The records of level and above go to the console and / or file_name '''
+    stop_logging()
+    outputs = []
+    if console:
+        outputs.append((sys.stdout, lambda record: format_record(record, CONSOLE_FORMAT)))
+    if file_name:
+        outputs.append((open(file_name, 'a', encoding='utf-8'), format_json if structured else lambda record: format_record(record, FILE_FORMAT)))
+    state.level = level
+    state.writer = LogWriter(outputs)
+    state.writer.thread.start()
+    state.put = state.writer.records.put
+    atexit.register(stop_logging) # the writer thread is a daemon. Do not lose the last records on exit
+    return state.writer
+
+def stop_logging():
+    ''' Write the records still queued and stop the writer thread. Later records are written at once again '''
+    writer = state.writer
+    if writer is None:
+        return
+    atexit.unregister(stop_logging)
+    state.put = state.write_now
+    state.writer = None
+    writer.stop()
+    for stream, _ in writer.outputs:
+        if stream is not sys.stdout:
+            stream.close()
@@ -20,6 +20,9 @@ from ibapi.wrapper import EWrapper
 from ibapi.client import Contract
 from ibapi.order import Order
 from ibapi.utils import iswrapper
+from callback_logger import get_logger, start_logging, error_level
+
+log = get_logger(__name__)
 
 class TestApp(EWrapper, EClient):
     ''' Serves as the client and the wrapper '''
@@ -52,7 +55,7 @@ class TestApp(EWrapper, EClient):
         # Callback Trigerred after 1) successfully connecting to the TWS 2) after invoking the IBApi.EClient.reqIds method.
         self.orderId = orderId
         self.nextValidId_available.set() #internal flag is set to True
-        print('Order Id from nextValidId callback is: {}'.format(orderId))      
+        log.info('Order Id from nextValidId callback is: %s', orderId)
 
     # Active orders will be delivered via 2 callback's - The openOrder callback and The orderStatus callback. 
     @iswrapper
@@ -79,7 +82,7 @@ class TestApp(EWrapper, EClient):
     # They come automatically, in the same way as openOrder and orderStatus notifications.
     @iswrapper
     def execDetails(self, reqId, contract, execution):
-        print("\nIn callback ExecDetails. ReqId: {}, Symbol: {}, SecType: {}, Currency: {}, Execution: {}".format(reqId, contract.localSymbol, contract.secType, contract.currency, execution))
+        log.info('In callback ExecDetails. ReqId: %s, Symbol: %s, SecType: %s, Currency: %s, Execution: %s', reqId, contract.localSymbol, contract.secType, contract.currency, execution)
         self.order_executed = True
         self.execDetails_available.set() #internal flag is set to True        
     
@@ -87,14 +90,15 @@ class TestApp(EWrapper, EClient):
     def execDetailsEnd(self, reqId):
         # Triggered Only if you request all executions via reqExecutions
         # Triggered after all execDetails are received.
-        print("In callback execDetailsEnd. ReqId: {}".format(reqId))
+        log.info('In callback execDetailsEnd. ReqId: %s', reqId)
         self.execDetailsEnd_available.set() #internal flag is set to True
 
     @iswrapper    
     def error(self, req_id, code, msg):
         ''' Called if an error occurs '''
-        print('Error Request Id: {}, Error Code: {}, Error Message: {}'.format(req_id, code, msg))
+        log.log(error_level(code), 'Error Request Id: %s, Error Code: %s, Error Message: %s', req_id, code, msg)
 
+start_logging() # the callbacks log through a background writer thread
 print ("Main Program Starts Here. Going to Connect to TWS")
 # Create the client and connect to TWS
 client = TestApp('127.0.0.1', 7497, 4)
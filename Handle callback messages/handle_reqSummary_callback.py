@@ -7,6 +7,7 @@ from ibapi.utils import iswrapper
 from ibapi.client import Contract
 from ibapi.order import Order
 from ibapi.execution import ExecutionFilter
+from callback_logger import get_logger, start_logging, error_level
 
 from threading import Thread, Event
 
@@ -17,6 +18,8 @@ import sys
 import time
 import datetime
 
+log = get_logger(__name__)
+
 class TestReq(EWrapper, EClient):
     ''' Serves as the client and the wrapper '''
 
@@ -45,7 +48,7 @@ class TestReq(EWrapper, EClient):
         ''' Provides the next order ID '''
         self.orderId = orderId
         self.nextValidId_available.set() #internal flag is set to True
-        print('Order Id from nextValidId callback is: {}'.format(orderId))
+        log.info('Order Id from nextValidId callback is: %s', orderId)
 
     @iswrapper
     def managedAccounts(self, accountsList):
@@ -68,14 +71,15 @@ class TestReq(EWrapper, EClient):
                     
     @iswrapper
     def accountSummaryEnd(self, reqId: int):
-        print("In Callback accountSummaryEnd. ReqId:", reqId)
+        log.info('In Callback accountSummaryEnd. ReqId: %s', reqId)
         self.accountSummaryEnd_available.set() #internal flag is set to True
 
     @iswrapper    
     def error(self, req_id, code, msg):
         ''' Called if an error occurs '''
-        print('Error Request Id: {}, Error Code: {}, Error Message: {}'.format(req_id, code, msg))
+        log.log(error_level(code), 'Error Request Id: %s, Error Code: %s, Error Message: %s', req_id, code, msg)
 
+start_logging() # the callbacks log through a background writer thread
 # Create the client and connect to TWS
 client = TestReq('127.0.0.1', 7497, 0)
 client.nextValidId_available.wait() # block thread until internal flag is set to True
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+reqId multiplexed request router for the TWS API.
+
+Instead of one Event per callback type and one shared buffer (which allows only one request of a
+kind at a time, with a hard coded reqId), the router allocates a new reqId for every request, collects
+the callbacks of that reqId in its own collector and resolves a concurrent.futures.Future when the
+End callback (or an error for that reqId) arrives. Many requests can be in flight on one connection:
+
+    client = RequestRouter('127.0.0.1', 7497, 0)
+    client.nextValidId_available.wait()
+    futures = {symbol: client.historical_data(contract, '', '5 D', '5 mins') for symbol, contract in ...}
+    df = futures['RELIANCE'].result(timeout=30)
+
+The futures can be awaited from asyncio with asyncio.wrap_future(future).
+Subclass RequestRouter (instead of EWrapper, EClient) to add the callbacks of a program.
+"""
+# Imports used in the program
+from ibapi.client import EClient
+from ibapi.wrapper import EWrapper
+from ibapi.utils import iswrapper
+from ibapi.client import Contract
+from callback_logger import get_logger, start_logging, error_level
+
+from threading import Thread, Event, Lock
+from concurrent.futures import Future, wait
+
+import pandas as pd
+import itertools
+import datetime
+import time
+
+log = get_logger(__name__)
+
+class IBError(Exception):
+    ''' Error callback received for a request of the router '''
+
+    def __init__(self, req_id, code, msg):
+        super().__init__('Request Id: {}, Error Code: {}, Error Message: {}'.format(req_id, code, msg))
+        self.req_id = req_id
+        self.code = code
+        self.msg = msg
+
+class PendingRequest:
+    ''' Result collector of one request in flight '''
+
+    def __init__(self, kind, make_result, cancel):
+        self.kind = kind # e.g. 'historicalData'
+        self.items = [] # callbacks received so far
+        self.make_result = make_result # builds the result of the Future from the items
+        self.cancel = cancel # cancels the request at TWS, or None
+        self.future = Future()
+
+def is_warning(code):
+    ''' Error codes which are only information (e.g. 2104 Market data farm connection is OK) '''
+    return 2100 <= code < 2200 or code == 10167
+
+def bars_to_df(bars):
+    ''' List of BarData to a DataFrame with columns ['Date', 'Open', 'High', 'Low', 'Close', 'Volume'] '''
+    return pd.DataFrame({'Date': [bar.date for bar in bars], 'Open': [bar.open for bar in bars],
+                         'High': [bar.high for bar in bars], 'Low': [bar.low for bar in bars],
+                         'Close': [bar.close for bar in bars], 'Volume': [bar.volume for bar in bars]},
+                        columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
+
+class RequestRouter(EWrapper, EClient):
+    ''' Serves as the client and the wrapper. Every request gets its own reqId and returns a Future '''
+
+    def __init__(self, addr, port, client_id, first_req_id=1000):
+        EClient.__init__(self, self)
+
+        # Initialize properties
+        self.orderId = None
+        self.accountsList = None
+        self.req_ids = itertools.count(first_req_id) # reqIds allocated by the router
+        self.pending = {} # reqId : PendingRequest
+        self.pending_lock = Lock()
+
+        self.nextValidId_available = Event() # Initialize an Event object
+
+        # Connect to TWS
+        self.connect(addr, port, client_id)
+
+        # Launch the client thread
+        thread = Thread(target=self.run)
+        thread.start()
+
+    @iswrapper
+    def nextValidId(self, orderId):
+        ''' Provides the next order ID '''
+        self.orderId = orderId
+        self.nextValidId_available.set() #internal flag is set to True
+        log.info('Order Id from nextValidId callback is: %s', orderId)
+
+    @iswrapper
+    def managedAccounts(self, accountsList):
+        ''' Provides the Account Details. Can use to test if we are connected to TWS API '''
+        self.accountsList = accountsList
+
+    # Book keeping of the requests in flight
+    def _start(self, kind, make_result=list, cancel=None):
+        ''' Allocate a reqId and its collector. Returns (reqId, Future) '''
+        with self.pending_lock:
+            req_id = next(self.req_ids)
+            request = PendingRequest(kind, make_result, cancel)
+            self.pending[req_id] = request
+        # A cancelled Future cancels the request at TWS
+        request.future.add_done_callback(lambda f: self._cancelled(req_id, f))
+        return req_id, request.future
+
+    def _cancelled(self, req_id, future):
+        if future.cancelled():
+            with self.pending_lock:
+                request = self.pending.pop(req_id, None)
+            if request is not None and request.cancel is not None:
+                request.cancel(req_id)
+
+    def _collect(self, req_id, item):
+        ''' Add a callback to the collector of its reqId. Callbacks of unknown reqIds are ignored '''
+        request = self.pending.get(req_id)
+        if request is not None:
+            request.items.append(item)
+
+    def _finish(self, req_id):
+        ''' The End callback of a request arrived. Resolve its Future '''
+        with self.pending_lock:
+            request = self.pending.pop(req_id, None)
+        if request is not None and not request.future.done():
+            try:
+                request.future.set_result(request.make_result(request.items))
+            except Exception as e:
+                request.future.set_exception(e)
+        return request
+
+    def _fail(self, req_id, exception):
+        with self.pending_lock:
+            request = self.pending.pop(req_id, None)
+        if request is not None and not request.future.done():
+            request.future.set_exception(exception)
+        return request
+
+    # Requests. Each returns a Future
+    def historical_data(self, contract, end_date_time, duration, bar_size, what_to_show='TRADES', use_rth=1):
+        ''' reqHistoricalData. The Future resolves to a DataFrame of the bars '''
+        req_id, future = self._start('historicalData', bars_to_df, self.cancelHistoricalData)
+        self.reqHistoricalData(req_id, contract, end_date_time, duration, bar_size, what_to_show, use_rth, 1, False, [])
+        return future
+
+    def contract_details(self, contract):
+        ''' reqContractDetails. The Future resolves to a list of ContractDetails '''
+        req_id, future = self._start('contractDetails')
+        self.reqContractDetails(req_id, contract)
+        return future
+
+    def account_summary(self, tags, group='All'):
+        ''' reqAccountSummary. The Future resolves to a list of dicts with keys account, tag, value, currency '''
+        req_id, future = self._start('accountSummary', cancel=self.cancelAccountSummary)
+        self.reqAccountSummary(req_id, group, tags)
+        return future
+
+    # Callbacks
+    @iswrapper
+    def historicalData(self, reqId, bar):
+        ''' Callback to reqHistoricalData '''
+        self._collect(reqId, bar)
+
+    @iswrapper
+    def historicalDataEnd(self, reqId, start, end):
+        ''' Marks the ending of the historical bars reception '''
+        self._finish(reqId)
+
+    @iswrapper
+    def contractDetails(self, reqId, contractDetails):
+        ''' Callback to reqContractDetails '''
+        self._collect(reqId, contractDetails)
+
+    @iswrapper
+    def contractDetailsEnd(self, reqId):
+        ''' After all contracts matching the request were returned, this method will mark the end of their reception '''
+        self._finish(reqId)
+
+    @iswrapper
+    def accountSummary(self, reqId, account, tag, value, currency):
+        ''' Callback to reqAccountSummary '''
+        self._collect(reqId, {'account': account, 'tag': tag, 'value': value, 'currency': currency})
+
+    @iswrapper
+    def accountSummaryEnd(self, reqId):
+        ''' Marks the ending of the account summary. The subscription is cancelled, the summary is sent only once '''
+        if self._finish(reqId) is not None:
+            self.cancelAccountSummary(reqId)
+
+    @iswrapper
+    def connectionClosed(self):
+        ''' The requests in flight will never be answered. Their Futures fail with ConnectionError '''
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+        for req_id, request in pending.items():
+            if not request.future.done():
+                request.future.set_exception(ConnectionError('Connection to TWS closed with {} request {} in flight'.format(request.kind, req_id)))
+        log.error('Connection to TWS closed')
+
+    @iswrapper
+    def error(self, req_id, code, msg):
+        ''' Called if an error occurs. An error for a request in flight fails its Future '''
+        if not is_warning(code) and req_id in self.pending:
+            self._fail(req_id, IBError(req_id, code, msg))
+        else:
+            log.log(error_level(code), 'Error Request Id: %s, Error Code: %s, Error Message: %s', req_id, code, msg)
+
+def main():
+    start_logging() # the callbacks log through a background writer thread
+    # Create the client and connect to TWS
+    client = RequestRouter('127.0.0.1', 7497, 0)
+    client.nextValidId_available.wait() # block thread until internal flag is set to True
+
+    # Send all the requests at once, then collect the results
+    contracts = {}
+    for symbol in ['RELIANCE', 'INFY', 'TCS']:
+        contract = Contract()
+        contract.symbol = symbol
+        contract.secType = 'STK'
+        contract.exchange = 'NSE'
+        contract.currency = 'INR'
+        contracts[symbol] = contract
+
+    start_time = time.time()
+    now = datetime.datetime.now().strftime("%Y%m%d %H:%M:%S")
+    bars = {symbol: client.historical_data(contract, now, '5 D', '5 mins') for symbol, contract in contracts.items()}
+    details = {symbol: client.contract_details(contract) for symbol, contract in contracts.items()}
+    summary = client.account_summary('TotalCashValue, BuyingPower, AvailableFunds')
+    wait(list(bars.values()) + list(details.values()) + [summary], timeout=30)
+
+    for symbol in contracts:
+        try:
+            print('{}: conId {}, {} bars'.format(symbol, details[symbol].result(0)[0].contract.conId, len(bars[symbol].result(0))))
+        except Exception as e:
+            print('{}: {}'.format(symbol, e))
+    try:
+        for item in summary.result(0):
+            print('Account {}: {} '.format(item['tag'], item['value']))
+    except Exception as e:
+        print('Account summary: {}'.format(e))
+    print('All requests done in {:.2f} seconds'.format(time.time() - start_time))
+
+    client.disconnect()
+
+if __name__ == '__main__':
+    main()
@@ -10,82 +10,64 @@ Writes a CSV file with IB Symbol and conID
 """
 
 # Imports for the Program
-from ibapi.client import EClient
-from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract
 from ibapi.utils import iswrapper
 
-import time
-import threading
+import sys, os
+import numpy as np
 import pandas as pd
-import collections
 
-class CreateStockUniverse(EWrapper, EClient):
-    ''' Class that Serves as the Client and the Wrapper '''
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'Handle callback messages')) # for request_router
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'contracts')) # for contract_resolver
+from request_router import RequestRouter
+from callback_logger import get_logger, start_logging
+from contract_resolver import ContractResolver, ContractCache
+
+log = get_logger(__name__)
+
+class CreateStockUniverse(RequestRouter):
+    ''' Class that Serves as the Client and the Wrapper. Every reqContractDetails gets its own reqId '''
 
     def __init__(self, addr, port, client_id):
-        EWrapper.__init__(self)
-        EClient.__init__(self, self)
-        
         # Initialization
-        self.orderId = None
-        self.accountsList = ""
-
         df_scraped_data = pd.read_csv('scraped_data.csv') # Read csv into pandas DataFrame
         self.df_scraped_data = df_scraped_data
-        self.conId_dq = collections.deque() # Store Contract ID in deque
-
-        # Connect to TWS API
-        self.connect(addr, port, client_id)
 
-        # Launch the client thread
-        thread = threading.Thread(target=self.run)
-        thread.start()
+        RequestRouter.__init__(self, addr, port, client_id) # Connect to TWS API and launch the client thread
 
     @iswrapper
     def nextValidId(self, orderId):
         ''' Provides the next order ID '''
         self.orderId = orderId
+        self.nextValidId_available.set() #internal flag is set to True
         # print('\nThe order id is: {}'.format(orderId))
 
     @iswrapper
     def managedAccounts(self, accountsList):
         ''' Provides the Account Details. Needed to test if we are connected to TWS API '''
         self.accountsList = accountsList
-        print ('Type is: {}'.format(type(self.accountsList)))
+        log.debug('Type is: %s', type(self.accountsList))
         # print('\nThe Account Details are: {}'.format(accountsList))
 
-    @iswrapper
-    def contractDetails(self, reqId, details):
-        ''' Callback from '''
-        print('Details from contractDetails Callback follows:')
-        print('Market Name: {}'.format(details.marketName)) # symbol=TATACONSU, marketname=TATACONSUM
-        print('Long Name: {}'.format(details.longName))
-        print('Contract ID: {}'.format(details.contract.conId))
-        # print('Time Zone for the Product: {}'.format(details.timeZoneId))
-        # print(details)
-        self.conId_dq.append(details.contract.conId)
-        
-    @iswrapper
-    def contractDetailsEnd(self, reqId):
-        print ('...The End of Contract Details...for reqId:{} \n'.format(reqId))
-        
-    @iswrapper    
-    def error(self, reqId, code, msg):
-        print('\nError Code: {}'.format(code))
-        print('Error Message: {}'.format(msg))
-        
+def select_conId(ib_symbol, details_list):
+    ''' conId of the NSE stock among the matching contracts. NaN if nothing matched '''
+    if not details_list:
+        print('No contract found for IB Symbol: {}'.format(ib_symbol))
+        return np.nan
+    nse = [d for d in details_list if d['secType'] == 'STK' and d['primaryExchange'] == 'NSE' and d['symbol'] == ib_symbol]
+    if len(details_list) > 1:
+        print('{} contracts found for IB Symbol: {}. Using conId {}'.format(len(details_list), ib_symbol, (nse or details_list)[0]['conId']))
+    return (nse or details_list)[0]['conId']
+
 def main():
-    
+    start_logging() # the callbacks log through a background writer thread
     count = 1
     while count < 10:
         # Create the client and Connect to TWS API
         client = CreateStockUniverse('127.0.0.1', 7497, 7)
-        time.sleep(count)
 
-        # Request from TWS, the next valid ID for the order
-        client.reqIds(1) # In the callback, if we receive an Order Id, then we are connected.
-        time.sleep(count)
+        # TWS sends the next valid ID on connection. If we receive an Order Id, then we are connected.
+        client.nextValidId_available.wait(timeout=2*count) # block thread until internal flag is set to True or timeout
         if client.orderId is None:
             print ('\n   Connection to TWS Not established. No of attempts = {}'.format(count))
             count += 1
@@ -94,30 +76,30 @@ def main():
             print ('   The Order Id is: {}'.format(client.orderId))
             print ('   The Account Details are: {}'.format(client.accountsList))
             break
-    
+
+    contracts = {}
     for ib_symbol in client.df_scraped_data['IB Symbol']:
-        print('IB Symbol from Scraped Data CSV file: {}'.format(ib_symbol))
-        
         contract = Contract ()
         contract.symbol = ib_symbol
         contract.secType = "STK"
         contract.primaryExchange = "NSE"
         contract.currency = "INR"
-    
-        client.reqContractDetails(1, contract)
-        time.sleep(3) #Sleep interval to allow time for connection to server
-        
-    conId_list = list(client.conId_dq)
-    df_conId = pd.DataFrame([conId_list]).transpose()
-    df_conId.columns = ['Contract ID']
-    df_final = client.df_scraped_data.join(df_conId)
+        contracts[ib_symbol] = contract
+
+    # All the symbols are resolved at once, from the cache or with one reqContractDetails per symbol in flight
+    resolver = ContractResolver(client, ContractCache(ttl_days=7))
+    resolved = resolver.resolve(contracts)
+
+    # Join by IB Symbol, not by position. A failed lookup leaves an empty Contract ID for its own symbol only
+    df_final = client.df_scraped_data.copy()
+    df_final['Contract ID'] = [select_conId(ib_symbol, resolved[ib_symbol]) for ib_symbol in df_final['IB Symbol']]
+    df_final['Contract ID'] = df_final['Contract ID'].astype('Int64')
     print ('Length of df_scraped_data: {}'.format(len(client.df_scraped_data)))
-    print ('Length of df_conId: {}'.format(len(df_conId)))
+    print ('Symbols without Contract ID: {}'.format(df_final['Contract ID'].isna().sum()))
     print('Length of df_final: {}'.format(len(df_final)))
     df_final.to_csv('stock_universe_web_scraping'+ '.csv', encoding='utf-8', index=False)
     
     # Disconnect from TWS
-    time.sleep(3)
     client.disconnect()
    
 if __name__ == "__main__":
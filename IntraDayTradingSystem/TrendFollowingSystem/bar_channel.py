@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Publish / subscribe channel for the completed bars of a universe of symbols, on one machine.
+
+The fetcher publishes the bar of every symbol each time a bar closes, as one batch with a sequence
+number. The batches are written into a ring of slots in shared memory, and the sequence number is
+sent as a datagram to every subscribed process on 127.0.0.1. A subscriber blocks on its socket (no
+polling of files or modification times) and reads the batch in place, without copying or parsing:
+
+    publisher = BarPublisher(symbols) # in the fetcher
+    seq = publisher.publish(bar_date, values) # values: symbols x fields (Open, High, Low, Close, Volume)
+    ...
+    subscriber = BarSubscriber() # in a strategy process, by name
+    batch = subscriber.receive(timeout=None) # blocks until the next batch is published
+    batch.seq, batch.date, batch.data # data[symbol, field] is a zero-copy view of the slot
+
+Shared memory layout: a header of 8 int64 words (magic, number of symbols, slots, number of fields,
+last sequence published, UDP port of the publisher, 2 spare), the symbols, then 'slots' slots of
+(sequence, bar date as datetime64[s], symbols x fields float64). Batch seq is in slot seq % slots.
+A slot is overwritten 'slots' batches later: batch.intact() tells whether it still holds the batch.
+A subscriber more than 'slots' batches behind skips the lost ones, counted in subscriber.lost.
+"""
+# Imports used
+from multiprocessing import shared_memory
+from threading import Thread, Lock
+
+from bar_panel import FIELDS, SYMBOL_BYTES, attach_shared_memory
+
+import numpy as np
+import pandas as pd
+
+import socket
+import struct
+import time
+
+DEFAULT_NAME = 'RTD_from_IB_bars'
+MAGIC = 0x4C454E4E41484342 # 'BCHANNEL'
+HEADER = 8 # int64 words: magic, number of symbols, slots, number of fields, last sequence, port, 2 spare
+SUBSCRIBE, UNSUBSCRIBE = b'S', b'U'
+NOTICE = struct.Struct('<q') # the datagram to the subscribers: the sequence number published
+
+class BarRing:
+    ''' The slots of the channel in a named shared memory block. Used by the publisher and the subscribers '''
+
+    def __init__(self, shm):
+        self.shm = shm
+        buf = shm.buf
+        self.header = np.ndarray(HEADER, dtype=np.int64, buffer=buf)
+        if self.header[0] != MAGIC:
+            raise ValueError('Shared memory block {} is not a bar channel'.format(shm.name))
+        n, slots, n_fields = (int(x) for x in self.header[1:4])
+        offset = HEADER * 8
+        self._symbols = np.ndarray(n, dtype='S{}'.format(SYMBOL_BYTES), buffer=buf, offset=offset)
+        offset += n * SYMBOL_BYTES
+        self.slot_seq = np.ndarray(slots, dtype=np.int64, buffer=buf, offset=offset)
+        offset += slots * 8
+        self.slot_date = np.ndarray(slots, dtype=np.int64, buffer=buf, offset=offset) # datetime64[s] as int64
+        offset += slots * 8
+        self.slot_data = np.ndarray((slots, n, n_fields), dtype=np.float64, buffer=buf, offset=offset)
+        self.symbols = [s.decode() for s in self._symbols]
+        self.slots = slots
+
+    @staticmethod
+    def size(n, slots, n_fields=len(FIELDS)):
+        ''' Bytes of the block '''
+        return HEADER * 8 + n * SYMBOL_BYTES + slots * 16 + slots * n * n_fields * 8
+
+    @property
+    def seq(self):
+        ''' The last sequence number published, 0 before the first batch '''
+        return int(self.header[4])
+
+    @property
+    def port(self):
+        return int(self.header[5])
+
+    def release(self):
+        ''' Drop the views and detach '''
+        self.header = self._symbols = self.slot_seq = self.slot_date = self.slot_data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass # a batch still has a view of its slot. The mapping goes when the process exits
+
+class BarBatch:
+    ''' One published batch: the bar of every symbol at date. data is a view of the slot, valid while intact() '''
+    __slots__ = ['ring', 'seq', 'date', 'data']
+
+    def __init__(self, ring, seq):
+        slot = seq % ring.slots
+        self.ring = ring
+        self.seq = seq
+        self.date = ring.slot_date[slot].astype('datetime64[s]')
+        self.data = ring.slot_data[slot]
+
+    def intact(self):
+        ''' True while the publisher has not reused the slot for a later batch '''
+        return int(self.ring.slot_seq[self.seq % self.ring.slots]) == self.seq
+
+    def to_frame(self):
+        ''' A copy as a DataFrame indexed by Symbol with the FIELDS columns '''
+        df = pd.DataFrame(self.data.copy(), index=pd.Index(self.ring.symbols, name='Symbol'), columns=FIELDS)
+        if not self.intact():
+            raise RuntimeError('Batch {} was overwritten while it was read'.format(self.seq))
+        return df
+
+class BarPublisher:
+    ''' Writes the batches into the ring and notifies the subscribers. One publisher per channel name '''
+
+    def __init__(self, symbols, slots=64, name=DEFAULT_NAME):
+        symbols = list(symbols)
+        for symbol in symbols:
+            if len(symbol.encode()) > SYMBOL_BYTES:
+                raise ValueError('Symbol {} is longer than {} bytes'.format(symbol, SYMBOL_BYTES))
+        size = BarRing.size(len(symbols), slots)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError: # left by a publisher which died
+            stale = attach_shared_memory(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        # The subscribers send SUBSCRIBE / UNSUBSCRIBE to this socket, and the notices are sent from it
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        header = np.ndarray(HEADER, dtype=np.int64, buffer=shm.buf)
+        header[:] = [MAGIC, len(symbols), slots, len(FIELDS), 0, self.sock.getsockname()[1], 0, 0]
+        del header
+        self.ring = BarRing(shm)
+        self.ring._symbols[:] = [s.encode() for s in symbols]
+        self.ring.symbols = symbols
+        self.ring.slot_seq[:] = 0
+        self.index = {symbol: i for i, symbol in enumerate(symbols)} # symbol : i
+        self.subscribers = set() # (host, port) of the subscriber sockets
+        self.subscribers_lock = Lock()
+        self.seq = 0 # last sequence published
+        self.closed = False
+
+        # Launch the thread which takes the subscriptions
+        thread = Thread(target=self.run, name='BarPublisher', daemon=True)
+        thread.start()
+
+    def run(self):
+        while not self.closed:
+            try:
+                message, address = self.sock.recvfrom(16) # block thread until a subscriber writes
+            except OSError: # closed, or a notice could not be delivered (Windows reports it here)
+                continue
+            with self.subscribers_lock:
+                if message == SUBSCRIBE:
+                    self.subscribers.add(address)
+                elif message == UNSUBSCRIBE:
+                    self.subscribers.discard(address)
+            if message == SUBSCRIBE:
+                try:
+                    self.sock.sendto(NOTICE.pack(self.seq), address) # the reply, so that the subscriber knows it is registered
+                except OSError:
+                    pass
+
+    def publish(self, date, values):
+        ''' Write the bars of all the symbols at date (symbols x fields, NaN for a symbol without the bar) and notify the subscribers '''
+        ring = self.ring
+        seq = self.seq + 1
+        slot = seq % ring.slots
+        ring.slot_seq[slot] = -1 # being written
+        ring.slot_date[slot] = np.datetime64(pd.Timestamp(date), 's').astype(np.int64)
+        ring.slot_data[slot] = values
+        ring.slot_seq[slot] = seq
+        ring.header[4] = self.seq = seq
+        notice = NOTICE.pack(seq)
+        with self.subscribers_lock:
+            subscribers = list(self.subscribers)
+        for address in subscribers:
+            try:
+                self.sock.sendto(notice, address)
+            except OSError:
+                with self.subscribers_lock:
+                    self.subscribers.discard(address)
+        return seq
+
+    def close(self):
+        ''' Stop taking subscriptions and remove the block. Subscribers which hold it open keep their mapping '''
+        self.closed = True
+        self.sock.close()
+        shm = self.ring.shm
+        self.ring.release()
+        shm.unlink()
+
+class BarSubscriber:
+    ''' Receives the batches of a publisher, in order, from the one after the last published when it subscribed '''
+
+    def __init__(self, name=DEFAULT_NAME, timeout=5.0):
+        self.ring = BarRing(attach_shared_memory(name)) # FileNotFoundError if there is no publisher
+        self.symbols = self.ring.symbols
+        self.publisher = ('127.0.0.1', self.ring.port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.next_seq = self.ring.seq + 1 # before subscribing: a batch published meanwhile is in the ring, notice or not
+        self.sock.sendto(SUBSCRIBE, self.publisher)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.recv(NOTICE.size) # the publisher's reply
+        except socket.timeout:
+            self.close()
+            raise ConnectionError('No reply from the publisher of bar channel {}'.format(name))
+        self.lost = 0 # batches overwritten before they were received
+
+    def receive(self, timeout=None):
+        ''' The next batch. Blocks until it is published, None after timeout seconds '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.ring.seq < self.next_seq:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0: # settimeout(0) would make the socket non blocking
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                self.sock.recv(NOTICE.size) # block thread until a notice arrives. The ring has the sequence
+            except socket.timeout:
+                return None
+        seq = self.next_seq
+        oldest = self.ring.seq - self.ring.slots + 1
+        if seq < oldest:
+            self.lost += oldest - seq
+            seq = oldest
+        self.next_seq = seq + 1
+        return BarBatch(self.ring, seq)
+
+    def close(self):
+        ''' Unsubscribe and detach '''
+        try:
+            self.sock.sendto(UNSUBSCRIBE, self.publisher)
+        except OSError:
+            pass
+        self.sock.close()
+        self.ring.release()
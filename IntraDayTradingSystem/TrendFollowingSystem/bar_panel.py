@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Panel of the 5 minute OHLCV bars of a universe of symbols, in shared memory.
+
+Instead of one <symbol>_Minute.csv per stock in RTD_from_IB, re-read by every consumer, the fetcher
+writes the bars of all the symbols into one block of shared memory, and any number of processes on
+the same machine attach to it by name and read it without copying or parsing:
+
+    data[symbol, bar, field] : float64, fields Open, High, Low, Close, Volume. NaN where a symbol has no bar
+    dates[bar]               : datetime64[s], the start of the bar. The same time grid for every symbol
+
+    panel = BarPanel.create(symbols, capacity=5*75) # in the fetcher. 5 days of 5 minute bars
+    panel.write(symbol, df) # the bars of one symbol, columns ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+    ...
+    panel = BarPanel.attach() # in a consumer, by name
+    dates, data = panel.snapshot() # a consistent copy, never half of a write
+    df = panel.to_frame() # or a DataFrame with a (Symbol, Date) MultiIndex
+
+The time grid holds the last 'capacity' bar dates seen. A write with newer dates shifts out the
+oldest bars of every symbol. Every write increments panel.version twice (odd while it is writing,
+even once done), so a reader can tell whether anything changed and never uses a torn copy.
+"""
+# Imports used
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import time
+
+DEFAULT_NAME = 'RTD_from_IB'
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+OPEN, HIGH, LOW, CLOSE, VOLUME = range(len(FIELDS))
+MAGIC = 0x4C454E4150524142 # 'BARPANEL'
+HEADER = 8 # int64 words: magic, number of symbols, capacity, number of fields, length, version, 2 spare
+SYMBOL_BYTES = 16
+
+def attach_shared_memory(name):
+    ''' Open an existing block without handing it to the resource tracker, which would unlink it when this process exits '''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13 and later
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except (ImportError, AttributeError, KeyError):
+            pass # Windows has no resource tracker. The block lives while a process has it open
+        return shm
+
+class BarPanel:
+    ''' Symbols x bars x fields array of bars in a named shared memory block. One writer, any number of readers '''
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner # the creating process unlinks the block
+        buf = shm.buf
+        self.header = np.ndarray(HEADER, dtype=np.int64, buffer=buf)
+        if self.header[0] != MAGIC:
+            raise ValueError('Shared memory block {} is not a bar panel'.format(shm.name))
+        n, capacity, n_fields = (int(x) for x in self.header[1:4])
+        offset = HEADER * 8
+        self._symbols = np.ndarray(n, dtype='S{}'.format(SYMBOL_BYTES), buffer=buf, offset=offset)
+        offset += n * SYMBOL_BYTES
+        self._dates = np.ndarray(capacity, dtype=np.int64, buffer=buf, offset=offset) # datetime64[s] as int64
+        offset += capacity * 8
+        self._data = np.ndarray((n, capacity, n_fields), dtype=np.float64, buffer=buf, offset=offset)
+        self.symbols = [s.decode() for s in self._symbols]
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)} # symbol : i
+        self.capacity = capacity
+
+    @staticmethod
+    def size(n, capacity, n_fields=len(FIELDS)):
+        ''' Bytes of the block '''
+        return HEADER * 8 + n * SYMBOL_BYTES + capacity * 8 + n * capacity * n_fields * 8
+
+    @classmethod
+    def create(cls, symbols, capacity=5*75, name=DEFAULT_NAME):
+        ''' Create the block for the symbols. A block of the same name left by a process which died is replaced '''
+        symbols = list(symbols)
+        for symbol in symbols:
+            if len(symbol.encode()) > SYMBOL_BYTES:
+                raise ValueError('Symbol {} is longer than {} bytes'.format(symbol, SYMBOL_BYTES))
+        size = cls.size(len(symbols), capacity)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = attach_shared_memory(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray(HEADER, dtype=np.int64, buffer=shm.buf)
+        header[:] = [MAGIC, len(symbols), capacity, len(FIELDS), 0, 0, 0, 0]
+        del header
+        panel = cls(shm, owner=True)
+        panel._symbols[:] = [s.encode() for s in symbols]
+        panel.symbols = symbols
+        panel.index = {symbol: i for i, symbol in enumerate(symbols)}
+        panel._data[:] = np.nan
+        return panel
+
+    @classmethod
+    def attach(cls, name=DEFAULT_NAME):
+        ''' Attach to the block of a writer. FileNotFoundError if there is none '''
+        return cls(attach_shared_memory(name), owner=False)
+
+    @property
+    def length(self):
+        ''' Number of bars in the time grid '''
+        return int(self.header[4])
+
+    @property
+    def version(self):
+        return int(self.header[5])
+
+    @property
+    def dates(self):
+        ''' The time grid, a zero-copy view. A writer may change it while it is read: use snapshot for a consistent copy '''
+        return self._dates[:self.length].view('datetime64[s]')
+
+    @property
+    def data(self):
+        ''' Symbols x bars x fields, a zero-copy view '''
+        return self._data[:, :self.length]
+
+    def snapshot(self, timeout=1.0):
+        ''' Copies of (dates, data) taken while no write was in progress '''
+        deadline = time.monotonic() + timeout
+        while True:
+            version = self.version
+            if version % 2 == 0:
+                n = self.length
+                dates = self._dates[:n].view('datetime64[s]').copy()
+                data = self._data[:, :n].copy()
+                if self.version == version:
+                    return dates, data
+            if time.monotonic() > deadline:
+                raise TimeoutError('Bar panel {} is being written for more than {} seconds'.format(self.shm.name, timeout))
+            time.sleep(0) # let the writer finish
+
+    def write(self, symbol, df):
+        ''' Replace the bars of one symbol with those of df. Bars older than the time grid are dropped '''
+        i = self.index[symbol]
+        dates = pd.to_datetime(df['Date']).values.astype('datetime64[s]').astype(np.int64)
+        values = df[FIELDS].values.astype(np.float64)
+        self.header[5] += 1 # odd: a write is in progress
+        try:
+            n = self.length
+            grid = self._dates[:n]
+            if len(dates) and not np.isin(dates, grid).all():
+                n = self._extend_grid(dates)
+                grid = self._dates[:n]
+            self._data[i, :n] = np.nan
+            keep = np.isin(dates, grid)
+            self._data[i, np.searchsorted(grid, dates[keep])] = values[keep]
+        finally:
+            self.header[5] += 1 # even: done
+
+    def _extend_grid(self, dates):
+        ''' Merge new dates into the time grid, keep the last capacity and move the bars of every symbol to their new place '''
+        n = self.length
+        old_grid = self._dates[:n].copy()
+        new_grid = np.union1d(old_grid, dates)[-self.capacity:]
+        old_data = self._data[:, :n].copy()
+        self._data[:] = np.nan
+        kept = np.isin(old_grid, new_grid)
+        self._data[:, np.searchsorted(new_grid, old_grid[kept])] = old_data[:, kept]
+        self._dates[:len(new_grid)] = new_grid
+        self.header[4] = len(new_grid)
+        return len(new_grid)
+
+    def bar(self, date):
+        ''' Symbols x fields copy of the bar at date, NaN for the symbols which do not have it (or all, if date is not in the grid) '''
+        dates, data = self.snapshot()
+        i = np.searchsorted(dates, np.datetime64(pd.Timestamp(date), 's'))
+        if i < len(dates) and dates[i] == np.datetime64(pd.Timestamp(date), 's'):
+            return data[:, i]
+        return np.full((len(self.symbols), data.shape[2]), np.nan)
+
+    def to_frame(self):
+        ''' DataFrame of a snapshot with a (Symbol, Date) MultiIndex and the FIELDS columns. The bars a symbol does not have are left out '''
+        dates, data = self.snapshot()
+        index = pd.MultiIndex.from_product([self.symbols, dates.astype('datetime64[ns]')], names=['Symbol', 'Date'])
+        df = pd.DataFrame(data.reshape(-1, data.shape[2]), index=index, columns=FIELDS)
+        return df.dropna(subset=['Close'])
+
+    def close(self):
+        ''' Release the views and detach. The creator also removes the block '''
+        self.header = self._symbols = self._dates = self._data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
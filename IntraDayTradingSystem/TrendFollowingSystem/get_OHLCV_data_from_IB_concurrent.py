@@ -0,0 +1,293 @@
+''' Read historical data of all the shortlisted symbols concurrently, store OHLCV in Pandas Dataframe and write to CSV '''
+# Same output as get_OHLCV_data_from_IB_sequential.py, but instead of waiting for historicalDataEnd of one symbol
+# before requesting the next, many reqHistoricalData are kept in flight, each with its own reqId and buffer.
+# A token bucket keeps the request rate within IB's historical data pacing limits.
+
+# Imports used in the program
+from ibapi.client import EClient, Contract
+from ibapi.wrapper import EWrapper
+from ibapi.utils import iswrapper
+
+from threading import Thread, Event, Lock
+
+import pandas as pd
+import queue
+import datetime, time
+import sys, os, shutil
+
+from get_OHLCV_data_from_IB_sequential import prepare_directory, get_shortlisted_symbols
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'pandas and csv')) # for history_store
+from history_store import HistoryStore
+try:
+    from bar_panel import BarPanel # multiprocessing.shared_memory needs Python 3.8 or later
+    from bar_channel import BarPublisher
+except ImportError:
+    BarPanel = BarPublisher = None # Python 3.7: only the csv files are written
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'futures and options', 'NIFTY ORB Trading System')) # for bar_clock
+from bar_clock import BarClock
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, stop_logging
+from request_router import is_warning
+
+log = get_logger(__name__)
+
+class TokenBucket:
+    '''
+    Pacing of requests. Holds up to 'capacity' tokens and refills 'rate' tokens per second.
+    Each request takes one token. IB allows at most 60 historical data requests in any 10 minute
+    period for small bars, i.e. TokenBucket(rate=60/600, capacity=60). Bars of 1 min and more are a soft limit.
+    '''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def try_acquire(self):
+        ''' Take one token if available. Returns True if the request can be sent now '''
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def wait_time(self):
+        ''' Seconds until the next token is available '''
+        with self.lock:
+            self._refill()
+            return max(0.0, (1 - self.tokens) / self.rate)
+
+class ReadOHLCVConcurrent(EWrapper, EClient):
+    ''' Serves as the client and the wrapper '''
+
+    def __init__(self, addr, port, client_id):
+        EClient.__init__(self, self)
+
+        # Initialize properties
+        self.accountsList = None
+        self.orderId = None
+        self.next_req_id = 100 # reqIds of the historical data requests
+        self.symbol_of_req = {} # reqId : symbol of the requests in flight
+        self.candle_buffers = {} # reqId : candle data dictionary of the requests in flight
+        self.completed_queue = queue.Queue() # (reqId, error code or None, error message) when a request ends
+
+        self.nextValidId_available = Event() # Initialize an Event object
+
+        # Connect to TWS
+        self.connect(addr, port, client_id)
+
+        # Launch the client thread
+        thread = Thread(target=self.run)
+        thread.start()
+
+    @iswrapper
+    def nextValidId(self, orderId):
+        ''' Provides the next order ID '''
+        self.orderId = orderId
+        self.nextValidId_available.set() #internal flag is set to True
+        log.info('Order Id from nextValidId callback is: %s', orderId)
+
+    @iswrapper
+    def managedAccounts(self, accountsList):
+        ''' Provides the Account Details. Can use to test if we are connected to TWS API '''
+        self.accountsList = accountsList
+
+    def request_ohlcv(self, symbol, conId, duration, bar_size):
+        ''' Send reqHistoricalData for one symbol with its own reqId and buffer. Does not wait '''
+        contract = Contract()
+        contract.symbol = symbol
+        contract.secType = 'STK'
+        contract.exchange = 'NSE'
+        contract.conId = conId
+        contract.currency = "INR"
+
+        req_id = self.next_req_id
+        self.next_req_id += 1
+        self.candle_buffers[req_id] = {'Date': [], 'Open': [], 'High': [], 'Low': [], 'Close': [], 'Volume': []}
+        self.symbol_of_req[req_id] = symbol
+        now = datetime.datetime.now().strftime("%Y%m%d %H:%M:%S")
+        self.reqHistoricalData(req_id, contract, now, duration, bar_size, 'TRADES', False, 1, False, [])
+        return req_id
+
+    @iswrapper
+    def historicalData(self, req_id, bar):
+        ''' Callback to reqHistoricalData '''
+        candle_dict = self.candle_buffers.get(req_id)
+        if candle_dict is None: # the request has already ended, e.g. with an error
+            return
+        candle_dict['Date'].append(bar.date)
+        candle_dict['Open'].append(bar.open)
+        candle_dict['High'].append(bar.high)
+        candle_dict['Low'].append(bar.low)
+        candle_dict['Close'].append(bar.close)
+        candle_dict['Volume'].append(bar.volume) # whatToShow in reqHistoricalData should be TRADES
+
+    @iswrapper
+    def historicalDataEnd(self, req_id: int, start: str, end: str):
+        '''Marks the ending of the historical bars reception.'''
+        if req_id in self.candle_buffers:
+            self.completed_queue.put((req_id, None, ''))
+
+    @iswrapper
+    def error(self, req_id, code, msg):
+        ''' Called if an error occurs '''
+        if req_id in self.symbol_of_req and not is_warning(code): # A historical data request failed
+            log.error('Error for Symbol: %s, Request Id: %s, Error Code: %s, Error Message: %s', self.symbol_of_req[req_id], req_id, code, msg)
+            self.completed_queue.put((req_id, code, msg))
+        elif req_id in self.symbol_of_req: # A warning, e.g. 2174. The request goes on
+            log.info('Warning for Symbol: %s, Request Id: %s, Code: %s, Message: %s', self.symbol_of_req[req_id], req_id, code, msg)
+        elif code == 2104:
+            log.info('Connections Info - Market data farm connection is OK:hfarm')
+        elif code == 2106:
+            log.info('Connections Info - HMDS data farm connection is OK:hkhmds')
+        elif code == 2158:
+            log.info('Connections Info - Sec-def data farm connection is OK:secdefhk')
+        elif code == 2137:
+            log.info('Request Id: %s, Code: %s, Message: %s', req_id, code, msg)
+        elif code == 502: # Couldn't connect to TWS . Not logged in or Configuratio incorrect
+            log.error('Error Request Id: %s, Error Code: %s, Error Message: %s', req_id, code, msg)
+            self.disconnect()
+            stop_logging() # write the queued records, os._exit skips the exit handlers
+            os._exit(9999999) # This will exit the entire process without any cleanup
+        else:
+            log.error('Error Request Id: %s, Error Code: %s, Error Message: %s', req_id, code, msg)
+
+# Functions used in the program
+def write_to_csv(symbol, candle_dict, history_store, panel=None):
+    ''' Write the OHLCV data of one symbol to temp_data, then copy to RTD_from_IB, and to the bar panel '''
+    df = pd.DataFrame(candle_dict, columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
+    df['Date'] = pd.to_datetime(df['Date']) # Convert to pandas DateTime format
+    df = df[df.Volume != 0] # Drop all entries for which volume traded = 0
+
+    full_path = os.path.realpath(__file__)
+    current_directory = os.path.dirname(full_path)
+    src_directory = current_directory + "\\temp_data\\"
+    dest_directory = current_directory + "\\RTD_from_IB\\"
+    file_name = symbol + '_Minute' + '.csv'
+    src_file = os.path.join(src_directory, file_name)
+    df.to_csv(src_file, encoding='utf-8', index=False)
+    # Copy only after the entire writing is done, so readers of RTD_from_IB never see a half written file
+    dest_file = os.path.join(dest_directory, file_name)
+    shutil.copyfile(src_file, dest_file)
+    history_store.write(symbol, '5 mins', df) # only the current day's partition is rewritten
+    if panel is not None:
+        panel.write(symbol, df)
+
+def fetch_all_symbols(client, symbols_dict, bucket, history_store, panel=None, max_in_flight=50, max_retries=3, request_timeout=60):
+    '''
+    Keep up to max_in_flight reqHistoricalData in flight, paced by the token bucket, until all the symbols are done.
+    Requests which fail with a pacing violation (162 with 'pacing violation' in the message), or have no answer
+    within request_timeout seconds, are sent again. Returns the list of symbols that could not be read
+    '''
+    to_request = [(symbol, 0) for symbol in symbols_dict] # (symbol, number of retries)
+    in_flight = {} # reqId : (symbol, number of retries, time sent)
+    failed = []
+    while to_request or in_flight:
+        # Send as many requests as the pacing and the in flight limit allow
+        while to_request and len(in_flight) < max_in_flight and bucket.try_acquire():
+            symbol, retries = to_request.pop(0)
+            req_id = client.request_ohlcv(symbol, symbols_dict[symbol], '5 D', '5 mins')
+            in_flight[req_id] = (symbol, retries, time.monotonic())
+
+        # Wait for a request to end, for the next token, or until the oldest request expires
+        timeout = bucket.wait_time() if (to_request and len(in_flight) < max_in_flight) else 30
+        if in_flight:
+            oldest = min(sent for _, _, sent in in_flight.values())
+            timeout = min(timeout, oldest + request_timeout - time.monotonic())
+        try:
+            req_id, error_code, error_msg = client.completed_queue.get(timeout=max(timeout, 0.01))
+        except queue.Empty:
+            req_id = None
+
+        # Give up on the requests without an answer, e.g. after a dropped data farm connection
+        now = time.monotonic()
+        for expired_id in [r for r, (_, _, sent) in in_flight.items() if now - sent > request_timeout]:
+            expired_symbol, expired_retries, _ = in_flight.pop(expired_id)
+            client.cancelHistoricalData(expired_id)
+            client.candle_buffers.pop(expired_id, None)
+            client.symbol_of_req.pop(expired_id, None)
+            log.warning('No answer for Symbol: %s, Request Id: %s in %s seconds. Cancelled', expired_symbol, expired_id, request_timeout)
+            if expired_retries < max_retries:
+                to_request.append((expired_symbol, expired_retries + 1))
+            else:
+                failed.append(expired_symbol)
+
+        if req_id not in in_flight: # Nothing ended, or a late error for a request that has already ended
+            continue
+        symbol, retries, _ = in_flight.pop(req_id)
+        candle_dict = client.candle_buffers.pop(req_id)
+        client.symbol_of_req.pop(req_id)
+
+        if error_code is None:
+            write_to_csv(symbol, candle_dict, history_store, panel)
+        elif error_code == 162 and 'pacing violation' in error_msg.lower() and retries < max_retries: # Send again later. 162 is also 'HMDS query returned no data'
+            to_request.append((symbol, retries + 1))
+        else:
+            failed.append(symbol)
+    return failed
+
+def main():
+
+    market_close_time = datetime.time(15,30)
+    interval_minutes = 5
+
+    pgm_start_time = datetime.time(9,21) # Start the program Only after 9:21
+    print ("Program Start Time is: {}. Is the TWS / IB Gateway program Running?".format(pgm_start_time))
+    while datetime.datetime.now().time() <= pgm_start_time:
+        time.sleep(10)
+
+    prepare_directory() # Call function to prepare directory
+    symbols_dict = get_shortlisted_symbols() # call function to get list of all symbols
+
+    # Create the client and connect to TWS. The callbacks log through a background writer thread
+    start_logging()
+    client = ReadOHLCVConcurrent('127.0.0.1', 7497, 7)
+    client.nextValidId_available.wait() # block thread until internal flag is set to True
+    history_store = HistoryStore() # columnar on-disk store shared by the programs in this repository
+    panel = publisher = None
+    if BarPanel is not None:
+        panel = BarPanel.create(symbols_dict) # the bars of all the symbols in shared memory, for panel_scan.py and other readers
+        publisher = BarPublisher(symbols_dict) # notifies the subscribed processes of every completed bar
+
+    # 5 minute bars are a soft pacing limit. Allow a burst of the whole universe, then about 1 request per second
+    bucket = TokenBucket(rate=1.0, capacity=len(symbols_dict))
+
+    print ('\n   Good to Go Baba. We are Connected to TWS for Retreiving OHLCV Data')
+    print ('   The Order Id is: {}'.format(client.orderId))
+    print ('   The Account Details are: {}\n'.format(client.accountsList))
+
+    clock = BarClock(interval_minutes) # wakes up on the 5 minute bar closes, in exchange time
+    while ((datetime.datetime.now().time() <= market_close_time)):
+        bar_close = clock.wait_for_bar_close() # block until the bar closes
+        if bar_close.time() <= market_close_time:
+            print('\nBar closed at: {}. Woke up {:.1f} ms after the bar close'.format(bar_close, clock.jitter_ms[-1]))
+            loop_start_time = time.time()
+
+            failed = fetch_all_symbols(client, symbols_dict, bucket, history_store, panel)
+            print('Read {} symbols in {:.2f} seconds. Failed symbols: {}'.format(len(symbols_dict) - len(failed), time.time() - loop_start_time, failed))
+
+            # Publish the bar which just closed, of all the symbols, to the subscribers
+            if publisher is not None:
+                bar_start = bar_close - datetime.timedelta(minutes=interval_minutes)
+                seq = publisher.publish(bar_start, panel.bar(bar_start))
+                print('Published the {} bars as batch {} to {} subscribers'.format(bar_start.time(), seq, len(publisher.subscribers)))
+
+    # # If time is > than 3:30 , then exit.
+    if (datetime.datetime.now().time() >= market_close_time):
+        print('Going to Disconnect from TWS')
+        client.disconnect()
+    if publisher is not None:
+        publisher.close()
+        panel.close()
+
+if __name__ == '__main__':
+    main()
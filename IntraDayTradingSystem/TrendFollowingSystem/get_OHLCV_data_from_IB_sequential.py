@@ -14,6 +14,20 @@ import datetime, time
 import sys, os, glob, shutil
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'pandas and csv')) # for history_store
+from history_store import HistoryStore
+try:
+    from bar_panel import BarPanel # multiprocessing.shared_memory needs Python 3.8 or later
+    from bar_channel import BarPublisher
+except ImportError:
+    BarPanel = BarPublisher = None # Python 3.7: only the csv files are written
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'futures and options', 'NIFTY ORB Trading System')) # for bar_clock
+from bar_clock import BarClock
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, stop_logging
+
+log = get_logger(__name__)
+
 class ReadOHLCV(EWrapper, EClient):
     ''' Serves as the client and the wrapper '''
 
@@ -41,7 +55,7 @@ class ReadOHLCV(EWrapper, EClient):
         ''' Provides the next order ID '''
         self.orderId = orderId
         self.nextValidId_available.set() #internal flag is set to True
-        print('Order Id from nextValidId callback is: {}'.format(orderId))
+        log.info('Order Id from nextValidId callback is: %s', orderId)
 
     @iswrapper
     def managedAccounts(self, accountsList):
@@ -69,20 +83,21 @@ class ReadOHLCV(EWrapper, EClient):
     def error(self, req_id, code, msg):
         ''' Called if an error occurs '''
         if code == 2104:
-            print('Connections Info - Market data farm connection is OK:hfarm')
+            log.info('Connections Info - Market data farm connection is OK:hfarm')
         elif code == 2106:
-            print('Connections Info - HMDS data farm connection is OK:hkhmds')
+            log.info('Connections Info - HMDS data farm connection is OK:hkhmds')
         elif code == 2158:
-            print('Connections Info - Sec-def data farm connection is OK:secdefhk')
+            log.info('Connections Info - Sec-def data farm connection is OK:secdefhk')
         elif code == 2137:
-            print('Request Id: {}, Code: {}, Message: {}'.format(req_id, code, msg))
+            log.info('Request Id: %s, Code: %s, Message: %s', req_id, code, msg)
         elif code == 502: # Couldn't connect to TWS . Not logged in or Configuratio incorrect
-            print('Error Request Id: {}, Error Code: {}, Error Message: {}'.format(req_id, code, msg))
+            log.error('Error Request Id: %s, Error Code: %s, Error Message: %s', req_id, code, msg)
             self.disconnect()
+            stop_logging() # write the queued records, os._exit skips the exit handlers
             os._exit(9999999) # This will exit the entire process without any cleanup
             # https://stackoverflow.com/questions/905189/why-does-sys-exit-not-exit-when-called-inside-a-thread-in-python
         else:
-            print('Error Request Id: {}, Error Code: {}, Error Message: {}'.format(req_id, code, msg))
+            log.error('Error Request Id: %s, Error Code: %s, Error Message: %s', req_id, code, msg)
 
 # Functions used in the program
 def prepare_directory():
@@ -142,8 +157,14 @@ def main():
     prepare_directory() # Call function to prepare directory
     symbols_dict = get_shortlisted_symbols() # call function to get list of all symbols
 
-    # Create the client and connect to TWS
+    # Create the client and connect to TWS. The callbacks log through a background writer thread
+    start_logging()
     client = ReadOHLCV('127.0.0.1', 7497, 7)
+    history_store = HistoryStore() # columnar on-disk store shared by the programs in this repository
+    panel = publisher = None
+    if BarPanel is not None:
+        panel = BarPanel.create(symbols_dict) # the bars of all the symbols in shared memory, for panel_scan.py and other readers
+        publisher = BarPublisher(symbols_dict) # notifies the subscribed processes of every completed bar
     client.nextValidId_available.wait() # block thread until internal flag is set to True
 
     print ('\n   Good to Go Baba. We are Connected to TWS for Retreiving OHLCV Data')
@@ -152,11 +173,11 @@ def main():
 
     # Write the OHLCV data for symbols to csv file
     # write_to_csv(client,symbols_dict)
+    clock = BarClock(interval_minutes) # wakes up on the 5 minute bar closes, in exchange time
     while ((datetime.datetime.now().time() <= market_close_time)):
-        if ((datetime.datetime.now().minute % interval_minutes == 0) and (datetime.datetime.now().second == 0)):
-            print('\nStarting loop_start_time')
-            print ("datetime minute: {}, datetime second: {}".format(datetime.datetime.now().minute, datetime.datetime.now().second))
-            loop_start_time = time.time() # use this for calculation of Sleep Time
+        bar_close = clock.wait_for_bar_close() # block until the bar closes
+        if bar_close.time() <= market_close_time:
+            print('\nBar closed at: {}. Woke up {:.1f} ms after the bar close'.format(bar_close, clock.jitter_ms[-1]))
 
             for symbol in symbols_dict:
 
@@ -200,16 +221,17 @@ def main():
                 # after the entire writing is done (and NOT while the writing is being done).
                 dest_file = os.path.join(dest_directory, file_name)
                 shutil.copyfile(src_file, dest_file)
+                history_store.write(symbol, '5 mins', df) # only the current day's partition is rewritten
+                if panel is not None:
+                    panel.write(symbol, df)
 
                 client.candle_dict.clear()
 
-            sleep_time = (interval_minutes*60) - (time.time() - loop_start_time) - 60 # incase the first run is at 09:15:28
-            if sleep_time > 0:
-                pass
-            else:
-                sleep_time = 1
-            print('.....Grrr..... Going to Sleep Mode for: {} seconds starting: {}'.format(sleep_time, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-            time.sleep(sleep_time)
+            # Publish the bar which just closed, of all the symbols, to the subscribers
+            if publisher is not None:
+                bar_start = bar_close - datetime.timedelta(minutes=interval_minutes)
+                seq = publisher.publish(bar_start, panel.bar(bar_start))
+                print('Published the {} bars as batch {} to {} subscribers'.format(bar_start.time(), seq, len(publisher.subscribers)))
 
     # # If time is > than 3:30 , then exit.
     if (datetime.datetime.now().time() >= market_close_time):
@@ -217,6 +239,9 @@ def main():
         print('Going to Disconnect from TWS')
         time.sleep(3)
         client.disconnect()
+    if publisher is not None:
+        publisher.close()
+        panel.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Scan of the whole universe in the bar panel, in one batched NumPy pass.
+
+ATR, SuperTrend and the Open Range Breakout of every symbol are computed on the symbols x bars
+arrays of the panel (bar_panel.py): the candles are walked once, and each step updates all the
+symbols together as one vector. A bar a symbol does not have (NaN) is skipped for that symbol, so
+its values are the same as ATR() / SuperTrend() of tech_indicators.py over the bars of that symbol.
+
+    panel = BarPanel.attach()
+    df_scan = scan(panel) # one row per symbol, ranked by the breakout beyond the Open Range, in ATRs
+
+Columns of the scan: Date and Close of the last bar, ATR, SuperTrend value and direction ('up' /
+'down' / 'nan', as STX), the Open Range High / Low of the day of the last bar (first candle +/- 0.1
+percent), ORB ('long', 'short' or ''), and Score, the distance of the Close beyond the Open Range in
+ATRs (negative inside the range).
+
+Usage :
+    python panel_scan.py [panel name]
+
+attaches to the panel written by get_OHLCV_data_from_IB_sequential.py / _concurrent.py, subscribes
+to their bar channel (bar_channel.py) and prints the ranking each time the fetcher publishes the
+bars of a 5 minute bar close. Nothing is polled: the process sleeps on the channel's socket.
+"""
+# Imports used in the program
+from bar_panel import BarPanel, DEFAULT_NAME, HIGH, LOW, CLOSE
+from bar_channel import BarSubscriber
+
+import numpy as np
+import pandas as pd
+import datetime
+import time
+import sys
+
+def atr_panel(high, low, close, period=14):
+    '''
+    ATR of every symbol, symbols x bars arrays in. Same values as ATR() over the bars of each symbol:
+    Wilder smoothing of the True Range seeded with the mean of the first 'period', 0 before that. NaN where there is no bar
+    '''
+    high, low, close = bars_major(high, low, close)
+    valid = ~np.isnan(close)
+    prev_close = pd.DataFrame(close).ffill().shift().values # Close of the previous bar of each symbol
+    tr = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close))) # the first bar has no previous Close: h - l
+    tr[~valid] = np.nan
+
+    # Wilder smoothing of every column at once. ignore_na skips the bars a symbol does not have
+    count = np.cumsum(valid, axis=0) # bars seen per symbol
+    seeded = valid & (count == period)
+    smoothed = np.where(valid & (count > period), tr, np.nan)
+    smoothed[seeded] = (np.nancumsum(tr, axis=0) / period)[seeded]
+    atr = pd.DataFrame(smoothed).ewm(alpha=1 / period, adjust=False, ignore_na=True).mean().values
+    atr[count < period] = 0.00
+    atr[~valid] = np.nan
+    return atr.T, tr.T
+
+def supertrend_panel(high, low, close, atr, period=14, multiplier=2):
+    '''
+    SuperTrend of every symbol, symbols x bars arrays in, as SuperTrendArray over the bars of each symbol.
+    Returns the SuperTrend value (0 before it has one, NaN where there is no bar) and its direction (1 up, -1 down, 0 nan)
+    '''
+    high, low, close, atr = bars_major(high, low, close, atr)
+    n_bars, n = close.shape
+    st = np.full((n_bars, n), np.nan)
+    count = np.zeros(n, dtype=np.int64)
+    prev_close = np.full(n, np.nan)
+    final_ub, final_lb, value = np.zeros(n), np.zeros(n), np.zeros(n)
+    hl2 = (high + low) / 2
+    basic_ub = hl2 + multiplier * atr # the basic bands of all the candles in one step
+    basic_lb = hl2 - multiplier * atr
+    for t in range(n_bars):
+        c = close[t]
+        valid = c == c # not NaN
+        count += valid
+        step = valid & (count > period) # the same candles as range(period, len(df)) in SuperTrendArray
+        if step.any():
+            ub = np.where((basic_ub[t] < final_ub) | (prev_close > final_ub), basic_ub[t], final_ub)
+            lb = np.where((basic_lb[t] > final_lb) | (prev_close < final_lb), basic_lb[t], final_lb)
+            new_value = np.where(value == final_ub, np.where(c <= ub, ub, lb), np.where(value == final_lb, np.where(c >= lb, lb, ub), 0.00))
+            np.copyto(value, new_value, where=step)
+            np.copyto(final_ub, ub, where=step)
+            np.copyto(final_lb, lb, where=step)
+        st[t] = value
+        np.copyto(prev_close, c, where=valid)
+    st[np.isnan(close)] = np.nan
+    direction = np.where(st > 0.00, np.where(close < st, -1, 1), 0).astype(np.int8)
+    return st.T, direction.T
+
+def bars_major(*arrays):
+    ''' Bars x symbols copies of symbols x bars arrays, so that a step over the symbols of one bar reads contiguous memory '''
+    return [np.ascontiguousarray(np.asarray(arr, dtype=np.float64).T) for arr in arrays]
+
+def last_valid(arr, valid):
+    ''' Value of each row at its last valid column, NaN for a row without one '''
+    last = arr.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    return np.where(valid.any(axis=1), arr[np.arange(arr.shape[0]), last], np.nan), last
+
+def open_range(dates, high, low, close, or_buffer=0.001):
+    ''' Open Range High / Low of every symbol: its first candle of the day of the last bar in the panel, +/- or_buffer '''
+    days = dates.astype('datetime64[D]')
+    today = days == days[-1] if len(days) else np.zeros(0, dtype=bool)
+    valid = ~np.isnan(close) & today
+    first = np.argmax(valid, axis=1)
+    has_bar = valid.any(axis=1)
+    rows = np.arange(close.shape[0])
+    or_high = np.where(has_bar, high[rows, first] * (1 + or_buffer), np.nan)
+    or_low = np.where(has_bar, low[rows, first] * (1 - or_buffer), np.nan)
+    return or_high, or_low
+
+def scan(panel, atr_period=14, st_period=14, st_multiplier=2, or_buffer=0.001, snapshot=None):
+    ''' One row per symbol with its last bar, ATR, SuperTrend and ORB flags, ranked by Score '''
+    dates, data = snapshot if snapshot is not None else panel.snapshot()
+    high, low, close = data[:, :, HIGH], data[:, :, LOW], data[:, :, CLOSE]
+    atr, _ = atr_panel(high, low, close, atr_period)
+    if st_period != atr_period:
+        st_atr, _ = atr_panel(high, low, close, st_period)
+    else:
+        st_atr = atr
+    st, direction = supertrend_panel(high, low, close, st_atr, st_period, st_multiplier)
+    or_high, or_low = open_range(dates, high, low, close, or_buffer)
+
+    valid = ~np.isnan(close)
+    last_close, last = last_valid(close, valid)
+    last_atr, _ = last_valid(atr, valid)
+    last_st, _ = last_valid(st, valid)
+    last_direction = direction[np.arange(len(last)), last]
+    long_orb = last_close > or_high
+    short_orb = last_close < or_low
+    score = np.fmax(last_close - or_high, or_low - last_close) / last_atr
+
+    df = pd.DataFrame({
+        'Date': np.where(valid.any(axis=1), dates[last] if len(dates) else np.datetime64('NaT'), np.datetime64('NaT')).astype('datetime64[ns]'),
+        'Close': last_close, 'ATR': last_atr, 'SuperTrend': last_st,
+        'STX': np.select([last_direction == 1, last_direction == -1], ['up', 'down'], 'nan'),
+        'OR_High': or_high, 'OR_Low': or_low,
+        'ORB': np.select([long_orb, short_orb], ['long', 'short'], ''),
+        'Score': score}, index=pd.Index(panel.symbols, name='Symbol'))
+    return df.sort_values('Score', ascending=False)
+
+def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_NAME
+    market_close_time = datetime.time(15,30)
+    try:
+        panel = BarPanel.attach(name)
+        subscriber = BarSubscriber()
+    except (FileNotFoundError, ConnectionError):
+        print('No bar panel {} or bar channel. Is get_OHLCV_data_from_IB_sequential.py / _concurrent.py running?'.format(name))
+        return
+
+    pd.set_option('display.width', 200)
+    df_scan = scan(panel) # the bars written so far
+    print(df_scan.head(20))
+    while ((datetime.datetime.now().time() <= market_close_time)):
+        batch = subscriber.receive(timeout=60) # block thread until the fetcher publishes the next bar close
+        if batch is None:
+            continue
+        t0 = time.perf_counter()
+        df_scan = scan(panel)
+        print('\nBatch {}, bars of {}. Scan of {} symbols, {} bars, in {:.1f} ms'.format(batch.seq, batch.date, len(panel.symbols), panel.length, (time.perf_counter() - t0) * 1000))
+        if subscriber.lost:
+            print('{} batches were overwritten before they were read'.format(subscriber.lost))
+        print(df_scan.head(20))
+    subscriber.close()
+    panel.close()
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,13 @@ from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract
 from ibapi.utils import iswrapper
 
-import time
 import threading
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, error_level
+
+log = get_logger(__name__)
 
 class TestContract(EWrapper, EClient):
     ''' Serves as the Client and the Wrapper '''
@@ -13,6 +18,11 @@ class TestContract(EWrapper, EClient):
     def __init__(self, addr, port, client_id):
         EWrapper.__init__(self)
         EClient.__init__(self, self)
+        self.symbol = None
+
+        self.nextValidId_available = threading.Event() # Initialize an Event object
+        self.symbolSamples_available = threading.Event() # Initialize an Event object
+        self.contractDetailsEnd_available = threading.Event() # Initialize an Event object
 
         # Connect to TWS API
         self.connect(addr, port, client_id)
@@ -20,51 +30,59 @@ class TestContract(EWrapper, EClient):
         # Launch the client thread
         thread = threading.Thread(target=self.run)
         thread.start()
+
+    @iswrapper
+    def nextValidId(self, orderId):
+        ''' Sent by TWS on connection '''
+        self.nextValidId_available.set() #internal flag is set to True
         
     @iswrapper
     def symbolSamples(self, reqId, contractDescriptions):
         # Print the symbols in the returned results
-        print ('...')
-        print('Number of Contract descriptions in List: {}'.format(len(contractDescriptions)))
+        log.info('Number of Contract descriptions in List: %s', len(contractDescriptions))
         for contractDescription in contractDescriptions:
-            print('Symbol: {}'.format(contractDescription.contract.symbol))
-            print('Contract ID: {}'.format(contractDescription.contract.conId))
-            print('Contract Security Type: {}'.format(contractDescription.contract.secType))
-            print('Contract Primary Exchange: {}'.format(contractDescription.contract.primaryExchange))
-            print('Contract Currency: {}'.format(contractDescription.contract.currency))
+            c = contractDescription.contract
+            log.info('Symbol: %s, Contract ID: %s, Contract Security Type: %s, Contract Primary Exchange: %s, Contract Currency: %s',
+                     c.symbol, c.conId, c.secType, c.primaryExchange, c.currency)
 
         # Select the first symbol
-        self.symbol = contractDescriptions[0].contract.symbol
+        if contractDescriptions:
+            self.symbol = contractDescriptions[0].contract.symbol
+        self.symbolSamples_available.set() #internal flag is set to True
 
     @iswrapper
     def contractDetails(self, reqId, details):
-        print('\nDetails of first symbol follows:')
-        print('Market Name: {}'.format(details.marketName))
-        print('Long Name: {}'.format(details.longName))
-        print('Industry Classification: {}'.format(details.industry))
-        print('Industry Category: {}'.format(details.category))
-        print('Subcategory: {}'.format(details.subcategory))
-        print('Contract ID: {}'.format(details.contract.conId))
-        print('Time Zone for the Product: {}'.format(details.timeZoneId))
-        print('Trading Hours of the Product: {}'.format(details.tradingHours))
-        print('\nFull Contract Details, Unformatted:', reqId, " ", details)
+        log.info('Details of first symbol follows:\nMarket Name: %s\nLong Name: %s\nIndustry Classification: %s\nIndustry Category: %s\n'
+                 'Subcategory: %s\nContract ID: %s\nTime Zone for the Product: %s\nTrading Hours of the Product: %s',
+                 details.marketName, details.longName, details.industry, details.category, details.subcategory,
+                 details.contract.conId, details.timeZoneId, details.tradingHours)
+        log.debug('Full Contract Details, Unformatted: %s %s', reqId, details)
         
     @iswrapper
     def contractDetailsEnd(self, reqId):
-        print ('...The End of Contract Details...for reqId:{} '.format(reqId))
+        log.info('...The End of Contract Details...for reqId: %s', reqId)
+        self.contractDetailsEnd_available.set() #internal flag is set to True
 
     def error(self, reqId, code, msg):
-        print('Error Code: {}'.format(code))
-        print('Error Message: {}'.format(msg))
+        log.log(error_level(code), 'Error Code: %s, Error Message: %s', code, msg)
+        if reqId == 0: # reqMatchingSymbols failed
+            self.symbolSamples_available.set() #internal flag is set to True
+        elif reqId == 1: # No security definition has been found. There will be no contractDetailsEnd
+            self.contractDetailsEnd_available.set() #internal flag is set to True
 
 def main():
-    # Create the client and connect to TWS API
+    # Create the client and connect to TWS API. The callbacks log through a background writer thread
+    start_logging()
     client = TestContract('127.0.0.1', 7497, 700)
-    time.sleep(3)
+    client.nextValidId_available.wait(timeout=10) # block thread until we are connected to TWS
 
     # Request descriptions of contract starting with "goog"
     client.reqMatchingSymbols(0, 'goog')
-    time.sleep(3)
+    client.symbolSamples_available.wait(timeout=10) # block thread until symbolSamples
+    if client.symbol is None:
+        print('No matching symbols received')
+        client.disconnect()
+        return
 
     # Request details for the Stock
     contract = Contract ()
@@ -74,8 +92,8 @@ def main():
     contract.currency = "USD"
 
     client.reqContractDetails(1, contract)
-    
-    time.sleep(3)
+    client.contractDetailsEnd_available.wait(timeout=10) # block thread until contractDetailsEnd
+
     client.disconnect()
    
 if __name__ == "__main__":
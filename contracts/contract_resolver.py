@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Batched contract resolution with a persistent cache of ContractDetails.
+
+Resolving a universe of symbols one reqContractDetails at a time (same reqId, wait, next) is slow
+and joins the results back by position. The ContractResolver sends many reqContractDetails at once,
+each under its own reqId (through the RequestRouter in 'Handle callback messages/request_router.py'),
+and maps every answer back to the key of its request.
+
+The details (conId, localSymbol, multiplier, tradingHours, timeZoneId, ...) are kept in a local
+SQLite cache with a time to live, so a daily run mostly hits the cache instead of TWS:
+
+    resolver = ContractResolver(client, ContractCache(ttl_days=7))
+    details = resolver.resolve({'INFY': contract_infy, 'TCS': contract_tcs})
+    details['INFY'] # list of dicts, one per matching contract. Empty if nothing matched
+"""
+# Imports used
+import os
+import time
+import sqlite3
+
+from concurrent.futures import wait
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'contract_cache.sqlite')
+
+FIELDS = ['conId', 'symbol', 'localSymbol', 'secType', 'exchange', 'primaryExchange', 'currency',
+          'multiplier', 'tradingClass', 'longName', 'marketName', 'minTick', 'tradingHours', 'liquidHours', 'timeZoneId']
+
+def contract_key(contract):
+    ''' Cache key of a contract request, e.g. 'STK:INFY::NSE:INR'. The conId alone if it is set '''
+    if contract.conId:
+        return 'CONID:{}'.format(contract.conId)
+    return ':'.join(str(x) for x in [contract.secType, contract.symbol, contract.lastTradeDateOrContractMonth,
+                                     contract.primaryExchange or contract.exchange, contract.currency])
+
+def details_to_dict(details):
+    ''' The fields of a ContractDetails which are kept in the cache '''
+    c = details.contract
+    return {'conId': c.conId, 'symbol': c.symbol, 'localSymbol': c.localSymbol, 'secType': c.secType,
+            'exchange': c.exchange, 'primaryExchange': c.primaryExchange, 'currency': c.currency,
+            'multiplier': c.multiplier, 'tradingClass': c.tradingClass, 'longName': details.longName,
+            'marketName': details.marketName, 'minTick': details.minTick, 'tradingHours': details.tradingHours,
+            'liquidHours': details.liquidHours, 'timeZoneId': details.timeZoneId}
+
+class ContractCache:
+    ''' SQLite table of ContractDetails per request key, indexed by key and by conId. Entries older than ttl_days are stale '''
+
+    def __init__(self, path=DEFAULT_PATH, ttl_days=7):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS contract_details (key TEXT NOT NULL, fetched_at REAL NOT NULL, {}, '
+                          'PRIMARY KEY (key, conId))'.format(', '.join(FIELDS)))
+        self.conn.execute('CREATE INDEX IF NOT EXISTS contract_details_conId ON contract_details (conId)')
+        self.conn.commit()
+
+    def get(self, key):
+        ''' List of cached details of the key, or None if the key is not cached or is stale '''
+        rows = self.conn.execute('SELECT fetched_at, {} FROM contract_details WHERE key = ?'.format(', '.join(FIELDS)), (key,)).fetchall()
+        if not rows or time.time() - min(row[0] for row in rows) > self.ttl:
+            return None
+        return [dict(zip(FIELDS, row[1:])) for row in rows]
+
+    def get_by_conId(self, conId):
+        ''' Cached details of a conId (whatever its age), or None '''
+        row = self.conn.execute('SELECT {} FROM contract_details WHERE conId = ?'.format(', '.join(FIELDS)), (conId,)).fetchone()
+        return dict(zip(FIELDS, row)) if row else None
+
+    def put(self, key, details_list):
+        ''' Replace the cached details of the key '''
+        fetched_at = time.time()
+        with self.conn:
+            self.conn.execute('DELETE FROM contract_details WHERE key = ?', (key,))
+            self.conn.executemany('INSERT INTO contract_details VALUES (?, ?, {})'.format(', '.join('?' * len(FIELDS))),
+                                  [[key, fetched_at] + [d[f] for f in FIELDS] for d in details_list])
+
+    def close(self):
+        self.conn.close()
+
+class ContractResolver:
+    ''' Resolve many contracts at once. client is a RequestRouter (its contract_details returns a Future) '''
+
+    def __init__(self, client, cache=None):
+        self.client = client
+        self.cache = cache if cache is not None else ContractCache()
+
+    def resolve(self, contracts, max_in_flight=50, timeout=30):
+        '''
+        contracts is a dict of name : Contract. Returns a dict of name : list of details dicts (one per matching
+        contract, empty if none matched), or None if TWS did not answer within the timeout.
+        Fresh cache entries are used, the rest is requested from TWS with up to max_in_flight requests in flight.
+        '''
+        results = {}
+        to_request = []
+        for name, contract in contracts.items():
+            cached = self.cache.get(contract_key(contract))
+            if cached is not None:
+                results[name] = cached
+            else:
+                to_request.append(name)
+        print('Contracts from cache: {}, to request from TWS: {}'.format(len(results), len(to_request)))
+
+        for i in range(0, len(to_request), max_in_flight):
+            batch = {name: self.client.contract_details(contracts[name]) for name in to_request[i:i + max_in_flight]}
+            wait(list(batch.values()), timeout=timeout)
+            for name, future in batch.items():
+                if not future.done():
+                    future.cancel()
+                    results[name] = None
+                    continue
+                try:
+                    details_list = [details_to_dict(d) for d in future.result()]
+                except Exception as e: # e.g. 200, No security definition has been found
+                    print('{}: {}'.format(name, e))
+                    details_list = []
+                if details_list:
+                    self.cache.put(contract_key(contracts[name]), details_list)
+                results[name] = details_list
+        return results
@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""
+Portfolio ORB: the rules of nifty_ORB_main_pgm.py over a universe of stock futures at once.
+
+The universe is a CSV file with an 'IB Symbol' and a 'Lot Size' column, e.g. the N100L15 stocks of
+IntraDayTradingSystem/TrendFollowingSystem/N100L15_Symbols.csv with their lot sizes added. For every symbol:
+
+    the front month future is found with a CONTFUT reqContractDetails
+    its daily candles come from the history store. Only the days not yet stored are requested
+    its 5 minute candles come from a keepUpToDate reqHistoricalData, backfilled once
+
+The requests of all the instruments are sent at once and waited on together, not one round trip
+per instrument. At each 5 minute bar close the candles which just closed are gathered into arrays and
+ORBEngine (orb_engine.py) evaluates the entries and exits of all the instruments in one pass. The
+orders of all the entries (a Market order with its Stop) are transmitted before any fill is waited on.
+The positions are then read back from TWS, so a Stop filled at IB flattens the instrument in the engine.
+
+The quantity of an instrument is its 'Lot Size' in the universe file. The program does not start
+without the lot size of every symbol: the multiplier of a future is not its lot size.
+
+Usage :
+    python ORB_portfolio_main_pgm.py [universe_csv_file]
+"""
+# Imports used In the program
+from nifty_ORB_main_class import NiftyORB
+from nifty_ORB_main_pgm import request_positions
+from orb_engine import ORBEngine, LONG
+from order_tracker import FILLED
+from bar_store import BarStore
+from bar_clock import BarClock
+from historical_cache import duration_str
+from callback_logger import get_logger, start_logging, error_level
+from tech_indicators import ATR
+
+from ibapi.client import Contract
+from ibapi.order import Order
+from ibapi.utils import iswrapper
+
+from concurrent.futures import TimeoutError
+from threading import Event, Lock
+
+import numpy as np
+import pandas as pd
+import datetime
+import time
+import sys
+import os
+
+# reqId = base + index of the instrument. Far above the order IDs, which share the error callback with the reqIds
+CONTRACT_REQ, DAILY_REQ, MINUTE_REQ = 1000000000, 1100000000, 1200000000
+log = get_logger(__name__)
+
+UNIVERSE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'IntraDayTradingSystem', 'TrendFollowingSystem', 'N100L15_Symbols.csv')
+
+class ORBPortfolio(NiftyORB):
+    ''' NiftyORB with the contracts and bar stores of many instruments, told apart by the reqId '''
+
+    def __init__(self, addr, port, client_id):
+        # Set before NiftyORB.__init__ connects, as the callbacks use them
+        self.futures = {} # CONTRACT_REQ reqId : the future returned by contractDetails
+        self.local_symbols = [] # localSymbol of the future of each instrument, the key of its bars in the history store
+        self.bar_stores = {} # DAILY_REQ / MINUTE_REQ reqId : BarStore, allocated before the request
+        self.pending = set() # reqIds of the requests not answered yet
+        self.failed = set() # reqIds answered with an error
+        self.pending_lock = Lock()
+        self.requests_done = Event() # set when pending is empty
+        self.new_bar_reqs = set() # MINUTE_REQ reqIds with a new bar since the last bar close
+        self.live_feeds = 0 # number of keepUpToDate requests
+        NiftyORB.__init__(self, addr, port, client_id)
+
+    def expect(self, req_ids):
+        ''' The requests about to be sent. requests_done is set once all of them are answered '''
+        with self.pending_lock:
+            self.pending = set(req_ids)
+            self.failed.clear()
+            if self.pending:
+                self.requests_done.clear() # internal flag is set to False
+            else:
+                self.requests_done.set() # internal flag is set to True
+
+    def answered(self, req_id):
+        with self.pending_lock:
+            self.pending.discard(req_id)
+            if not self.pending:
+                self.requests_done.set() #internal flag is set to True
+
+    @iswrapper
+    def contractDetails(self, req_id, details):
+        ''' Called in response to reqContractDetails '''
+        self.futures[req_id] = details.contract
+
+    @iswrapper
+    def contractDetailsEnd(self, req_id: int):
+        self.answered(req_id)
+
+    @iswrapper
+    def historicalData(self, req_id, bar):
+        ''' Called in response to reqHistoricalData '''
+        if bar.volume == 0: # Drop all entries for which volume traded = 0
+            return
+        self.bar_stores[req_id].upsert(bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume)
+
+    @iswrapper
+    def historicalDataEnd(self, req_id: int, start: str, end: str):
+        '''Marks the ending of the historical bars reception.'''
+        log.info('HistoricalDataEnd. ReqId: %s from %s to %s', req_id, start, end)
+        self.latency.since(('reqHistoricalData', req_id), 'reqHistoricalData_to_historicalDataEnd', pop=True)
+        if self.history_store is not None:
+            i = req_id - MINUTE_REQ if req_id >= MINUTE_REQ else req_id - DAILY_REQ
+            bar_size = '5 mins' if req_id >= MINUTE_REQ else '1 day'
+            with self.latency.span('history_store_write'):
+                self.history_store.write(self.local_symbols[i], bar_size, self.bar_stores[req_id].to_df())
+        self.answered(req_id)
+
+    @iswrapper
+    def historicalDataUpdate(self, req_id, bar):
+        ''' The forming bar of a live feed. The event is set once every feed has started a new bar '''
+        if self.bar_stores[req_id].upsert(bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume):
+            self.new_bar_reqs.add(req_id)
+            if len(self.new_bar_reqs) >= self.live_feeds:
+                self.new_bar_available.set() #internal flag is set to True. The previous bars are complete
+
+    @iswrapper
+    def error(self, req_id, code, msg):
+        ''' A request which fails is not waited on any longer. An order error ends that order only, never the process '''
+        state = self.order_tracker.get(req_id) if req_id < CONTRACT_REQ else None # a data request is never taken for an order
+        if state is not None and code != 103: # e.g. 201 rejected for margin. place_entries / wait_for_fills go on with the other instruments
+            self.order_tracker.on_error(req_id, code, msg)
+            log.log(error_level(code), 'Order Id: %s of %s, Error Code: %s, Error Message: %s', req_id, state.local_symbol, code, msg)
+            return
+        NiftyORB.error(self, req_id, code, msg) # 103 also resyncs the order IDs
+        if req_id in self.pending and not 2100 <= code < 2200:
+            self.failed.add(req_id)
+            self.answered(req_id)
+
+# Functions used In the program
+
+def get_universe(file_name):
+    ''' Symbols of the universe file and their lot sizes. Exits if a lot size is missing '''
+    df_symbols = pd.read_csv(file_name)
+    df_symbols = df_symbols.dropna(subset=['IB Symbol'])
+    df_symbols['IB Symbol'] = df_symbols['IB Symbol'].astype(str)
+    if 'Lot Size' not in df_symbols.columns:
+        print ("The universe file {} has no 'Lot Size' column. Add the lot size of every symbol".format(file_name))
+        sys.exit()
+    missing = df_symbols.loc[df_symbols['Lot Size'].isna(), 'IB Symbol'].tolist()
+    if missing:
+        print ('No Lot Size in {} for: {}'.format(file_name, missing))
+        sys.exit()
+    lot_sizes = df_symbols['Lot Size'].astype(int).tolist()
+    print ('# of symbols in the universe: {}'.format(len(df_symbols)))
+    return df_symbols['IB Symbol'].tolist(), lot_sizes
+
+def get_contracts(client, symbols):
+    ''' The front month future of every symbol, None for the symbols without one. All the requests at once '''
+    client.expect(CONTRACT_REQ + i for i in range(len(symbols)))
+    for i, symbol in enumerate(symbols):
+        contract = Contract()
+        contract.symbol = symbol
+        contract.secType = "CONTFUT"
+        contract.exchange = 'NSE'
+        contract.currency = "INR"
+        contract.includeExpired = True
+        client.reqContractDetails(CONTRACT_REQ + i, contract)
+    if not client.requests_done.wait(timeout=30): # block thread until every contract is answered
+        print ('No contract details within 30 seconds for: {}'.format([symbols[req_id - CONTRACT_REQ] for req_id in client.pending]))
+    return [client.futures.get(CONTRACT_REQ + i) for i in range(len(symbols))]
+
+def trading_contract(future):
+    ''' The futures Contract the orders are placed on '''
+    contract = Contract()
+    contract.localSymbol = future.localSymbol
+    contract.secType = 'FUT'
+    contract.exchange = 'NSE'
+    contract.currency = 'INR'
+    contract.primaryExchange = "NSE"
+    return contract
+
+def wait_for_requests(client, what, timeout):
+    ''' Block until the requests of client.expect are answered. Returns the reqIds which failed or timed out '''
+    if not client.requests_done.wait(timeout=timeout): # block thread until internal flag is set to True
+        print ('{}: no answer within {} seconds for reqIds {}'.format(what, timeout, sorted(client.pending)))
+    return client.failed | client.pending
+
+def get_daily_candle_data(client, contracts):
+    ''' Daily candles of every instrument. Only the days not yet in the history store are requested '''
+    now = datetime.datetime.now()
+    start = now - datetime.timedelta(days=365)
+    requests = {} # reqId : (start, end) of the request
+    for i, contract in enumerate(contracts):
+        req_id = DAILY_REQ + i
+        client.bar_stores[req_id] = BarStore(capacity=1024)
+        if client.history_store is None: # No local cache. Download the year
+            requests[req_id] = (start, now)
+        else:
+            gaps = client.historical_cache.missing_requests(contract.localSymbol, '1 day', 'TRADES', start, now)
+            if gaps:
+                requests[req_id] = (gaps[0][2], now) # from the first gap till now, in one request
+    client.expect(requests)
+    for req_id, (gap_start, gap_end) in requests.items():
+        client.latency.mark(('reqHistoricalData', req_id))
+        client.reqHistoricalData(req_id, contracts[req_id - DAILY_REQ], now.strftime("%Y%m%d %H:%M:%S"), duration_str(gap_start, gap_end, '1 day'),
+                                 '1 day', 'TRADES', 1, 1, False, [])
+    print ('Requested the daily candles of {} instruments'.format(len(requests)))
+    failed = wait_for_requests(client, 'Daily candles', 120)
+    if client.history_store is not None:
+        for i, contract in enumerate(contracts):
+            req_id = DAILY_REQ + i
+            if req_id in requests and req_id not in failed: # historicalDataEnd has written the bars to the history store
+                client.historical_cache.mark_covered(contract.localSymbol, '1 day', 'TRADES', *requests[req_id])
+            client.bar_stores[req_id].load(client.history_store.read(contract.localSymbol, '1 day', start, now))
+
+def calc_yest_data(client, n):
+    ''' Yesterdays ATR and Close of every instrument, NaN without enough daily candles '''
+    today = np.datetime64(datetime.date.today(), 's')
+    yest_ATR, yest_close = np.full(n, np.nan), np.full(n, np.nan)
+    for i in range(n):
+        df_daily = client.bar_stores[DAILY_REQ + i].to_df()
+        df_daily = df_daily[df_daily['Date'] < today] # till yesterday
+        if len(df_daily) > 14:
+            df_daily = ATR(df_daily, 14, ohlc=['Open', 'High', 'Low', 'Close'])
+            yest_ATR[i], yest_close[i] = df_daily['ATR_14'].iloc[-1], df_daily['Close'].iloc[-1]
+    return yest_ATR, yest_close
+
+def start_minute_candle_feeds(client, contracts):
+    ''' Backfill the 5 minute candles of today once for every instrument. Thereafter historicalDataUpdate keeps them up to date '''
+    req_ids = [MINUTE_REQ + i for i in range(len(contracts))]
+    for req_id in req_ids:
+        client.bar_stores[req_id] = BarStore(capacity=512)
+    client.live_feeds = len(req_ids)
+    client.expect(req_ids)
+    for req_id in req_ids:
+        client.latency.mark(('reqHistoricalData', req_id))
+        # With keepUpToDate=True the endDateTime has to be an empty string
+        client.reqHistoricalData(req_id, contracts[req_id - MINUTE_REQ], '', '1 D', '5 mins', 'TRADES', False, 1, True, [])
+    failed = wait_for_requests(client, 'Live 5 minute candle feeds', 120)
+    client.live_feeds -= len(failed)
+    print ('Finished backfill of {} live 5 minute candle feeds at time: {}'.format(client.live_feeds, datetime.datetime.now()))
+
+def completed_bars(client, n, bar_start):
+    ''' High, Low and Close of the 5 minute candle starting at bar_start of every instrument, and which instruments have it '''
+    high, low, close = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+    bar_start = np.datetime64(bar_start, 's')
+    for i in range(n):
+        bars = client.bar_stores[MINUTE_REQ + i].arrays()
+        dates = bars['Date'][-2:] # the candle which just closed is the last or, once the next one started, the one before
+        for k in np.flatnonzero(dates == bar_start):
+            k = k - len(dates)
+            high[i], low[i], close[i] = bars['High'][k], bars['Low'][k], bars['Close'][k]
+    return high, low, close, ~np.isnan(close)
+
+def load_todays_bars(client, engine, bar_start):
+    ''' Feed today's candles completed before bar_start, from the backfill, to the engine '''
+    today = np.datetime64(datetime.date.today(), 's')
+    for i in range(engine.n):
+        bars = client.bar_stores[MINUTE_REQ + i].arrays()
+        today_bars = (bars['Date'] >= today) & (bars['Date'] < np.datetime64(bar_start, 's'))
+        engine.load_day(i, bars['High'][today_bars], bars['Low'][today_bars], bars['Close'][today_bars])
+
+def wait_for_fills(states, timeout=60):
+    ''' Block until the orders {i: OrderState} are done. Returns the i of the filled ones '''
+    filled = []
+    for i, state in states.items():
+        try:
+            state.wait(timeout)
+        except (ConnectionError, TimeoutError) as e:
+            print ('    *** Order {} of {}: {} ***    '.format(state.order_id, state.local_symbol, str(e) or 'not done within {} seconds'.format(timeout)))
+            continue
+        if state.outcome == FILLED:
+            print ('    *** Order of {} is Successfully Executed at {} ***'.format(state.local_symbol, state.avg_fill_price))
+            filled.append(i)
+        else:
+            print ('    *** Order of {} NOT Executed. {}: {} ***'.format(state.local_symbol, state.outcome, state.error))
+    return np.array(filled, dtype=np.int64)
+
+def place_entries(client, engine, contracts, idx, side, stop):
+    ''' Transmit a Market order with its Stop for every instrument idx, then wait for the fills '''
+    states = {}
+    for i in idx:
+        # The order IDs come from the local allocator, seeded by nextValidId. No round trip to TWS before the order
+        order_id = client.order_ids.allocate(2) # a contiguous block for the parent and the stopLoss
+        if order_id is None:
+            print ('Order ID not received. No entry in {}'.format(engine.symbols[i]))
+            continue
+        action = 'BUY' if side[i] == LONG else 'SELL'
+        bracket = NiftyORB.OrderWithStop(order_id, action, int(engine.quantity[i]), float(stop[i]))
+        # Track the orders before placing them, so that no callback is missed
+        order_states = [client.order_tracker.track(o.orderId, contracts[i], o) for o in bracket]
+        for o in bracket:
+            client.orders_list.append(o.orderId)
+            client.latency.mark(('orderStatus', o.orderId), ('execDetails', o.orderId))
+            client.placeOrder(o.orderId, contracts[i], o)
+        states[i] = order_states[0]
+        print ('{} {} {} with Stop at {}'.format(action, engine.quantity[i], engine.symbols[i], stop[i]))
+    client.latency.since('bar_close', 'bar_close_to_placeOrder')
+    filled = wait_for_fills(states)
+    engine.entered(filled, side[filled], stop[filled])
+
+def close_positions(client, engine, contracts, idx):
+    ''' Close the positions of the instruments idx with Market orders, then cancel their Stops '''
+    states = {}
+    for i in idx:
+        order = Order()
+        order.action = 'SELL' if engine.position[i] > 0 else 'BUY'
+        order.totalQuantity = abs(int(engine.position[i]))
+        order.orderType = 'MKT'
+        order_id = client.order_ids.allocate()
+        if order_id is None:
+            print ('Order ID not received. Position of {} not closed'.format(engine.symbols[i]))
+            continue
+        states[i] = client.order_tracker.track(order_id, contracts[i], order) # before placeOrder, so that no callback is missed
+        client.latency.mark(('orderStatus', order_id), ('execDetails', order_id))
+        client.placeOrder(order_id, contracts[i], order)
+    client.latency.since('bar_close', 'bar_close_to_exit_placeOrder')
+    closed = wait_for_fills(states)
+    engine.exited(closed)
+
+    # The open orders of every session reach the order tracker through the openOrder callback
+    client.openOrderEnd_available.clear()
+    client.reqAllOpenOrders()
+    client.openOrderEnd_available.wait(timeout=5)
+    for i in closed:
+        for state in client.order_tracker.live_orders(engine.symbols[i]):
+            print('Open Order ID to be cancelled: {}'.format(state.order_id))
+            client.cancelOrder(state.order_id)
+
+def main():
+    # Variables used in pgm
+    market_close_time = datetime.time(15,30)
+    interval_minutes = 5
+    symbols, lot_sizes = get_universe(sys.argv[1] if len(sys.argv) > 1 else UNIVERSE_FILE)
+
+    # Connect to TWS only after 9:22 AM IST
+    pgm_start_time = datetime.time(9,22) # Start the program Only after 9:22
+    print ("Program Start Time is: {}. Is the TWS / IB Gateway program Running?".format(pgm_start_time))
+    while datetime.datetime.now().time() <= pgm_start_time:
+        time.sleep(10)
+
+    # Create the client and connect to TWS. The callbacks log through a background writer thread
+    start_logging()
+    client = ORBPortfolio('127.0.0.1', 7497, 1)
+    client.nextValidId_available.wait() # block thread until internal flag is set to True
+
+    print ('\n   Good to Go Baba. We are Connected to TWS')
+    print ('   The Order Id is: {}'.format(client.orderId))
+    print ('   The Account Details are: {}\n'.format(client.accountsList))
+
+    client.latency.enabled = True # time the stages from the bar close to the order transmit
+
+    # The instruments with a front month future
+    futures = get_contracts(client, symbols)
+    keep = [i for i, future in enumerate(futures) if future is not None]
+    futures = [futures[i] for i in keep]
+    quantity = [lot_sizes[i] for i in keep]
+    client.local_symbols = [future.localSymbol for future in futures]
+    contracts = [trading_contract(future) for future in futures]
+    print ('Futures of {} of the {} symbols: {}'.format(len(futures), len(symbols), client.local_symbols))
+    if not futures:
+        client.disconnect()
+        sys.exit()
+
+    engine = ORBEngine(client.local_symbols, quantity=quantity) # keyed by localSymbol, as position_dict
+    get_daily_candle_data(client, contracts)
+    engine.new_day(*calc_yest_data(client, engine.n))
+    start_minute_candle_feeds(client, contracts)
+
+    clock = BarClock(interval_minutes) # wakes up on the 5 minute bar closes, in exchange time
+    load_todays_bars(client, engine, clock.last_bar_close()) # the candles closed before the first wake up
+    request_positions(client) # positions held from an earlier run of the program
+    engine.sync_positions(client.position_dict)
+    engine.traded |= engine.position != 0
+    client.position_dict.clear()
+    print(engine.to_df())
+    client.new_bar_reqs.clear() # the new bars of the backfill are not a bar close
+    client.new_bar_available.clear() # internal flag is set to False
+
+    while ((datetime.datetime.now().time() <= market_close_time)):
+        # Block until the bar closes, i.e. until every live feed has started its next bar (or the grace time is over)
+        bar_close = clock.wait_for_bar_close(client.new_bar_available)
+        client.new_bar_reqs.clear()
+        if bar_close.time() > market_close_time:
+            break
+        print('\nBar closed at: {}. Woke up {:.1f} ms after the bar close'.format(bar_close, clock.jitter_ms[-1]))
+        client.latency.mark('bar_close', ago=clock.jitter_ms[-1] / 1000) # the bar close itself, not the wake up
+        client.latency.record('bar_close_wakeup', clock.jitter_ms[-1] / 1000)
+
+        # All the instruments in one pass
+        with client.latency.span('completed_bars'):
+            high, low, close, valid = completed_bars(client, engine.n, bar_close - clock.interval)
+        with client.latency.span('orb_signals'):
+            engine.update(high, low, close, valid)
+            side, stop, exits = engine.signals(bar_close.time())
+        client.latency.since('bar_close', 'bar_close_to_decision')
+        print('Candles of {} instruments. Entries: {}, Exits: {}'.format(valid.sum(), np.count_nonzero(side), np.count_nonzero(exits)))
+
+        if exits.any():
+            close_positions(client, engine, contracts, np.flatnonzero(exits))
+        if side.any():
+            place_entries(client, engine, contracts, np.flatnonzero(side), side, stop)
+
+        # A Stop filled at IB, or an order filled after its wait, is seen in the positions
+        if engine.position.any() or exits.any():
+            request_positions(client)
+            engine.sync_positions(client.position_dict)
+            client.position_dict.clear() # Removes all Items from dictionary
+
+        if bar_close.time() >= engine.params['latest_entry_time'] and not engine.position.any():
+            print('Dont Open any positions after {}. No open positions. Come out of the while Loop'.format(engine.params['latest_entry_time']))
+            break # come out of the while loop
+
+    print(engine.to_df())
+
+    # Request All Completed Orders today before disconnecting
+    client.completedOrdersEnd_available.clear() # internal flag is set to False
+    client.reqCompletedOrders(True) # apiOnly Orders
+    client.completedOrdersEnd_available.wait(timeout=5) # block thread until internal flag is set to True or 10 seconds
+
+    clock.print_jitter()
+    if client.latency.enabled:
+        client.latency.report()
+        client.latency.write_prometheus('ORB_portfolio_latency.prom')
+    for i in range(engine.n):
+        client.cancelHistoricalData(MINUTE_REQ + i) # cancel the keepUpToDate subscriptions
+    client.disconnect()
+
+if __name__ == '__main__':
+    main()
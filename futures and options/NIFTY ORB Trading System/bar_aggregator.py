@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental multi timeframe bar aggregator.
+
+Every completed base bar (e.g. 5 minutes) is consumed once and updates the forming bar of every
+higher timeframe (e.g. 15, 30, 60 minutes and daily) in O(1). When a higher timeframe bar is
+complete it is passed to the subscribers of that timeframe, e.g. a StreamingSuperTrend:
+
+    aggregator = MultiTimeframeAggregator(base_minutes=5, timeframes=[15, 30, 60, 'daily'])
+    st_15 = StreamingSuperTrend(14, 2)
+    aggregator.subscribe(15, lambda bar: st_15.update(bar.high, bar.low, bar.close))
+    aggregator.update(date, open_, high, low, close, volume) # for each completed 5 minute bar
+
+The buckets are the same as DataFrame.resample(rule='15Min', on='Date') with the default origin,
+i.e. counted from midnight, and empty buckets are skipped as after resample(...).dropna().
+"""
+# Imports used
+import datetime
+
+class Bar:
+    ''' One OHLCV bar. date is the start of the bar '''
+    __slots__ = ['date', 'open', 'high', 'low', 'close', 'volume']
+
+    def __init__(self, date, open_, high, low, close, volume):
+        self.date = date
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def __repr__(self):
+        return 'Bar({}, O={}, H={}, L={}, C={}, V={})'.format(self.date, self.open, self.high, self.low, self.close, self.volume)
+
+class MultiTimeframeAggregator:
+    ''' Aggregates completed base bars into higher timeframe bars. Timeframes are minutes, or 'daily' '''
+
+    def __init__(self, base_minutes=5, timeframes=(15, 30, 60, 'daily')):
+        self.base = datetime.timedelta(minutes=base_minutes)
+        self.base_minutes = base_minutes
+        self.timeframes = list(timeframes)
+        self.forming = {tf: None for tf in self.timeframes} # forming (incomplete) bar of each timeframe
+        self.subscribers = {tf: [] for tf in [base_minutes] + self.timeframes}
+        self.last_base_date = None # date of the last base bar consumed
+
+    def subscribe(self, timeframe, callback):
+        ''' callback(bar) is called with every completed bar of the timeframe. Subscribe to base_minutes for the base bars '''
+        self.subscribers[timeframe].append(callback)
+
+    def bucket_start(self, date, timeframe):
+        ''' Start of the timeframe bar the date belongs to '''
+        if timeframe == 'daily':
+            return date.replace(hour=0, minute=0, second=0, microsecond=0)
+        minutes = (date.hour * 60 + date.minute) // timeframe * timeframe
+        return date.replace(hour=minutes // 60, minute=minutes % 60, second=0, microsecond=0)
+
+    def update(self, date, open_, high, low, close, volume):
+        ''' Consume one completed base bar. date is the start of the base bar '''
+        self.last_base_date = date
+        self._emit(self.base_minutes, Bar(date, open_, high, low, close, volume))
+        for tf in self.timeframes:
+            start = self.bucket_start(date, tf)
+            bar = self.forming[tf]
+            if bar is not None and bar.date != start: # A base bar of a later bucket: the forming bar is complete
+                self._emit(tf, bar)
+                bar = None
+            if bar is None:
+                bar = Bar(start, open_, high, low, close, volume)
+            else:
+                bar.high = max(bar.high, high)
+                bar.low = min(bar.low, low)
+                bar.close = close
+                bar.volume += volume
+            # The last base bar of the bucket completes it without waiting for the next bucket
+            if tf != 'daily' and date + self.base >= start + datetime.timedelta(minutes=tf):
+                self._emit(tf, bar)
+                bar = None
+            self.forming[tf] = bar
+
+    def update_from_df(self, df, before=None):
+        ''' Consume the rows of a DataFrame ['Date', 'Open', 'High', 'Low', 'Close', 'Volume'] newer than the last base bar consumed, and dated before 'before' if given '''
+        start = 0 if self.last_base_date is None else df['Date'].searchsorted(self.last_base_date, side='right')
+        end = len(df) if before is None else df['Date'].searchsorted(before, side='left')
+        df_new = df.iloc[start:max(start, end)]
+        for row in zip(df_new['Date'], df_new['Open'].values.tolist(), df_new['High'].values.tolist(), df_new['Low'].values.tolist(),
+                       df_new['Close'].values.tolist(), df_new['Volume'].values.tolist()):
+            self.update(*row)
+        return len(df_new)
+
+    def peek(self, timeframe, date, open_, high, low, close, volume):
+        ''' The forming bar of the timeframe as it would be with the base bar, without consuming it. For a base bar which can still change '''
+        start = self.bucket_start(date, timeframe)
+        bar = self.forming[timeframe]
+        if bar is None or bar.date != start:
+            return Bar(start, open_, high, low, close, volume)
+        return Bar(start, bar.open, max(bar.high, high), min(bar.low, low), close, bar.volume + volume)
+
+    def _emit(self, timeframe, bar):
+        for callback in self.subscribers[timeframe]:
+            callback(bar)
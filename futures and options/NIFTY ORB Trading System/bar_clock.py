@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Bar close scheduler in exchange time, driven by a monotonic clock.
+
+Instead of spinning in 'while now <= market_close_time' and checking 'minute % 5 == 0 and second == 0',
+the main loop blocks in BarClock.wait_for_bar_close() and wakes up on the bar boundary:
+
+    clock = BarClock(interval_minutes=5)
+    while True:
+        bar_close = clock.wait_for_bar_close(client.new_bar_available) # or wait_for_bar_close() without a live feed
+        if bar_close.time() > market_close_time:
+            break
+        ... decide on the completed bar ...
+    clock.print_jitter()
+
+With a live feed (reqHistoricalData with keepUpToDate) the wake up is the bar completion event itself,
+i.e. the first update of the next bar. Without a live feed, the clock sleeps until the boundary.
+Bar boundaries are counted from the session start in exchange time (IST, UTC+5:30, no daylight saving).
+The wall clock is read once and then advanced with time.monotonic(), so a clock adjustment of the
+OS during the day does not move the boundaries.
+"""
+# Imports used
+import time
+import datetime
+
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+
+class BarClock:
+    ''' Wakes up on the bar boundaries of a session and measures how late each wake up was (jitter) '''
+
+    def __init__(self, interval_minutes=5, session_start=datetime.time(9,15), tz=IST):
+        self.interval = datetime.timedelta(minutes=interval_minutes)
+        self.session_start = session_start
+        self.tz = tz
+        self.anchor_wall = time.time() # wall clock, read once
+        self.anchor_monotonic = time.monotonic()
+        self.jitter_ms = [] # lateness of every wake up after its bar boundary, in milli seconds
+
+    def now(self):
+        ''' Exchange time, as a naive datetime like the Date column of the bars '''
+        wall = self.anchor_wall + (time.monotonic() - self.anchor_monotonic)
+        return datetime.datetime.fromtimestamp(wall, self.tz).replace(tzinfo=None)
+
+    def last_bar_close(self, now=None):
+        ''' The latest bar boundary at or before now '''
+        now = now or self.now()
+        session_start = datetime.datetime.combine(now.date(), self.session_start)
+        return session_start + ((now - session_start) // self.interval) * self.interval
+
+    def next_bar_close(self, now=None):
+        ''' The first bar boundary after now '''
+        return self.last_bar_close(now) + self.interval
+
+    def sleep_until(self, target):
+        ''' Sleep until the exchange time target. Sleeps most of the way and spins on the monotonic clock for the last milli second '''
+        deadline = time.monotonic() + (target - self.now()).total_seconds()
+        remaining = deadline - time.monotonic()
+        if remaining > 0.002:
+            time.sleep(remaining - 0.001)
+        while time.monotonic() < deadline:
+            pass
+
+    def wait_for_bar_close(self, new_bar_event=None, grace_seconds=10):
+        '''
+        Block until the next bar closes and return its bar boundary (the start time of the next bar).
+        new_bar_event is an Event set when the first update of a new bar arrives. It is cleared here.
+        If it is not set within grace_seconds after the boundary (no trades), the boundary is returned anyway.
+        '''
+        if new_bar_event is None:
+            bar_close = self.next_bar_close()
+            self.sleep_until(bar_close)
+        else:
+            timeout = (self.next_bar_close() - self.now()).total_seconds() + grace_seconds
+            if new_bar_event.wait(timeout=timeout):
+                new_bar_event.clear() #internal flag is set to False
+            else:
+                print('No update of a new bar within {} seconds of the bar close'.format(grace_seconds))
+            bar_close = self.last_bar_close()
+        self.jitter_ms.append((self.now() - bar_close).total_seconds() * 1000)
+        return bar_close
+
+    def print_jitter(self):
+        ''' Summary of how late the wake ups were after the bar boundaries '''
+        if not self.jitter_ms:
+            return
+        jitter = sorted(self.jitter_ms)
+        print('Bar close wake ups: {}, jitter median: {:.1f} ms, max: {:.1f} ms'.format(len(jitter), jitter[len(jitter) // 2], jitter[-1]))
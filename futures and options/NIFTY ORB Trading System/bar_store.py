@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+In memory, columnar store of OHLCV bars.
+
+The reqHistoricalData callbacks (historicalData / historicalDataUpdate) append to the store and the
+strategy reads NumPy views or a DataFrame straight from it. No list of lists, no CSV round trip.
+
+    Date   : datetime64[s]
+    Open, High, Low, Close : float64 (one 2-D block, so the DataFrame is built without copying)
+    Volume : int64
+
+"""
+# Imports used
+import numpy as np
+import pandas as pd
+
+from threading import Lock
+
+def ib_date_to_datetime64(bar_date):
+    ''' Convert the date of an IB bar (formatDate=1) 'YYYYMMDD' or 'YYYYMMDD  HH:MM:SS' to datetime64[s] '''
+    parts = bar_date.split()
+    day = parts[0]
+    iso = day[0:4] + '-' + day[4:6] + '-' + day[6:8]
+    if len(parts) > 1: # Intraday bars have a time part
+        iso = iso + 'T' + parts[1]
+    return np.datetime64(iso, 's')
+
+class BarStore:
+    ''' Growable columnar arrays of OHLCV bars. Safe to append from the client thread and read from the main thread '''
+
+    OHLC = ['Open', 'High', 'Low', 'Close']
+
+    def __init__(self, capacity=4096):
+        self.length = 0 # number of bars stored
+        self.dates = np.empty(capacity, dtype='datetime64[s]')
+        self.ohlc = np.empty((4, capacity), dtype=np.float64) # rows are Open, High, Low, Close
+        self.volume = np.empty(capacity, dtype=np.int64)
+        self.lock = Lock()
+
+    def __len__(self):
+        return self.length
+
+    def clear(self):
+        ''' Remove all bars. The allocated memory is kept '''
+        with self.lock:
+            self.length = 0
+
+    def append(self, bar_date, open_, high, low, close, volume):
+        ''' Add a new bar at the end of the store '''
+        with self.lock:
+            self._append(ib_date_to_datetime64(bar_date), open_, high, low, close, volume)
+
+    def upsert(self, bar_date, open_, high, low, close, volume):
+        '''
+        Replace the last bar if it has the same date (the forming bar of a keepUpToDate request), else add a new bar.
+        Bars older than the last bar are already stored and are ignored. Returns True if a new bar was added
+        '''
+        date = ib_date_to_datetime64(bar_date)
+        with self.lock:
+            if self.length and self.dates[self.length - 1] > date:
+                return False
+            if self.length and self.dates[self.length - 1] == date:
+                i = self.length - 1
+                self.ohlc[0, i] = open_
+                self.ohlc[1, i] = high
+                self.ohlc[2, i] = low
+                self.ohlc[3, i] = close
+                self.volume[i] = volume
+                return False
+            self._append(date, open_, high, low, close, volume)
+            return True
+
+    def load(self, df):
+        ''' Replace the content of the store with the bars of a DataFrame with columns ['Date', 'Open', 'High', 'Low', 'Close', 'Volume'] '''
+        n = len(df)
+        with self.lock:
+            if n > len(self.dates):
+                capacity = max(n, 2 * len(self.dates))
+                self.dates = np.empty(capacity, dtype=self.dates.dtype)
+                self.ohlc = np.empty((4, capacity), dtype=np.float64)
+                self.volume = np.empty(capacity, dtype=np.int64)
+            self.dates[:n] = pd.to_datetime(df['Date']).values.astype(self.dates.dtype)
+            for row, column in enumerate(self.OHLC):
+                self.ohlc[row, :n] = df[column].values
+            self.volume[:n] = df['Volume'].values
+            self.length = n
+
+    def _append(self, date, open_, high, low, close, volume):
+        ''' Append without taking the lock. Grow the arrays by doubling when they are full '''
+        if self.length == len(self.dates):
+            capacity = 2 * len(self.dates)
+            dates = np.empty(capacity, dtype=self.dates.dtype)
+            ohlc = np.empty((4, capacity), dtype=np.float64)
+            volume_arr = np.empty(capacity, dtype=np.int64)
+            dates[:self.length] = self.dates[:self.length]
+            ohlc[:, :self.length] = self.ohlc[:, :self.length]
+            volume_arr[:self.length] = self.volume[:self.length]
+            self.dates, self.ohlc, self.volume = dates, ohlc, volume_arr
+        i = self.length
+        self.dates[i] = date
+        self.ohlc[0, i] = open_
+        self.ohlc[1, i] = high
+        self.ohlc[2, i] = low
+        self.ohlc[3, i] = close
+        self.volume[i] = volume
+        self.length = i + 1
+
+    def arrays(self):
+        '''
+        Zero-copy NumPy views of the stored bars as a dict with keys 'Date', 'Open', 'High', 'Low', 'Close', 'Volume'.
+        An in place update of the last (forming) bar is visible through the views. Bars appended later are not.
+        '''
+        with self.lock:
+            n = self.length
+            views = {'Date': self.dates[:n], 'Volume': self.volume[:n]}
+            for row, column in enumerate(self.OHLC):
+                views[column] = self.ohlc[row, :n]
+        return views
+
+    def to_df(self):
+        ''' DataFrame with columns ['Date', 'Open', 'High', 'Low', 'Close', 'Volume'] built on views of the store '''
+        with self.lock:
+            n = self.length
+            df = pd.DataFrame(self.ohlc[:, :n].T, columns=self.OHLC, copy=False)
+            df.insert(0, 'Date', self.dates[:n].astype('datetime64[ns]')) # pandas uses ns resolution
+            df['Volume'] = self.volume[:n]
+        return df
+
+    def to_csv(self, file_name):
+        ''' Optional side output. Write the bars to a CSV file in the same format as the earlier programs '''
+        self.to_df().to_csv(file_name, encoding='utf-8', index=False)
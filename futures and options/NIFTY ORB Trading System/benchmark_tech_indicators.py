@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the SuperTrend in tech_indicators against the earlier pandas .iat loop implementation.
+
+Usage :
+    python benchmark_tech_indicators.py [minute_csv_file]
+
+If no CSV file (with Date, Open, High, Low, Close, Volume columns) is given, 45 days of
+synthetic 5 minute NIFTY like candles are generated.
+"""
+# Imports used in the program
+from tech_indicators import ATR, SuperTrend, StreamingSuperTrend
+
+import numpy as np
+import pandas as pd
+import sys
+import time
+
+# Functions used in the program
+
+def SuperTrend_iat_loop(df, period, multiplier, ohlc=['Open', 'High', 'Low', 'Close']):
+    ''' The earlier SuperTrend implementation, kept here as the reference for the benchmark '''
+    ATR(df, period, ohlc=ohlc)
+    atr = 'ATR_' + str(period)
+    st = 'ST_' + str(period) + '_' + str(multiplier)
+    stx = 'STX_' + str(period) + '_' + str(multiplier)
+
+    df['basic_ub'] = (df[ohlc[1]] + df[ohlc[2]]) / 2 + multiplier * df[atr]
+    df['basic_lb'] = (df[ohlc[1]] + df[ohlc[2]]) / 2 - multiplier * df[atr]
+
+    df['final_ub'] = 0.00
+    df['final_lb'] = 0.00
+    for i in range(period, len(df)):
+        df['final_ub'].iat[i] = df['basic_ub'].iat[i] if df['basic_ub'].iat[i] < df['final_ub'].iat[i - 1] or df[ohlc[3]].iat[i - 1] > df['final_ub'].iat[i - 1] else df['final_ub'].iat[i - 1]
+        df['final_lb'].iat[i] = df['basic_lb'].iat[i] if df['basic_lb'].iat[i] > df['final_lb'].iat[i - 1] or df[ohlc[3]].iat[i - 1] < df['final_lb'].iat[i - 1] else df['final_lb'].iat[i - 1]
+
+    df[st] = 0.00
+    for i in range(period, len(df)):
+        df[st].iat[i] = df['final_ub'].iat[i] if df[st].iat[i - 1] == df['final_ub'].iat[i - 1] and df[ohlc[3]].iat[i] <= df['final_ub'].iat[i] else \
+                        df['final_lb'].iat[i] if df[st].iat[i - 1] == df['final_ub'].iat[i - 1] and df[ohlc[3]].iat[i] >  df['final_ub'].iat[i] else \
+                        df['final_lb'].iat[i] if df[st].iat[i - 1] == df['final_lb'].iat[i - 1] and df[ohlc[3]].iat[i] >= df['final_lb'].iat[i] else \
+                        df['final_ub'].iat[i] if df[st].iat[i - 1] == df['final_lb'].iat[i - 1] and df[ohlc[3]].iat[i] <  df['final_lb'].iat[i] else 0.00
+
+    df[stx] = np.where((df[st] > 0.00), np.where((df[ohlc[3]] < df[st]), 'down',  'up'), np.NaN)
+    df.drop(['basic_ub', 'basic_lb', 'final_ub', 'final_lb'], inplace=True, axis=1)
+    df.fillna(0, inplace=True)
+    return df
+
+def synthetic_minute_data(days=45, bars_per_day=75, start_price=11500.0, seed=7):
+    ''' Random walk 5 minute candles, 9:15 to 15:30 IST, for the given number of trading days '''
+    rng = np.random.default_rng(seed)
+    n = days * bars_per_day
+    close = start_price + np.cumsum(rng.normal(0, 8, n))
+    open_ = np.concatenate([[start_price], close[:-1]])
+    high = np.maximum(open_, close) + rng.uniform(0, 6, n)
+    low = np.minimum(open_, close) - rng.uniform(0, 6, n)
+    days_index = pd.bdate_range('2020-07-01', periods=days)
+    dates = [d + pd.Timedelta(hours=9, minutes=15) + pd.Timedelta(minutes=5 * b) for d in days_index for b in range(bars_per_day)]
+    return pd.DataFrame({'Date': dates, 'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': rng.integers(1000, 50000, n)})
+
+def time_it(func, df, repeat):
+    ''' Best of repeat runs in seconds, each on a fresh copy of the DataFrame '''
+    best = None
+    for _ in range(repeat):
+        df_copy = df.copy(deep=True)
+        t0 = time.perf_counter()
+        result = func(df_copy, 14, 2, ohlc=['Open', 'High', 'Low', 'Close'])
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    if len(sys.argv) > 1:
+        df = pd.read_csv(sys.argv[1])
+        df['Date'] = pd.to_datetime(df['Date']) # Convert to pandas DateTime format
+    else:
+        df = synthetic_minute_data()
+    print('Number of candles: {}'.format(len(df)))
+
+    old_time, df_old = time_it(SuperTrend_iat_loop, df, 3)
+    new_time, df_new = time_it(SuperTrend, df, 20)
+
+    # Both implementations must produce exactly the same columns
+    same_st = np.array_equal(df_old['ST_14_2'].values, df_new['ST_14_2'].values)
+    same_stx = (df_old['STX_14_2'].values == df_new['STX_14_2'].values).all()
+    print('ST_14_2 identical: {}, STX_14_2 identical: {}'.format(same_st, same_stx))
+    print('SuperTrend with .iat loop: {:.4f} sec'.format(old_time))
+    print('SuperTrend on NumPy arrays: {:.4f} sec'.format(new_time))
+    print('Speed up: {:.1f}x'.format(old_time / new_time))
+
+    # The streaming SuperTrend must give the same value as the batch SuperTrend, candle by candle
+    streaming_st = StreamingSuperTrend(14, 2)
+    st_values, stx_values = [], []
+    t0 = time.perf_counter()
+    for high, low, close in zip(df['High'].values.tolist(), df['Low'].values.tolist(), df['Close'].values.tolist()):
+        st_value, stx_value = streaming_st.update(high, low, close)
+        st_values.append(st_value)
+        stx_values.append(stx_value)
+    stream_time = time.perf_counter() - t0
+    same_stream = np.array_equal(df_new['ST_14_2'].values, st_values) and list(df_new['STX_14_2'].values) == stx_values
+    print('StreamingSuperTrend identical: {}, cost per candle: {:.2f} microsec'.format(same_stream, stream_time / len(df) * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Latency instrumentation of the decision path, from the bar close to the order transmit and its fill.
+
+A stage is timed with a span, or between two points of different threads with mark / since.
+The times come from time.perf_counter(), a monotonic clock. Every stage keeps its count, sum and
+its last max_samples durations, from which the p50 / p99 are read:
+
+    latency = LatencyRecorder(enabled=True)
+    with latency.span('calc_todays_data'):
+        ...
+    latency.mark('bar_close', ago=jitter) # e.g. in the main thread, jitter seconds after the bar close
+    latency.since('bar_close', 'bar_close_to_placeOrder') # elapsed since the mark, from any thread
+    latency.record('bar_close_wakeup', seconds) # a duration measured elsewhere
+    latency.report() # count, p50, p99 and max of every stage
+    latency.write_prometheus('nifty_ORB_latency.prom') # Prometheus text format, e.g. for the node exporter textfile collector
+    latency.serve(9464) # or scrape http://127.0.0.1:9464/metrics
+
+Disabled (the default), span returns one shared do nothing context manager and mark, since and record
+return at once, so the instrumentation can stay in the code.
+"""
+# Imports used
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from threading import Lock, Thread
+
+import time
+import os
+
+class Span:
+    ''' Times the block of a with statement '''
+    __slots__ = ['recorder', 'stage', 'start']
+
+    def __init__(self, recorder, stage):
+        self.recorder = recorder
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+class NullSpan:
+    ''' Span of a disabled recorder '''
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class LatencyRecorder:
+    ''' Durations of the stages of a program, in seconds '''
+
+    def __init__(self, enabled=False, max_samples=10000, metric='orb_stage_latency_seconds'):
+        self.enabled = enabled
+        self.max_samples = max_samples
+        self.metric = metric
+        self.samples = {} # stage : deque of the last max_samples durations
+        self.counts = {} # stage : number of durations recorded
+        self.sums = {} # stage : sum of the durations recorded
+        self.marks = {} # name : perf_counter() of the mark
+        self.lock = Lock()
+
+    def span(self, stage):
+        return Span(self, stage) if self.enabled else NULL_SPAN
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.max_samples)
+                self.counts[stage] = 0
+                self.sums[stage] = 0.0
+            self.samples[stage].append(seconds)
+            self.counts[stage] += 1
+            self.sums[stage] += seconds
+
+    def mark(self, *names, ago=0.0):
+        ''' Remember the time now (or ago seconds before) under each name, e.g. 'bar_close' or ('execDetails', orderId) '''
+        if self.enabled:
+            now = time.perf_counter() - ago
+            for name in names:
+                self.marks[name] = now
+
+    def since(self, name, stage, pop=False):
+        ''' Record the time since the mark name as a duration of stage. pop=True records only the first time after the mark '''
+        if not self.enabled:
+            return
+        start = self.marks.pop(name, None) if pop else self.marks.get(name)
+        if start is not None:
+            self.record(stage, time.perf_counter() - start)
+
+    def summary(self):
+        ''' {stage: (count, sum, p50, p99, max)} '''
+        with self.lock:
+            stages = {stage: (self.counts[stage], self.sums[stage], sorted(samples)) for stage, samples in self.samples.items()}
+        return {stage: (count, total, percentile(s, 0.5), percentile(s, 0.99), s[-1]) for stage, (count, total, s) in stages.items()}
+
+    def report(self):
+        ''' Print the count, p50, p99 and max of every stage in milli seconds '''
+        for stage, (count, total, p50, p99, high) in self.summary().items():
+            print('{:<36} count: {:>6}, p50: {:>9.3f} ms, p99: {:>9.3f} ms, max: {:>9.3f} ms'.format(
+                stage, count, p50 * 1000, p99 * 1000, high * 1000))
+
+    def prometheus_text(self):
+        ''' The stages as one Prometheus summary, in the text exposition format '''
+        lines = ['# HELP {} Duration of the stages of the decision path'.format(self.metric), '# TYPE {} summary'.format(self.metric)]
+        for stage, (count, total, p50, p99, high) in self.summary().items():
+            lines.append('{}{{stage="{}",quantile="0.5"}} {:.9f}'.format(self.metric, stage, p50))
+            lines.append('{}{{stage="{}",quantile="0.99"}} {:.9f}'.format(self.metric, stage, p99))
+            lines.append('{}_sum{{stage="{}"}} {:.9f}'.format(self.metric, stage, total))
+            lines.append('{}_count{{stage="{}"}} {}'.format(self.metric, stage, count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, file_name):
+        ''' Write prometheus_text to file_name. A reader never sees a half written file '''
+        temp_file = file_name + '.tmp'
+        with open(temp_file, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_file, file_name)
+
+    def serve(self, port=9464, host='127.0.0.1'):
+        ''' Serve prometheus_text at http://host:port/metrics from a daemon thread. Returns the server '''
+        recorder = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = recorder.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args): # no line per scrape
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        print('Latency metrics served at http://{}:{}/metrics'.format(host, port))
+        return server
+
+def percentile(sorted_samples, q):
+    ''' Nearest rank percentile of sorted samples '''
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))]
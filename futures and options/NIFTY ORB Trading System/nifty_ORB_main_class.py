@@ -9,9 +9,6 @@ This program defines the Main Class and its callback mthods for Nifty_ORB_Algo.p
 """
 # Imports used in the program
 
-import pandas as pd
-import collections
-import queue
 import datetime
 import sys, os
 
@@ -22,6 +19,18 @@ from ibapi.wrapper import EWrapper
 from ibapi.utils import iswrapper
 from ibapi.order import Order
 
+from bar_store import BarStore
+from order_tracker import OrderTracker, OrderIdAllocator
+from latency import LatencyRecorder
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'pandas and csv')) # for history_store
+from history_store import HistoryStore
+from historical_cache import HistoricalDataCache
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger
+
+log = get_logger(__name__)
+
 # import pdb
 
 class NiftyORB(EWrapper, EClient):
@@ -35,23 +44,22 @@ class NiftyORB(EWrapper, EClient):
         self.accountsList = None       
         self.local_symbol = None
         self.multiplier = None
-        self.daily_data_requested = None # use this flag for naming of the CSV file
+        self.daily_data_requested = None # use this flag to pick the daily or the minute bar store
+        self.export_csv = False # if True, also write the bars to <local_symbol>_Daily.csv / _Minute.csv
+        self.history_store = HistoryStore() # columnar on-disk store of the bars. Set to None to not store them
+        self.historical_cache = HistoricalDataCache(self.history_store) # what is already in the history store
         self.time_difference = None
         self.position_dict = {} # for storing the open positions from the position callback
-        self.openOrder_dict = {} # for storing the open Orders from the openOrder callback
+        self.order_tracker = OrderTracker() # state of every order, fed by openOrder, orderStatus, execDetails, commissionReport and error
+        self.order_ids = OrderIdAllocator() # order IDs handed out locally, seeded by nextValidId
+        self.latency = LatencyRecorder() # timings of the decision path stages. Disabled until the program enables it
         self.orders_list = [] # store the Order IDs of parent and stopLoss
         
-        self.date_dq = collections.deque() # to Store date in deque
-        self.open_dq = collections.deque() # to Store open in deque
-        self.high_dq = collections.deque() # to Store high in deque
-        self.low_dq = collections.deque() # to Store low in deque
-        self.close_dq = collections.deque() # to Store close in deque
-        self.volume_dq = collections.deque() # to Store volume in deque
+        self.daily_bars = BarStore(capacity=1024) # to Store the daily candles
+        self.minute_bars = BarStore() # to Store the 5 minute candles. With the live feed, the last one is the forming bar
+        self.live_feed_reqId = None # reqId of the keepUpToDate reqHistoricalData, if the live feed is started
         
-        self.orderStatus_queue = queue.Queue() # initialize empty queue for holding callback orderStatus
-
         self.nextValidId_available = Event() # Initialize an Event object
-        self.execDetails_available = Event() # use after call to placeOrder. The outlier
         self.contractDetailsEnd_available = Event() # Initialize an Event object
         self.historicalDataEnd_available = Event() # Initialize an Event object
         self.currentTime_available = Event() # Initialize an Event object
@@ -60,9 +68,7 @@ class NiftyORB(EWrapper, EClient):
         self.positionEnd_available = Event() # Initialize an Event object
         self.completedOrdersEnd_available = Event() # Initialize an Event object
         self.openOrderEnd_available = Event() # Initialize an Event object
-
-        self.order_executed = False # use to check execDetails callback
-        self.order_submitted = False # use to cjeck orderStatus callback
+        self.new_bar_available = Event() # set by historicalDataUpdate when a new bar starts, i.e. the previous bar is complete
         
         # self.symbols = {'BANKNIFTY':'NSE','NIFTY50':'NSE'}
 
@@ -77,8 +83,9 @@ class NiftyORB(EWrapper, EClient):
     def nextValidId(self, orderId):
         ''' Provides the next order ID '''
         self.orderId = orderId
+        self.order_ids.seed(orderId)
         self.nextValidId_available.set() #internal flag is set to True
-        print('Order Id from nextValidId callback is: {}'.format(orderId))
+        log.info('Order Id from nextValidId callback is: %s', orderId)
 
     @iswrapper
     def managedAccounts(self, accountsList):
@@ -88,7 +95,7 @@ class NiftyORB(EWrapper, EClient):
     @iswrapper
     def accountSummary(self, reqId, account, tag, value, currency):
         ''' Callback to reqAccountSummary. Read Information about the Account '''
-        print('\nAccount: {} & {}: {}'.format(account, tag, value))
+        log.info('Account: %s & %s: %s', account, tag, value)
         # print('The currency on which the Value is expressed: {}'.format(currency))
         
     @iswrapper
@@ -114,41 +121,38 @@ class NiftyORB(EWrapper, EClient):
     @iswrapper
     def historicalData(self, req_id, bar):
         ''' Called in response to reqHistoricalData '''
-        # Add the futures prices to the deque        
-        self.date_dq.append(bar.date)
-        self.open_dq.append(bar.open)
-        self.high_dq.append(bar.high)
-        self.low_dq.append(bar.low)
-        self.close_dq.append(bar.close)
-        self.volume_dq.append(bar.volume)
+        if bar.volume == 0: # Drop all entries for which volume traded = 0
+            return
+        # Add the futures prices to the bar store
+        bar_store = self.daily_bars if self.daily_data_requested is True else self.minute_bars
+        bar_store.upsert(bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume) # bars already loaded from the history store are skipped
         # print('Date: {}, Open: {}, High: {}, Low: {}, Close: {}'.format(bar.date, bar.open, bar.high, bar.low, bar.close))
                 
     @iswrapper
     def historicalDataEnd(self, req_id: int, start: str, end: str):
         '''Marks the ending of the historical bars reception.'''
-        print('HistoricalDataEnd. ReqId: {} from {} to {}'.format( req_id, start, end))      
-        # Create List
-        combined_list = [list(self.date_dq), list(self.open_dq), list(self.high_dq), list(self.low_dq), list(self.close_dq), list(self.volume_dq)]
-        
-        # Write data to a CSV file
-        df = pd.DataFrame(combined_list).transpose()
-        df.columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
-        df['Date'] = pd.to_datetime(df['Date']) # Convert to pandas DateTime format
-        df = df[df.Volume != 0] # Drop all entries for which volume traded = 0
+        log.info('HistoricalDataEnd. ReqId: %s from %s to %s', req_id, start, end)
+        self.latency.since(('reqHistoricalData', req_id), 'reqHistoricalData_to_historicalDataEnd', pop=True)
 
+        # The bars stay in memory. Writing them to disk is a side output
         if self.daily_data_requested is True:
-            file_name = self.local_symbol + '_Daily' + '.csv'
+            bar_store, bar_size, file_name = self.daily_bars, '1 day', self.local_symbol + '_Daily' + '.csv'
         else:
-            file_name = self.local_symbol + '_Minute' + '.csv'
-
-        df.to_csv(file_name, encoding='utf-8', index=False)
-       
-        # Clear the deque and list
-        for v in [self.date_dq, self.open_dq, self.high_dq, self.low_dq, self.close_dq, self.volume_dq]:
-            v.clear()
-        combined_list = []
+            bar_store, bar_size, file_name = self.minute_bars, '5 mins', self.local_symbol + '_Minute' + '.csv'
+        if self.history_store is not None:
+            with self.latency.span('history_store_write'):
+                self.history_store.write(self.local_symbol, bar_size, bar_store.to_df()) # only the changed partitions are written
+        if self.export_csv is True:
+            bar_store.to_csv(file_name)
         
         self.historicalDataEnd_available.set() #internal flag is set to True
+
+    @iswrapper
+    def historicalDataUpdate(self, req_id, bar):
+        ''' Called with the forming bar when reqHistoricalData is made with keepUpToDate=True '''
+        # Same bar is still forming: replace it. Else a new bar has started
+        if self.minute_bars.upsert(bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume):
+            self.new_bar_available.set() #internal flag is set to True. The previous bar is complete
     
     @iswrapper
     def currentTime(self, curr_time):
@@ -175,54 +179,50 @@ class NiftyORB(EWrapper, EClient):
         # print('Comission Charged: {}'.format(state.commission))
         # print('Completed Time: {}'.format(state.completedTime))
         # print('Warning Text: {}'.format(state.warningText))
-        self.openOrder_dict.update({contract.localSymbol:orderId})
+        self.order_tracker.on_open_order(orderId, contract, order, state)
                 
     @iswrapper
     def orderStatus(self, orderId, status, filled, remaining, avgFillPrice, permId, parentId, lastFillPrice, clientId, whyHeld, mktCapPrice):
         ''' Callback for the submitted order. '''
-        if hasattr(self, "orderStatus_queue"):
-            self.orderStatus_queue.put(
-                {
-                    "status": status,
-                    "filled": filled,
-                    "remaining": remaining,
-                    "avgFillPrice": avgFillPrice,
-                    "orderId": orderId,
-                    "permId": permId,
-                }
-            )
+        self.latency.since(('orderStatus', orderId), 'placeOrder_to_orderStatus', pop=True) # the first status of the order
+        log.info('Status of Order: %s, Filled Positions: %s, Remaining Positions: %s, OrderId: %s, permId: %s', status, filled, remaining, orderId, permId)
+        self.order_tracker.on_order_status(orderId, status, filled, remaining, avgFillPrice, permId, parentId)
             
     # When all orders have been sent to the client application you will receive a IBApi.EWrapper.openOrderEnd event:
     @iswrapper
     def openOrderEnd(self):
-        print("In Callback OpenOrderEnd")
+        log.info('In Callback OpenOrderEnd')
         self.openOrderEnd_available.set() #internal flag is set to True
     
     # No need to call reqExecutions to get notified of future executions. 
     # They come automatically, in the same way as openOrder and orderStatus notifications.
     @iswrapper
     def execDetails(self, reqId, contract, execution):
-        print("\nIn callback ExecDetails. ReqId: {}, Symbol: {}, SecType: {}, Currency: {}, Execution: {}".format(reqId, contract.localSymbol, contract.secType, contract.currency, execution))
-        self.order_executed = True
-        self.execDetails_available.set() #internal flag is set to True
+        self.latency.since(('execDetails', execution.orderId), 'placeOrder_to_execDetails', pop=True) # the first fill of the order
+        log.info('In callback ExecDetails. ReqId: %s, Symbol: %s, SecType: %s, Currency: %s, Execution: %s', reqId, contract.localSymbol, contract.secType, contract.currency, execution)
+        self.order_tracker.on_exec_details(contract, execution)
+
+    @iswrapper
+    def commissionReport(self, commissionReport):
+        ''' Commission of an execution. Follows execDetails '''
+        self.order_tracker.on_commission_report(commissionReport)
     
     @iswrapper
     def execDetailsEnd(self, reqId):
-        print("In callback execDetailsEnd. ReqId: {}".format(reqId))
+        log.info('In callback execDetailsEnd. ReqId: %s', reqId)
         self.execDetailsEnd_available.set() #internal flag is set to True
 
     @iswrapper
     def position(self, account, contract, pos, avgCost):
         ''' Provides the portfolios Open Positions'''
         # if contract.symbol == "NIFTY50":
-        print('\nNo. of Positions held in {} : {} '.format(contract.localSymbol, pos))
-        print('The average purchase/selling price: {}'.format(avgCost))
+        log.info('No. of Positions held in %s : %s. The average purchase/selling price: %s', contract.localSymbol, pos, avgCost)
         self.position_dict.update({contract.localSymbol:pos})
 
     @iswrapper
     def positionEnd(self):
         '''Callback positionEnd is trigerred after completing callback position'''
-        print("positionEnd")
+        log.info('positionEnd')
         self.positionEnd_available.set() #internal flag is set to True
     
     # List of all completed Orders since Midnight
@@ -230,38 +230,44 @@ class NiftyORB(EWrapper, EClient):
     def completedOrder(self, contract, order, state):
         ''' Callback to reqCompletedOrders '''
         # print ("In callback completedOrder.")
-        print('For Symbol: {}, the Order Status is: {}, Completed Time is: {}'.format(contract.localSymbol, state.status, state.completedTime ))
+        log.info('For Symbol: %s, the Order Status is: %s, Completed Time is: %s', contract.localSymbol, state.status, state.completedTime)
     
     @iswrapper
     def completedOrdersEnd(self):
         ''' Notifies the end of the completed orders' reception '''
-        print ("completedOrdersEnd")
+        log.info('completedOrdersEnd')
         self.completedOrdersEnd_available.set() #internal flag is set to True
 
+    @iswrapper
+    def connectionClosed(self):
+        ''' The orders still waited on can no longer be followed '''
+        self.order_tracker.on_connection_closed()
+
     @iswrapper    
     def error(self, req_id, code, msg):
         ''' Called if an error occurs '''
+        if code == 103: # Duplicate order id. The local order IDs are behind TWS: resync them from nextValidId
+            self.order_ids.invalidate() # before the rejected order is seen by the waiting thread
+            self.reqIds(-1)
+        self.order_tracker.on_error(req_id, code, msg) # Order Cancelled / Rejected ends the order
         if code == 2104:
-            print('Connections Info - Market data farm connection is OK:hfarm')
+            log.info('Connections Info - Market data farm connection is OK:hfarm')
         elif code == 2106:
-            print('Connections Info - HMDS data farm connection is OK:hkhmds')
+            log.info('Connections Info - HMDS data farm connection is OK:hkhmds')
         elif code == 2158:
-            print('Connections Info - Sec-def data farm connection is OK:secdefhk')
+            log.info('Connections Info - Sec-def data farm connection is OK:secdefhk')
         elif code == 2137:
-            print('Request Id: {}, Code: {}, Message: {}'.format(req_id, code, msg))
+            log.info('Request Id: %s, Code: %s, Message: %s', req_id, code, msg)
         elif code == 206:
-            print('Order Canceled')
+            log.info('Order Canceled')
         elif code == 399: # When order is placed after Exchange Timings.
-            print('Warning Request Id: {}, Warning Code: {}, Warning Message: {}'.format(req_id, code, msg))
-        elif code == 201: # Order Rejected
-            print('Error Request Id: {}, Error Code: {}, Error Message: {}'.format(req_id, code, msg))
-            self.disconnect()
-            os._exit(9999999) # This will exit the entire process without any cleanup
-            # https://stackoverflow.com/questions/905189/why-does-sys-exit-not-exit-when-called-inside-a-thread-in-python
+            log.warning('Warning Request Id: %s, Warning Code: %s, Warning Message: %s', req_id, code, msg)
+        elif code == 201: # Order Rejected. The order tracker ends it as Rejected, and the thread waiting on it goes on
+            log.error('Error Request Id: %s, Error Code: %s, Error Message: %s', req_id, code, msg)
         elif code == 202: # Order Cancelled
-            print('Message Request Id: {}, Code: {}, Message: {}'.format(req_id, code, msg))
+            log.info('Message Request Id: %s, Code: %s, Message: %s', req_id, code, msg)
         else:
-            print('Error Request Id: {}, Error Code: {}, Error Message: {}'.format(req_id, code, msg))
+            log.error('Error Request Id: %s, Error Code: %s, Error Message: %s', req_id, code, msg)
 
     @staticmethod
     def OrderWithStop(parentOrderId:int, action:str, quantity:int, stopLossPrice:float):
@@ -35,21 +35,27 @@ The Inverse of the Long Position is used for a Short Position.
 """
 # Imports used In the program
 from nifty_ORB_main_class import NiftyORB
+from order_tracker import FILLED, REJECTED
+from historical_cache import duration_str
+from callback_logger import start_logging
 from tech_indicators import ATR, SuperTrend
+from bar_clock import BarClock
 
 from ibapi.client import Contract
 from ibapi.order import Order
 from ibapi.execution import ExecutionFilter
 
-import pandas as pd
+from concurrent.futures import TimeoutError
+
 import sys
 import time
 import datetime
-import queue
 import math
 
 import pdb
 
+ORDER_TIMEOUT = 60 # seconds a Market order is waited on, before it is cancelled and the position read back from TWS
+
 # Functions used In the program
 
 # https://stackoverflow.com/questions/28425705/python-rounding-a-floating-point-number-to-nearest-0-05/28425782
@@ -84,29 +90,79 @@ def get_contract_details(client):
     return contract
 
 def get_daily_candle_data(client, contract):
-    ''' Get End of Day Data till Yesterday '''
-    client.historicalDataEnd_available.clear() #internal flag is set to False
-    client.daily_data_requested = True # for name of csv file
-    # query_time = (datetime.datetime.today().date() - timedelta(days=0)).strftime("%Y%m%d %H:%M:%S")
-    query_time = datetime.datetime.now().strftime("%Y%m%d %H:%M:%S") 
-    client.reqHistoricalData(2, contract, query_time, '2 Y', '1 day', 'TRADES', 1, 1, False, [])
-    client.historicalDataEnd_available.wait() # block thread until internal flag is set to True
+    ''' Get End of Day Data till Yesterday. Only the days not yet in the history store are requested '''
+    client.daily_data_requested = True # store the bars in client.daily_bars
+    client.daily_bars.clear()
+    now = datetime.datetime.now()
+    start = now - datetime.timedelta(days=2*365)
+    if client.history_store is None: # No local cache. Download the 2 years
+        requests = [(now.strftime("%Y%m%d %H:%M:%S"), '2 Y', start, now)]
+    else:
+        requests = client.historical_cache.missing_requests(client.local_symbol, '1 day', 'TRADES', start, now)
+
+    for query_time, duration, gap_start, gap_end in requests:
+        print ('Requesting daily candles: {} till {}'.format(duration, query_time))
+        client.historicalDataEnd_available.clear() #internal flag is set to False
+        client.latency.mark(('reqHistoricalData', 2))
+        client.reqHistoricalData(2, contract, query_time, duration, '1 day', 'TRADES', 1, 1, False, [])
+        client.historicalDataEnd_available.wait() # block thread until internal flag is set to True
+        if client.history_store is not None: # historicalDataEnd has written the bars to the history store
+            client.historical_cache.mark_covered(client.local_symbol, '1 day', 'TRADES', gap_start, gap_end)
     # client.cancelHistoricalData(2) # cancel the subscription
+
+    if client.history_store is not None: # the 2 years of daily candles from the history store
+        client.daily_bars.load(client.history_store.read(client.local_symbol, '1 day', start, now))
     client.daily_data_requested = False
     
 def get_minute_candle_data(client, contract):
     ''' Get 5 minute till Now '''
     client.historicalDataEnd_available.clear() #internal flag is set to False
-    client.daily_data_requested = False # for name of csv file as _Minute
+    client.daily_data_requested = False # store the bars in client.minute_bars
+    client.minute_bars.clear()
     query_time = datetime.datetime.now().strftime("%Y%m%d %H:%M:%S")
+    client.latency.mark(('reqHistoricalData', 3))
     client.reqHistoricalData(3, contract, query_time, '45 D', '5 mins', 'TRADES', False, 1, False, [])
     client.historicalDataEnd_available.wait() # block thread until internal flag is set to True
     print ('Finished get_minute_candle_data at time: {}'.format(datetime.datetime.now()))
     # client.cancelHistoricalData(3) # cancel the subscription
 
+def start_minute_candle_feed(client, contract):
+    ''' Backfill 5 minute candles once. Thereafter historicalDataUpdate keeps them up to date in memory '''
+    client.historicalDataEnd_available.clear() #internal flag is set to False
+    client.daily_data_requested = False # store the bars in client.minute_bars
+    client.minute_bars.clear()
+    now = datetime.datetime.now()
+    start = (now - datetime.timedelta(days=45)).replace(hour=0, minute=0, second=0, microsecond=0)
+    window_start = start
+    duration = '45 D'
+    if client.history_store is not None: # Load what is already stored and request only from the first gap till now
+        requests = client.historical_cache.missing_requests(client.local_symbol, '5 mins', 'TRADES', start, now)
+        if requests:
+            start = requests[0][2]
+            duration = duration_str(start, now, '5 mins')
+        client.minute_bars.load(client.history_store.read(client.local_symbol, '5 mins', window_start, start))
+    client.live_feed_reqId = 3
+    # With keepUpToDate=True the endDateTime has to be an empty string
+    print ('Requesting 5 minute candles: {} till now, and keep them up to date'.format(duration))
+    client.latency.mark(('reqHistoricalData', client.live_feed_reqId))
+    client.reqHistoricalData(client.live_feed_reqId, contract, '', duration, '5 mins', 'TRADES', False, 1, True, [])
+    client.historicalDataEnd_available.wait() # block thread until internal flag is set to True
+    if client.history_store is not None: # historicalDataEnd has written the bars to the history store
+        client.historical_cache.mark_covered(client.local_symbol, '5 mins', 'TRADES', start, now)
+    print ('Finished backfill of the live 5 minute candle feed at time: {}'.format(datetime.datetime.now()))
+
+def get_live_minute_candle_data(client):
+    ''' Get 5 minute candles till Now from the live feed. No request is sent to TWS '''
+    # Called after BarClock.wait_for_bar_close has seen the first update of the new bar,
+    # so the bar which just closed has its final values
+    with client.latency.span('live_minute_bars'):
+        df_minute = client.minute_bars.to_df()
+    print ('Finished get_live_minute_candle_data at time: {}'.format(datetime.datetime.now()))
+    return df_minute
+
 def calc_yest_data(client):
     ''' Calculate yesterdays ATR and get yesterdays close'''
-    df_daily = pd.read_csv(client.local_symbol + '_Daily' + '.csv')
+    df_daily = client.daily_bars.to_df()
     df_daily = ATR(df_daily, 14, ohlc=['Open', 'High', 'Low', 'Close'])
     yest_ATR = df_daily['ATR_14'].iloc[-2]
     yest_close = df_daily['Close'].iloc[-2]
@@ -134,8 +190,8 @@ def calc_todays_data(client, df_minute, yest_close):
     print('Todays TR: {}, Todays OR Low: {}, Todays OR High: {}'.format(todays_TR, todays_OR_low, todays_OR_high))
     return todays_TR, todays_OR_low, todays_OR_high
 
-def place_order_with_stop(client, action, quantity, stopLoss):
-    ''' Place the Order with IB '''
+def place_order_with_stop(client, action, quantity, stopLoss, retries=1):
+    ''' Place the Order with IB. An order rejected as a duplicate id (103) is placed again up to retries times '''
     # Define the futures Contract prior to placing order
     contract = Contract()
     contract.localSymbol = client.local_symbol
@@ -144,63 +200,76 @@ def place_order_with_stop(client, action, quantity, stopLoss):
     contract.currency = 'INR'
     contract.primaryExchange = "NSE"
 
-    # Request from TWS, the next valid ID for the order. 
-    client.nextValidId_available.clear() # internal flag is set to False
-    client.reqIds(-1) # The parameter is always ignored.
-    client.nextValidId_available.wait() # block thread until internal flag is set to True
+    # The order IDs come from the local allocator, seeded by nextValidId. No round trip to TWS before the order
+    order_id = client.order_ids.allocate(2) # a contiguous block for the parent and the stopLoss
 
     # Place the order
-    if client.orderId:
-    # for Market Orders use execDetails callback instead of orderStatus
-    # execDetails callback event is trigerred ONLY if the order placed is Executed    
-        client.execDetails_available.clear() # internal flag is set to False
-        if hasattr(client, "orderStatus_queue"): # Clear the existing messages in the Q , if any
-            with client.orderStatus_queue.mutex:
-                client.orderStatus_queue.queue.clear()
-
-        bracket = NiftyORB.OrderWithStop(client.orderId, action, quantity, stopLoss)
+    if order_id:
+        bracket = NiftyORB.OrderWithStop(order_id, action, quantity, stopLoss)
+        # Track the orders before placing them, so that no callback is missed
+        states = [client.order_tracker.track(o.orderId, contract, o) for o in bracket]
         for o in bracket:
             client.orders_list.append(o.orderId)
+            client.latency.mark(('orderStatus', o.orderId), ('execDetails', o.orderId))
             client.placeOrder(o.orderId, contract, o)
-               
+        client.latency.since('bar_close', 'bar_close_to_placeOrder')
+
+        # The parent is a Market Order. Block until it is Filled, Cancelled or Rejected. A late fill is not missed
         try:
-            client.execDetails_available.wait(timeout=5)
-        except:
-            print ('    *** An Exception Occured in client.execDetails_available.wait(timeout=5) in place_order_with_stop ***    ')
-        else: # if try condition is successful with no execption, this 'else' follows
-            if client.order_executed == True:
-                print ("    *** \nOrder is Successfully Executed ***\n")
-            else:
-                print ('    *** \nOrder NOT Executed ***\n')
-            
-            # Handle the q from orderStatus callback
-            # https://stackoverflow.com/questions/6517953/clear-all-items-from-the-queue
-            if hasattr(client, "orderStatus_queue"):
-                while not client.orderStatus_queue.empty(): # If the queue is not empty
-                    try:
-                        order_status = client.orderStatus_queue.get(False)
-                        print('Status of Order: {}, Filled Positions: {}, Remaining Positions: {}, OrderId: {}, permId: {}'.format(order_status['status'], order_status['filled'], order_status['remaining'], order_status['orderId'], order_status['permId']))
-                        if client.orderId == order_status['orderId']: # for the latest orderId
-                            if (order_status['status'] == 'Submitted') or (order_status['status'] == 'Filled'): # if for even 1 message, the status is filled or submitted
-                                client.order_submitted = True                                     
-                    except queue.Empty:
-                        continue
-                    client.orderStatus_queue.task_done() # task_done() is used to inform task completion
-                # del client.orderStatus_queue # Delete the queue
+            parent = wait_for_order(client, states[0])
+        except ConnectionError as e:
+            print ('    *** {} ***    '.format(e))
+            return False
+        if parent is None: # not done in time, and cancelled. The position at TWS tells whether it was filled meanwhile
+            return current_position(client) != 0
+        if parent.outcome == REJECTED and parent.error_code == 103: # the allocator is resyncing from TWS
+            stop_state = states[1] # sent with its parentId pointing at the duplicate id. Make sure it is not left working
+            if stop_state.outcome is None:
+                client.cancelOrder(stop_state.order_id)
+                try:
+                    stop_state.wait(5)
+                except (TimeoutError, ConnectionError):
+                    print ('    *** stopLoss order {} is {} ***    '.format(stop_state.order_id, stop_state.status))
+            if retries > 0:
+                print('Duplicate order id {}. Placing the order again'.format(order_id))
+                return place_order_with_stop(client, action, quantity, stopLoss, retries - 1)
+            print ('    *** \nOrder NOT Executed. Duplicate order id {} again ***\n'.format(order_id))
+            return False
+        if parent.outcome == FILLED:
+            print ("    *** \nOrder is Successfully Executed at {} ***\n".format(parent.avg_fill_price))
+        else:
+            print ('    *** \nOrder NOT Executed. {}: {} ***\n'.format(parent.outcome, parent.error))
     else:
         print ('Order ID not received. Terminating Application')
         client.disconnect()
         sys.exit()
 
-    if (client.order_executed == True) or (client.order_submitted == True):
+    if parent.outcome == FILLED:
         order_placed = True # set flag to True
     else:
         order_placed = False
-
-    client.order_submitted = False # reset the flag to False for future use
-    client.order_executed = False # reset the flag to False for future use
     return order_placed
 
+def wait_for_order(client, state, timeout=ORDER_TIMEOUT):
+    '''
+    Block until the order is Filled, Cancelled or Rejected, for at most timeout seconds. Returns its OrderState.
+    An order still working after timeout (e.g. held in Submitted outside the trading hours) is cancelled: returns None
+    '''
+    try:
+        return state.wait(timeout)
+    except TimeoutError:
+        print ('    *** Order {} is {} after {} seconds. Cancelling it ***    '.format(state.order_id, state.status, timeout))
+        client.cancelOrder(state.order_id) # the stopLoss child of a parent is cancelled with it
+        return None
+
+def current_position(client):
+    ''' The net position of the local symbol at TWS '''
+    client.position_dict.clear()
+    request_positions(client)
+    position = client.position_dict.get(client.local_symbol, 0)
+    print ('# of open positions in local symbol {} is: {}'.format(client.local_symbol, position))
+    return position
+
 def request_positions(client):
     ''' All positions sent initially, and then only updates as positions change '''
     client.positionEnd_available.clear() # internal flag is set to False
@@ -208,7 +277,7 @@ def request_positions(client):
     client.positionEnd_available.wait() # block thread until internal flag is set to True
     client.cancelPositions()
 
-def close_open_position(client, action:str, quantity:int):
+def close_open_position(client, action:str, quantity:int, retries=1):
     quantity = int(quantity)
     print ('Entered Close Position')
     # Define the futures Contract prior to placing order
@@ -225,69 +294,56 @@ def close_open_position(client, action:str, quantity:int):
     order.totalQuantity = quantity
     order.orderType = 'MKT'
 
-    # Request from TWS, the next valid ID for the order. 
-    client.nextValidId_available.clear() # internal flag is set to False
-    client.reqIds(-1) # The parameter is always ignored.
-    client.nextValidId_available.wait() # block thread until internal flag is set to True
+    # The order ID comes from the local allocator, seeded by nextValidId. No round trip to TWS before the order
+    order_id = client.order_ids.allocate()
 
     # Place the order
-    if client.orderId:
-    # for Market Orders use execDetails callback instead of orderStatus
-    # execDetails callback event is trigerred ONLY if the order placed is Executed    
-        client.execDetails_available.clear() # internal flag is set to False
-        if hasattr(client, "orderStatus_queue"): # Clear the existing messages in the Q , if any
-            with client.orderStatus_queue.mutex:
-                client.orderStatus_queue.queue.clear()
-        # Place the order
-        client.placeOrder(client.orderId, contract, order)
+    if order_id:
+        state = client.order_tracker.track(order_id, contract, order) # before placeOrder, so that no callback is missed
+        client.latency.mark(('orderStatus', order_id), ('execDetails', order_id))
+        client.placeOrder(order_id, contract, order)
+        client.latency.since('bar_close', 'bar_close_to_exit_placeOrder')
+
+        # Block until the Market Order is Filled, Cancelled or Rejected. A late fill is not missed
         try:
-            client.execDetails_available.wait(timeout=5)
-        except:
-            print ('    *** An Exception Occured in client.execDetails_available.wait(timeout=5) in close_open_position ***    ')
-        else: # if try condition is successful with no execption, this 'else' follows
-            if client.order_executed == True:
-                print ("    *** \nOrder is Successfully Executed ***\n")
-            else:
-                print ('    *** \nOrder NOT Executed ***\n')
-            # Handle the q from orderStatus callback
-            if hasattr(client, "orderStatus_queue"):
-                while not client.orderStatus_queue.empty(): # If the queue is not empty
-                    try:
-                        order_status = client.orderStatus_queue.get(False)
-                        print('Status of Order: {}, Filled Positions: {}, Remaining Positions: {}, OrderId: {}, permId: {}'.format(order_status['status'], order_status['filled'], order_status['remaining'], order_status['orderId'], order_status['permId']))
-                        if client.orderId == order_status['orderId']: # for the latest orderId
-                            if (order_status['status'] == 'Submitted') or (order_status['status'] == 'Filled'): # if for even 1 message, the status is filled or submitted
-                                client.order_submitted = True                                     
-                    except queue.Empty:
-                        continue
-                    client.orderStatus_queue.task_done() # task_done() is used to inform task completion
-                del client.orderStatus_queue # Delete the queue
+            done = wait_for_order(client, state)
+        except ConnectionError as e:
+            print ('    *** {} ***    '.format(e))
+            return False
+        if done is None: # not done in time, and cancelled. The position at TWS tells whether it was filled meanwhile
+            return current_position(client) == 0
+        if state.outcome == REJECTED and state.error_code == 103: # the allocator is resyncing from TWS
+            if retries > 0:
+                print('Duplicate order id {}. Placing the order again'.format(order_id))
+                return close_open_position(client, action, quantity, retries - 1)
+            print ('    *** \nOrder NOT Executed. Duplicate order id {} again ***\n'.format(order_id))
+            return False
+        if state.outcome == FILLED:
+            print ("    *** \nOrder is Successfully Executed at {} ***\n".format(state.avg_fill_price))
+        else:
+            print ('    *** \nOrder NOT Executed. {}: {} ***\n'.format(state.outcome, state.error))
     else:
         print ('Order ID not received. Terminating Application')
         client.disconnect()
         sys.exit()
 
-    if (client.order_executed == True) or (client.order_submitted == True):
+    if state.outcome == FILLED:
         position_closed = True # set flag to True
     else:
         position_closed = False
-
-    client.order_submitted = False # reset the flag to False for future use
-    client.order_executed = False # reset the flag to False for future use
     return position_closed
 
 def close_open_orders(client):
-    client.openOrder_dict.clear() # Empty the open orders dict
+    # The open orders of every session reach the order tracker through the openOrder callback
     client.openOrderEnd_available.clear()
-    client.openOrder_dict.clear() # Removes all Items from dictionary before making a request for openOrders
     client.reqAllOpenOrders()
     client.openOrderEnd_available.wait(timeout=5)
-    # Cancels an active order placed by from the same API client ID. The last one is orderId of SL
-    # If net connection problem, using orders_list could be problematic. Pick orderId from openOrder callback
+    # Cancels the active orders of the local symbol placed by the same API client ID, i.e. the stopLoss
+    # If net connection problem, using orders_list could be problematic. Pick the orderIds from the order tracker
     # client.cancelOrder(client.orders_list[-1])
-    if client.local_symbol in client.openOrder_dict:
-        print('Open Order ID to be cancelled: {}'.format(client.openOrder_dict[client.local_symbol]))
-        client.cancelOrder(client.openOrder_dict[client.local_symbol])
+    for state in client.order_tracker.live_orders(client.local_symbol):
+        print('Open Order ID to be cancelled: {}'.format(state.order_id))
+        client.cancelOrder(state.order_id)
     # client.reqGlobalCancel() #  will cancel all open orders, regardless of how they were originally placed
 
 def exit_program(client):
@@ -318,13 +374,19 @@ def main():
     while datetime.datetime.now().time() <= pgm_start_time:
         time.sleep(10)
 
-    # Create the client and connect to TWS
+    # Create the client and connect to TWS. The callbacks log through a background writer thread
+    start_logging()
     client = NiftyORB('127.0.0.1', 7497, 0)
     client.nextValidId_available.wait() # block thread until internal flag is set to True
     
     print ('\n   Good to Go Baba. We are Connected to TWS')
     print ('   The Order Id is: {}'.format(client.orderId))
     print ('   The Account Details are: {}\n'.format(client.accountsList))
+
+    client.latency.enabled = True # time the stages from the bar close to the order transmit
+    latency_port = None # e.g. 9464 to serve the timings to Prometheus at http://127.0.0.1:9464/metrics
+    if latency_port:
+        client.latency.serve(latency_port)
     
     # Obtain information about Account
     client.accountSummaryEnd_available.clear() # internal flag is set to False
@@ -338,13 +400,19 @@ def main():
  
     interval_minutes = 5
     order_placed = False
+    live_feed = True # Backfill the 5 minute candles once and keep them up to date, instead of downloading them every loop
+    if live_feed:
+        start_minute_candle_feed(client, contract)
 
+    clock = BarClock(interval_minutes) # wakes up on the 5 minute bar closes, in exchange time
     # while order_placed is False:
     while ((datetime.datetime.now().time() <= market_close_time)):
-        if ((datetime.datetime.now().minute % interval_minutes == 0) and (datetime.datetime.now().second == 0)):
-            print('\nStarting loop_start_time')
-            # print ("datetime minute: {}, datetime second: {}".format(datetime.datetime.now().minute, datetime.datetime.now().second))
-            loop_start_time = time.time() # use this for calculation of Sleep Time
+        # Block until the bar closes. With the live feed, until the first update of the next bar arrives
+        bar_close = clock.wait_for_bar_close(client.new_bar_available if live_feed else None)
+        if bar_close.time() <= market_close_time:
+            print('\nBar closed at: {}. Woke up {:.1f} ms after the bar close'.format(bar_close, clock.jitter_ms[-1]))
+            client.latency.mark('bar_close', ago=clock.jitter_ms[-1] / 1000) # the bar close itself, not the wake up
+            client.latency.record('bar_close_wakeup', clock.jitter_ms[-1] / 1000)
 
             client.currentTime_available.clear() #internal flag is set to False
             client.reqCurrentTime() # Request current time from IB Server
@@ -358,9 +426,12 @@ def main():
             #     pass            
 
             # Get minute Data
-            get_minute_candle_data(client, contract)
-            df_minute = pd.read_csv(client.local_symbol + '_Minute' + '.csv')
-            df_minute['Date'] = pd.to_datetime(df_minute['Date']) # Convert to pandas DateTime format
+            if live_feed:
+                df_minute = get_live_minute_candle_data(client)
+            else:
+                get_minute_candle_data(client, contract)
+                with client.latency.span('minute_bars'):
+                    df_minute = client.minute_bars.to_df()
 
             # Find the time difference of minutes alone between the current time and the last
             # First 5 minute Candlestick starts at 9:15. Second 5 minute Candlestick starts at 9:25 and last candle starts at 15:25 pm
@@ -370,7 +441,9 @@ def main():
                 df_minute = df_minute[:-1] # Drop the last 1 row
 
             # Get today's OR Low, OR High and TR
-            todays_TR, todays_OR_low, todays_OR_high = calc_todays_data(client, df_minute, yest_close)
+            with client.latency.span('calc_todays_data'):
+                todays_TR, todays_OR_low, todays_OR_high = calc_todays_data(client, df_minute, yest_close)
+            client.latency.since('bar_close', 'bar_close_to_decision')
 
             if order_placed is False:
                 if datetime.datetime.now().time() >= my_latest_entry_time:
@@ -436,14 +509,6 @@ def main():
                 close_open_orders(client) # call the function to close all the open orders
                 break # come out of the while loop
 
-            sleep_time = (interval_minutes*60) - (time.time() - loop_start_time) - 60 # incase the first run is at 09:15:28
-            if sleep_time > 0:
-                pass
-            else:
-                sleep_time = 1
-            print('.....Grrr..... Going to Sleep Mode for: {} seconds starting: {}'.format(sleep_time, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-            time.sleep(sleep_time)
-
     # If time is > than 3:15 , then close all open positions, if any, and exit.
 
     # Request All Completed Orders today before disconnecting
@@ -451,6 +516,12 @@ def main():
     client.reqCompletedOrders(True) # apiOnly Orders
     client.completedOrdersEnd_available.wait(timeout=5) # block thread until internal flag is set to True or 10 seconds
 
+    clock.print_jitter()
+    if client.latency.enabled:
+        client.latency.report()
+        client.latency.write_prometheus('nifty_ORB_latency.prom')
+    if live_feed:
+        client.cancelHistoricalData(client.live_feed_reqId) # cancel the keepUpToDate subscription
     client.disconnect()
 
 if __name__ == '__main__':
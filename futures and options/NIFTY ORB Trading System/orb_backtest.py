@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized backtest of the NIFTY ORB strategy over stored 5 minute bars.
+
+Runs the same rules as nifty_ORB_with_Trend_main_pgm.py (use_trend=True) and nifty_ORB_main_pgm.py
+(use_trend=False) for every trading day at once, with NumPy array operations
+instead of a loop over the candles:
+
+    Open Range      : High / Low of the first 5 minute candle of the day, +/- 0.1 percent
+    ATR filter      : no entry once today's TR is more than 75% of yesterday's 14 day ATR. By default
+                      only with use_trend: nifty_ORB_main_pgm.py has the filter commented out
+    Entry           : 5 minute Close above OR High (Long) / below OR Low (Short), before 15:00.
+                      With use_trend, the 5, 15 and 30 minute SuperTrend (14, 2) must all agree
+    Fixed Stop      : 1 daily ATR beyond the other side of the Open Range, rounded to 0.05
+    Exit            : stop hit, or 5 minute SuperTrend turns (use_trend) / Close back beyond the
+                      other side of the Open Range (without use_trend), or 15:15
+    One trade per day. Market orders are filled at the Close of the signal candle +/- slippage.
+
+Decisions are taken at the close of each candle with the candles completed so far, exactly as the
+live programs see them: the 15 and 30 minute SuperTrend include the forming (partial) 15 / 30 minute
+candle, as with resample() or StreamingSuperTrend.peek().
+
+Usage :
+    python orb_backtest.py [minute_csv_file | history store key]
+
+Without an argument, 5 years of synthetic 5 minute candles are used.
+"""
+# Imports used in the program
+from tech_indicators import ATR, SuperTrendArray
+
+import numpy as np
+import pandas as pd
+import datetime
+import sys
+import os
+import time
+
+DEFAULT_PARAMS = {
+    'st_period': 14, # SuperTrend period, all timeframes
+    'st_multiplier': 2, # SuperTrend multiplier
+    'atr_period': 14, # daily ATR period for the filter and the fixed stop
+    'atr_filter': 0.75, # no entry once today's TR > atr_filter * yesterday's ATR. None to disable. Default only with use_trend
+    'or_buffer': 0.001, # Open Range High * (1 + or_buffer), Low * (1 - or_buffer)
+    'latest_entry_time': datetime.time(15,00), # Dont take any new positions after this time
+    'close_time': datetime.time(15,15), # Close all Open Positions at this time
+    'use_trend': True, # 5, 15 and 30 minute SuperTrend agreement for the entry and SuperTrend exit
+    'timeframes': (15, 30), # higher timeframes of the SuperTrend agreement
+    'quantity': 75, # Minimum for Nifty
+    'slippage': 0.5, # points lost on every market fill (entry and exit)
+    'tick_size': 0.05,
+}
+
+UP, DOWN, NAN = 1, -1, 0 # SuperTrend direction codes. NAN before the SuperTrend has a value
+
+def with_defaults(params):
+    '''
+    DEFAULT_PARAMS updated with params. Unless atr_filter is given, the ATR filter is on only with use_trend,
+    as in the live programs: the 75% ATR filter is commented out in nifty_ORB_main_pgm.py
+    '''
+    merged = dict(DEFAULT_PARAMS, **params)
+    if 'atr_filter' not in params and not merged['use_trend']:
+        merged['atr_filter'] = None
+    return merged
+
+def prepare_bars(df_minute, df_daily=None, bar_minutes=5):
+    '''
+    Parameter independent arrays of the bars (a dict of NumPy arrays), computed once per data set.
+    df_daily is optional. Without it the daily candles are built from the 5 minute candles
+    '''
+    dates = pd.to_datetime(df_minute['Date']).values.astype('datetime64[m]')
+    days = dates.astype('datetime64[D]')
+    day_start = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) # index of the first candle of each day
+    day_id = np.cumsum(np.r_[True, days[1:] != days[:-1]]) - 1
+    bars = {
+        'Date': dates,
+        'Open': df_minute['Open'].values.astype(np.float64),
+        'High': df_minute['High'].values.astype(np.float64),
+        'Low': df_minute['Low'].values.astype(np.float64),
+        'Close': df_minute['Close'].values.astype(np.float64),
+        'minute_of_day': (dates - days).astype(np.int64), # minutes since midnight of the candle start
+        'day_id': day_id,
+        'day_start': day_start,
+        'bar_minutes': np.array([bar_minutes]),
+    }
+    bars['todays_high'] = pd.Series(bars['High']).groupby(day_id).cummax().values # today's High / Low so far, per candle
+    bars['todays_low'] = pd.Series(bars['Low']).groupby(day_id).cummin().values
+
+    # Yesterday's Close and the daily candles for yesterday's ATR
+    if df_daily is None:
+        df_daily = pd.DataFrame({'Date': days[day_start], 'Open': bars['Open'][day_start],
+                                 'High': np.maximum.reduceat(bars['High'], day_start),
+                                 'Low': np.minimum.reduceat(bars['Low'], day_start),
+                                 'Close': bars['Close'][np.r_[day_start[1:] - 1, len(dates) - 1]]})
+    daily_dates = pd.to_datetime(df_daily['Date']).values.astype('datetime64[D]')
+    bars['daily_High'] = df_daily['High'].values.astype(np.float64)
+    bars['daily_Low'] = df_daily['Low'].values.astype(np.float64)
+    bars['daily_Close'] = df_daily['Close'].values.astype(np.float64)
+    bars['yest_daily_index'] = np.searchsorted(daily_dates, days[day_start], side='left') - 1 # -1: no yesterday
+    return bars
+
+def daily_atr(bars, atr_period):
+    ''' Yesterday's ATR and Close for every trading day. NaN if there is no yesterday '''
+    df_daily = pd.DataFrame({'Open': bars['daily_Close'], 'High': bars['daily_High'], 'Low': bars['daily_Low'], 'Close': bars['daily_Close']})
+    atr = ATR(df_daily, atr_period)['ATR_' + str(atr_period)].values
+    yest = bars['yest_daily_index']
+    valid = yest >= 0
+    yest_atr = np.where(valid, atr[np.maximum(yest, 0)], np.nan)
+    yest_close = np.where(valid, bars['daily_Close'][np.maximum(yest, 0)], np.nan)
+    return yest_atr, yest_close
+
+def direction(st, close):
+    ''' SuperTrend direction codes, as STX: 'up' / 'down' once the SuperTrend has a value '''
+    return np.where(st > 0.00, np.where(close < st, DOWN, UP), NAN).astype(np.int8)
+
+def supertrend_direction(high, low, close, period, multiplier):
+    ''' Direction of the SuperTrend of every candle, computed over all the candles '''
+    df = pd.DataFrame({'Open': close, 'High': high, 'Low': low, 'Close': close})
+    atr = ATR(df, period)['ATR_' + str(period)].values
+    st, _, _ = SuperTrendArray(high, low, close, atr, period, multiplier)
+    return direction(st, close)
+
+def higher_timeframe_direction(bars, timeframe, period, multiplier):
+    '''
+    Direction of the 'timeframe' minute SuperTrend as seen at the close of every 5 minute candle,
+    i.e. over the completed timeframe candles plus the forming one built from the 5 minute candles so far
+    '''
+    high, low, close = bars['High'], bars['Low'], bars['Close']
+    bucket_key = bars['day_id'] * (1440 // timeframe + 1) + bars['minute_of_day'] // timeframe # same buckets as resample()
+    new_bucket = np.r_[True, bucket_key[1:] != bucket_key[:-1]]
+    bucket_start = np.flatnonzero(new_bucket)
+    bucket_id = np.cumsum(new_bucket) - 1
+
+    # Completed timeframe candles and their SuperTrend state
+    b_high = np.maximum.reduceat(high, bucket_start)
+    b_low = np.minimum.reduceat(low, bucket_start)
+    b_close = close[np.r_[bucket_start[1:] - 1, len(close) - 1]]
+    df = pd.DataFrame({'Open': b_close, 'High': b_high, 'Low': b_low, 'Close': b_close})
+    b_atr = ATR(df, period)['ATR_' + str(period)].values
+    b_st, b_ub, b_lb = SuperTrendArray(b_high, b_low, b_close, b_atr, period, multiplier)
+
+    # The forming candle at each 5 minute candle: running High / Low within the bucket, Close of the 5 minute candle
+    running_high = pd.Series(high).groupby(bucket_id).cummax().values
+    running_low = pd.Series(low).groupby(bucket_id).cummin().values
+
+    # One SuperTrend step from the previous completed candle, as StreamingSuperTrend.update() would do
+    prev = np.maximum(bucket_id - 1, 0)
+    has_prev = bucket_id > 0
+    prev_close = b_close[prev]
+    tr = np.where(has_prev, np.maximum.reduce([running_high - running_low, np.abs(running_high - prev_close), np.abs(running_low - prev_close)]),
+                  running_high - running_low)
+    com = (1 - 1 / period) / (1 / period) # Wilder smoothing, as EMA(alpha=True)
+    smoothing = 1 / (1 + com)
+    prev_atr = b_atr[prev]
+    atr = np.where(prev_atr == tr, prev_atr, ((1 - smoothing) * prev_atr + smoothing * tr) / ((1 - smoothing) + smoothing))
+
+    hl2 = (running_high + running_low) / 2
+    basic_ub = hl2 + multiplier * atr
+    basic_lb = hl2 - multiplier * atr
+    prev_ub, prev_lb, prev_st = b_ub[prev], b_lb[prev], b_st[prev]
+    ub = np.where((basic_ub < prev_ub) | (prev_close > prev_ub), basic_ub, prev_ub)
+    lb = np.where((basic_lb > prev_lb) | (prev_close < prev_lb), basic_lb, prev_lb)
+    st = np.select([(prev_st == prev_ub) & (close <= ub), (prev_st == prev_ub) & (close > ub),
+                    (prev_st == prev_lb) & (close >= lb), (prev_st == prev_lb) & (close < lb)], [ub, lb, lb, ub], 0.00)
+    st = np.where(bucket_id >= period, st, 0.00) # No SuperTrend value in the first 'period' candles
+    return direction(st, close)
+
+def first_per_day(mask, day_id, n_days):
+    ''' Index of the first True of each day, -1 for the days without a True '''
+    idx = np.flatnonzero(mask)
+    first = np.full(n_days, -1, dtype=np.int64)
+    days, pos = np.unique(day_id[idx], return_index=True)
+    first[days] = idx[pos]
+    return first
+
+def round_nearest(x, a):
+    ''' Vectorized round to the nearest multiple of a (0.05 for NIFTY), as round_nearest() of the live programs '''
+    return np.round(np.round(x / a) * a, 2)
+
+def compute_trends(bars, params):
+    ''' 5 minute and higher timeframe SuperTrend directions for the st_period and st_multiplier of params '''
+    p, m = params['st_period'], params['st_multiplier']
+    trend_5 = supertrend_direction(bars['High'], bars['Low'], bars['Close'], p, m)
+    higher = [higher_timeframe_direction(bars, tf, p, m) for tf in params['timeframes']]
+    return trend_5, higher
+
+def run_backtest(bars, cache=None, **params):
+    '''
+    Backtest the ORB rules over all the days in bars. Returns a DataFrame with one row per trade.
+    cache is a dict kept across runs (e.g. of a parameter sweep) for the SuperTrend directions and daily ATR
+    '''
+    params = with_defaults(params)
+    cache = {} if cache is None else cache
+    high, low, close, open_ = bars['High'], bars['Low'], bars['Close'], bars['Open']
+    day_id, day_start = bars['day_id'], bars['day_start']
+    n_days = len(day_start)
+    bar_minutes = int(bars['bar_minutes'][0])
+    decision_minute = bars['minute_of_day'] + bar_minutes # the decision is taken at the close of the candle
+
+    # Open Range and today's True Range so far, per candle
+    first = day_start[day_id]
+    or_high = high[first] * (1 + params['or_buffer'])
+    or_low = low[first] * (1 - params['or_buffer'])
+    key = ('daily_atr', params['atr_period'])
+    if key not in cache:
+        cache[key] = daily_atr(bars, params['atr_period'])
+    yest_atr, yest_close = cache[key]
+    todays_high, todays_low = bars['todays_high'], bars['todays_low']
+    yc = yest_close[day_id]
+    todays_tr = np.maximum.reduce([todays_high - todays_low, np.abs(todays_high - yc), np.abs(todays_low - yc)])
+
+    # Entry signals
+    entry_ok = (decision_minute < params['latest_entry_time'].hour * 60 + params['latest_entry_time'].minute) & ~np.isnan(yest_atr[day_id])
+    if params['atr_filter'] is not None:
+        entry_ok &= todays_tr <= params['atr_filter'] * yest_atr[day_id] # TR only grows: once above, no more entries today
+    long_signal = entry_ok & (close > or_high)
+    short_signal = entry_ok & (close < or_low)
+    if params['use_trend']:
+        key = ('trends', params['st_period'], params['st_multiplier'], tuple(params['timeframes']))
+        if key not in cache:
+            cache[key] = compute_trends(bars, params)
+        trend_5, higher = cache[key]
+        all_up = trend_5 == UP
+        all_down = trend_5 == DOWN
+        for trend in higher:
+            all_up &= trend == UP
+            all_down &= trend == DOWN
+        long_signal &= all_up
+        short_signal &= all_down
+
+    entry_idx = first_per_day(long_signal | short_signal, day_id, n_days)
+    traded = entry_idx >= 0
+    entry_idx_t = entry_idx[traded]
+    side_day = np.zeros(n_days, dtype=np.int8)
+    side_day[traded] = np.where(long_signal[entry_idx_t], 1, -1)
+    stop_day = np.full(n_days, np.nan)
+    stop_day[traded] = round_nearest(np.where(side_day[traded] == 1, or_low[entry_idx_t] - yest_atr[traded], or_high[entry_idx_t] + yest_atr[traded]),
+                                     params['tick_size'])
+
+    # Exit: the first candle after the entry with the stop hit, the exit signal or the close time
+    side, stop = side_day[day_id], stop_day[day_id]
+    in_trade = (side != 0) & (np.arange(len(close)) > entry_idx[day_id])
+    stop_hit = ((side == 1) & (low <= stop)) | ((side == -1) & (high >= stop))
+    if params['use_trend']:
+        exit_signal = ((side == 1) & (trend_5 == DOWN)) | ((side == -1) & (trend_5 == UP))
+    else:
+        exit_signal = ((side == 1) & (close < or_low)) | ((side == -1) & (close > or_high))
+    exit_signal |= decision_minute >= params['close_time'].hour * 60 + params['close_time'].minute
+    exit_idx = first_per_day(in_trade & (stop_hit | exit_signal), day_id, n_days)
+    day_end = np.r_[day_start[1:] - 1, len(close) - 1]
+    exit_idx = np.where(exit_idx >= 0, exit_idx, day_end)[traded] # no exit candle: out at the last candle of the day
+
+    # Fills. A stop gapped through is filled at the Open of the candle
+    side_t = side_day[traded].astype(np.float64)
+    stop_t = stop_day[traded]
+    slippage = params['slippage']
+    entry_price = close[entry_idx_t] + side_t * slippage
+    stopped = stop_hit[exit_idx]
+    stop_fill = np.where(side_t == 1, np.minimum(open_[exit_idx], stop_t), np.maximum(open_[exit_idx], stop_t))
+    exit_price = np.where(stopped, stop_fill, close[exit_idx]) - side_t * slippage
+    points = side_t * (exit_price - entry_price)
+
+    decision_time = lambda i: bars['Date'][i] + np.timedelta64(bar_minutes, 'm')
+    return pd.DataFrame({
+        'EntryTime': decision_time(entry_idx_t).astype('datetime64[ns]'), 'Side': np.where(side_t == 1, 'BUY', 'SELL'),
+        'EntryPrice': entry_price, 'StopLoss': stop_t,
+        'ExitTime': decision_time(exit_idx).astype('datetime64[ns]'), 'ExitPrice': exit_price,
+        'ExitReason': np.where(stopped, 'stop', np.where(decision_minute[exit_idx] >= params['close_time'].hour * 60 + params['close_time'].minute, 'time', 'signal')),
+        'Points': points, 'PnL': points * params['quantity']})
+
+def trade_stats(trades, quantity=75, slippage=0.5):
+    ''' Summary statistics of the trades. PnL is after slippage '''
+    pnl = trades['PnL'].values
+    if len(pnl) == 0:
+        return {'trades': 0, 'net_pnl': 0.0}
+    equity = np.cumsum(pnl)
+    gross_win = pnl[pnl > 0].sum()
+    gross_loss = -pnl[pnl < 0].sum()
+    daily_pnl = trades.groupby(trades['EntryTime'].dt.date)['PnL'].sum()
+    return {
+        'trades': len(pnl),
+        'win_rate': float((pnl > 0).mean()),
+        'net_pnl': float(pnl.sum()),
+        'pnl_before_slippage': float(pnl.sum() + 2 * slippage * quantity * len(pnl)),
+        'avg_pnl': float(pnl.mean()),
+        'profit_factor': float(gross_win / gross_loss) if gross_loss > 0 else np.inf,
+        'max_drawdown': float((np.maximum.accumulate(np.r_[0.0, equity]) - np.r_[0.0, equity]).max()),
+        'sharpe': float(daily_pnl.mean() / daily_pnl.std() * np.sqrt(252)) if daily_pnl.std() > 0 else 0.0,
+    }
+
+def backtest(df_minute, df_daily=None, **params):
+    ''' Backtest the ORB rules over a DataFrame of 5 minute candles. Returns (trades, stats) '''
+    params = with_defaults(params)
+    trades = run_backtest(prepare_bars(df_minute, df_daily), **params)
+    return trades, trade_stats(trades, params['quantity'], params['slippage'])
+
+def load_minute_data(source=None):
+    ''' 5 minute candles of the regular session from a CSV file, a history store key or (source None) 5 years of synthetic candles '''
+    if source is not None and source.endswith('.csv'):
+        df_minute = pd.read_csv(source)
+        df_minute['Date'] = pd.to_datetime(df_minute['Date']) # Convert to pandas DateTime format
+    elif source is not None: # history store key, e.g. the localSymbol of the NIFTY future
+        sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'pandas and csv')) # for history_store
+        from history_store import HistoryStore
+        df_minute = HistoryStore().read(source, '5 mins')
+    else:
+        from benchmark_tech_indicators import synthetic_minute_data
+        df_minute = synthetic_minute_data(days=5*250)
+    return df_minute[df_minute['Date'].dt.time.between(datetime.time(9,15), datetime.time(15,25))].reset_index(drop=True)
+
+def main():
+    df_minute = load_minute_data(sys.argv[1] if len(sys.argv) > 1 else None)
+    print('Number of candles: {}, days: {}'.format(len(df_minute), df_minute['Date'].dt.date.nunique()))
+    if df_minute.empty:
+        print('No 5 minute candles between 9:15 and 15:25. Terminating Application')
+        return
+
+    for use_trend in [True, False]:
+        t0 = time.perf_counter()
+        bars = prepare_bars(df_minute)
+        trades = run_backtest(bars, use_trend=use_trend)
+        elapsed = time.perf_counter() - t0
+        print('\n{} : {:.3f} sec'.format('ORB with Trend' if use_trend else 'ORB', elapsed))
+        print(trades.tail())
+        for key, value in trade_stats(trades).items():
+            print('   {}: {}'.format(key, round(value, 3) if isinstance(value, float) else value))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Portfolio ORB engine: the rules of nifty_ORB_main_pgm.py over many instruments at once.
+
+The state of every instrument is one element of a NumPy array (Open Range High / Low, today's High /
+Low, the last Close, yesterday's ATR and Close, the position, the stop and whether it traded today).
+At the close of each 5 minute candle the completed candles of all the instruments are fed in one call,
+and the entries and exits of all the instruments are evaluated in one vectorized pass:
+
+    engine = ORBEngine(['ACC', 'INFY', ...], quantity=[500, 300, ...])
+    engine.new_day(yest_atr, yest_close) # arrays, one value per instrument
+    engine.load_day(i, high, low, close) # once per instrument, with today's candles completed so far
+    ...
+    engine.update(high, low, close, valid) # every bar close. valid: the instruments with a completed candle
+    side, stop, exits = engine.signals(bar_close.time())
+    engine.entered(np.flatnonzero(side), side[side != 0]) # after the fills
+    engine.exited(np.flatnonzero(exits))
+    engine.sync_positions(client.position_dict) # or from the position callback, e.g. when a stop is hit
+
+The rules are those of orb_backtest.py with use_trend=False, and its defaults:
+
+    Open Range      : High / Low of the first 5 minute candle of the day, +/- 0.1 percent
+    ATR filter      : off, as in nifty_ORB_main_pgm.py. atr_filter=0.75: no entry once today's TR is
+                      more than 75% of yesterday's ATR
+    Entry           : Close above OR High (Long) / below OR Low (Short), before 15:00. One trade per day
+    Fixed Stop      : 1 daily ATR beyond the other side of the Open Range, rounded to the tick size
+    Exit            : Close back beyond the other side of the Open Range, or 15:15
+
+Usage :
+    python orb_engine.py [number of instruments] [number of days]
+
+replays synthetic 5 minute candles of the instruments through the engine, candle by candle, checks
+the trades against orb_backtest.run_backtest and prints the time of one pass over all the instruments.
+"""
+# Imports used in the program
+from orb_backtest import with_defaults, prepare_bars, run_backtest, daily_atr, round_nearest
+
+import numpy as np
+import pandas as pd
+import time
+import sys
+
+FLAT, LONG, SHORT = 0, 1, -1
+
+class ORBEngine:
+    ''' ORB state of n instruments in arrays. Instrument i is symbols[i] '''
+
+    def __init__(self, symbols, **params):
+        if params.get('use_trend'):
+            raise ValueError('The SuperTrend rules (use_trend=True) are not supported by the portfolio engine')
+        self.params = with_defaults(dict(params, use_trend=False))
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)} # symbol : i
+        n = self.n = len(self.symbols)
+        self.quantity = np.broadcast_to(np.asarray(self.params['quantity'], dtype=np.int64), (n,)).copy() # one value, or one per instrument
+        self.tick_size = np.broadcast_to(np.asarray(self.params['tick_size'], dtype=np.float64), (n,)).copy()
+        self.yest_atr = np.full(n, np.nan)
+        self.yest_close = np.full(n, np.nan)
+        self.or_high = np.full(n, np.nan) # NaN until the first candle of the day
+        self.or_low = np.full(n, np.nan)
+        self.todays_high = np.full(n, np.nan)
+        self.todays_low = np.full(n, np.nan)
+        self.close = np.full(n, np.nan) # Close of the last completed candle
+        self.position = np.zeros(n, dtype=np.int64) # signed quantity held
+        self.stop = np.full(n, np.nan) # stop price of the open position
+        self.traded = np.zeros(n, dtype=bool) # an entry was taken today
+        self.latest_entry_minute = self.params['latest_entry_time'].hour * 60 + self.params['latest_entry_time'].minute
+        self.close_minute = self.params['close_time'].hour * 60 + self.params['close_time'].minute
+
+    def new_day(self, yest_atr, yest_close):
+        ''' Start a trading day. The open positions are kept '''
+        self.yest_atr[:] = yest_atr
+        self.yest_close[:] = yest_close
+        for arr in (self.or_high, self.or_low, self.todays_high, self.todays_low, self.close):
+            arr[:] = np.nan
+        self.traded[:] = self.position != 0
+
+    def load_day(self, i, high, low, close):
+        ''' Today's candles of instrument i completed so far, oldest first, e.g. from the backfill at the start of the program '''
+        if len(high) == 0:
+            return
+        buffer = self.params['or_buffer']
+        self.or_high[i] = high[0] * (1 + buffer)
+        self.or_low[i] = low[0] * (1 - buffer)
+        self.todays_high[i] = np.max(high)
+        self.todays_low[i] = np.min(low)
+        self.close[i] = close[-1]
+
+    def update(self, high, low, close, valid=None):
+        ''' The candles of all the instruments which just closed. valid is False for the instruments without a new candle '''
+        if valid is None:
+            valid = ~np.isnan(close)
+        buffer = self.params['or_buffer']
+        first = valid & np.isnan(self.or_high) # the first candle of the day is the Open Range
+        self.or_high[first] = high[first] * (1 + buffer)
+        self.or_low[first] = low[first] * (1 - buffer)
+        self.todays_high[valid] = np.fmax(self.todays_high[valid], high[valid])
+        self.todays_low[valid] = np.fmin(self.todays_low[valid], low[valid])
+        self.close[valid] = close[valid]
+
+    def todays_tr(self):
+        ''' Today's True Range so far of every instrument '''
+        return np.fmax.reduce([self.todays_high - self.todays_low, np.abs(self.todays_high - self.yest_close),
+                               np.abs(self.todays_low - self.yest_close)])
+
+    def signals(self, decision_time):
+        '''
+        Entries and exits of all the instruments at decision_time, the bar close (exchange time).
+        Returns side (LONG / SHORT to enter, FLAT for none), the stop price of the entries and the exit mask
+        '''
+        minute = decision_time.hour * 60 + decision_time.minute
+        flat = self.position == 0
+        can_enter = flat & ~self.traded & ~np.isnan(self.or_high) & ~np.isnan(self.yest_atr)
+        if minute >= self.latest_entry_minute:
+            can_enter[:] = False
+        if self.params['atr_filter'] is not None:
+            can_enter &= self.todays_tr() <= self.params['atr_filter'] * self.yest_atr
+        long_entry = can_enter & (self.close > self.or_high)
+        short_entry = can_enter & (self.close < self.or_low)
+        side = np.where(long_entry, LONG, np.where(short_entry, SHORT, FLAT)).astype(np.int8)
+        stop = np.where(long_entry, self.or_low - self.yest_atr, np.where(short_entry, self.or_high + self.yest_atr, np.nan))
+        stop = round_nearest(stop, self.tick_size)
+
+        exits = ((self.position > 0) & (self.close < self.or_low)) | ((self.position < 0) & (self.close > self.or_high))
+        if minute >= self.close_minute:
+            exits |= ~flat
+        return side, stop, exits
+
+    def stops_hit(self, high, low):
+        ''' The open positions whose stop is inside the candle. The live programs leave this to the stop order at IB '''
+        return ((self.position > 0) & (low <= self.stop)) | ((self.position < 0) & (high >= self.stop))
+
+    def entered(self, idx, side, stop=None):
+        ''' The entries of the instruments idx were filled '''
+        self.position[idx] = side * self.quantity[idx]
+        self.traded[idx] = True
+        if stop is not None:
+            self.stop[idx] = stop
+
+    def exited(self, idx):
+        ''' The positions of the instruments idx were closed '''
+        self.position[idx] = 0
+        self.stop[idx] = np.nan
+
+    def sync_positions(self, positions):
+        ''' Set the positions from a dict symbol : position, e.g. the position callback. The symbols absent are flat '''
+        held = np.zeros(self.n, dtype=np.int64)
+        for symbol, pos in positions.items():
+            i = self.index.get(symbol)
+            if i is not None:
+                held[i] = int(pos)
+        closed = (self.position != 0) & (held == 0)
+        self.stop[closed] = np.nan
+        self.position[:] = held
+
+    def to_df(self):
+        ''' The state of every instrument, one row per symbol '''
+        return pd.DataFrame({'OR_High': self.or_high, 'OR_Low': self.or_low, 'Close': self.close, 'TR': self.todays_tr(),
+                             'ATR': self.yest_atr, 'Position': self.position, 'Stop': self.stop, 'Traded': self.traded},
+                            index=pd.Index(self.symbols, name='Symbol'))
+
+def replay(frames, **params):
+    '''
+    Run the engine candle by candle over the 5 minute candles of several instruments with the same dates
+    (a list of DataFrames). Market orders fill at the Close +/- slippage, stops at the stop price or the Open
+    beyond it. Returns (trades, seconds of every update and signals pass)
+    '''
+    params = with_defaults(dict(params, use_trend=False))
+    slippage = params['slippage']
+    bars = [prepare_bars(df) for df in frames]
+    engine = ORBEngine(['S{}'.format(k) for k in range(len(frames))], **params)
+    high = np.vstack([b['High'] for b in bars])
+    low = np.vstack([b['Low'] for b in bars])
+    close = np.vstack([b['Close'] for b in bars])
+    open_ = np.vstack([b['Open'] for b in bars])
+    atr, yc = zip(*[daily_atr(b, params['atr_period']) for b in bars])
+    atr, yc = np.vstack(atr), np.vstack(yc)
+    first = bars[0]
+    bar_minutes = int(first['bar_minutes'][0])
+    decision = first['Date'] + np.timedelta64(bar_minutes, 'm')
+
+    trades, open_trades, pass_times = [], {}, []
+    for t in range(high.shape[1]):
+        d = first['day_id'][t]
+        if t == first['day_start'][d]:
+            engine.new_day(atr[:, d], yc[:, d])
+        # A stop order at IB is worked inside the candle, before the decision at its close
+        hit = np.flatnonzero(engine.stops_hit(high[:, t], low[:, t]))
+        for i in hit:
+            side = np.sign(engine.position[i])
+            fill = min(open_[i, t], engine.stop[i]) if side > 0 else max(open_[i, t], engine.stop[i])
+            trades.append(open_trades.pop(i) + [decision[t], fill - side * slippage, 'stop'])
+        engine.exited(hit)
+
+        t0 = time.perf_counter()
+        engine.update(high[:, t], low[:, t], close[:, t])
+        side, stop, exits = engine.signals(pd.Timestamp(decision[t]).time())
+        pass_times.append(time.perf_counter() - t0)
+
+        for i in np.flatnonzero(exits):
+            reason = 'time' if pd.Timestamp(decision[t]).time() >= params['close_time'] else 'signal'
+            trades.append(open_trades.pop(i) + [decision[t], close[i, t] - np.sign(engine.position[i]) * slippage, reason])
+        engine.exited(np.flatnonzero(exits))
+        enter = np.flatnonzero(side)
+        for i in enter:
+            open_trades[i] = [engine.symbols[i], decision[t], 'BUY' if side[i] == LONG else 'SELL', close[i, t] + side[i] * slippage, stop[i]]
+        engine.entered(enter, side[enter], stop[enter])
+
+        if t + 1 == high.shape[1] or first['day_id'][t + 1] != d: # no exit candle: out at the last candle of the day
+            for i in list(open_trades):
+                trades.append(open_trades.pop(i) + [decision[t], close[i, t] - np.sign(engine.position[i]) * slippage, 'time'])
+                engine.exited([i])
+
+    trades = pd.DataFrame(trades, columns=['Symbol', 'EntryTime', 'Side', 'EntryPrice', 'StopLoss', 'ExitTime', 'ExitPrice', 'ExitReason'])
+    trades['EntryTime'] = trades['EntryTime'].astype('datetime64[ns]')
+    trades['ExitTime'] = trades['ExitTime'].astype('datetime64[ns]')
+    trades['Points'] = np.where(trades['Side'] == 'BUY', 1, -1) * (trades['ExitPrice'] - trades['EntryPrice'])
+    trades['PnL'] = trades['Points'] * params['quantity']
+    return trades, np.array(pass_times)
+
+def same_trades(a, b):
+    ''' True if two trade tables have the same entries and exits '''
+    if len(a) != len(b):
+        return False
+    for column in ['EntryTime', 'Side', 'ExitTime', 'ExitReason']:
+        if not (a[column].values == b[column].values).all():
+            return False
+    return all(np.allclose(a[column].values, b[column].values) for column in ['EntryPrice', 'StopLoss', 'ExitPrice'])
+
+def main():
+    from benchmark_tech_indicators import synthetic_minute_data
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    frames = [synthetic_minute_data(days=days, start_price=100 + 50 * k, seed=k) for k in range(n)]
+    for df in frames: # the same scale of noise for every price level
+        scale = df['Close'].iloc[0] / 11500.0
+        for column in ['Open', 'High', 'Low', 'Close']:
+            df[column] = df['Close'].iloc[0] + (df[column] - df['Close'].iloc[0]) * scale
+    print('Instruments: {}, days: {}, candles per instrument: {}'.format(n, days, len(frames[0])))
+
+    trades, pass_times = replay(frames)
+    print('Trades: {}, one pass over {} instruments: median {:.1f} microsec, max {:.1f} microsec'.format(
+        len(trades), n, np.median(pass_times) * 1e6, pass_times.max() * 1e6))
+
+    # The same rules, one instrument at a time, with the backtest
+    mismatches = 0
+    for k, df in enumerate(frames):
+        expected = run_backtest(prepare_bars(df), use_trend=False)
+        got = trades[trades['Symbol'] == 'S{}'.format(k)]
+        if not same_trades(expected, got):
+            mismatches += 1
+    print('Instruments whose trades differ from orb_backtest.run_backtest: {}'.format(mismatches))
+
+if __name__ == '__main__':
+    main()
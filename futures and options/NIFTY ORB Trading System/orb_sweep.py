@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweep of the NIFTY ORB strategy over a process pool.
+
+The bars are prepared once (orb_backtest.prepare_bars) and saved as .npy files in a temporary
+directory. Every worker process opens them with np.load(mmap_mode='r'), so all the workers read the
+same pages of the OS page cache instead of each receiving a pickled DataFrame.
+
+The combinations are sent to the workers in chunks, in the order of the SuperTrend parameters, so
+a worker computes the SuperTrend directions of a (period, multiplier) and the daily ATR of a period
+once and reuses them across the chunk.
+
+Usage :
+    python orb_sweep.py [minute_csv_file | history store key] [number of processes]
+
+The result table, one row per combination with its parameters and stats, is written to orb_sweep_results.csv
+"""
+# Imports used in the program
+from orb_backtest import load_minute_data, prepare_bars, run_backtest, trade_stats, with_defaults, DEFAULT_PARAMS
+
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import pandas as pd
+import datetime
+import itertools
+import tempfile
+import time
+import sys
+import os
+
+GRID = {
+    'st_period': [7, 10, 14, 20],
+    'st_multiplier': [1.5, 2, 2.5, 3],
+    'atr_period': [10, 14, 20],
+    'atr_filter': [0.5, 0.75, 1.0, None],
+    'or_buffer': [0.0, 0.0005, 0.001, 0.0015, 0.002],
+    'latest_entry_time': [datetime.time(14,00), datetime.time(14,30), datetime.time(15,00)],
+    'close_time': [datetime.time(15,15), datetime.time(15,25)],
+}
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'orb_sweep_results.csv')
+
+# Per worker process state, set by init_worker
+worker_bars = None
+worker_cache = None
+
+def expand_grid(grid):
+    ''' List of parameter dicts, one per combination, ordered by SuperTrend period and multiplier first '''
+    names = ['st_period', 'st_multiplier'] + [name for name in grid if name not in ('st_period', 'st_multiplier')]
+    values = [grid.get(name, [DEFAULT_PARAMS[name]]) for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def save_bars(bars, directory):
+    ''' Save every bar array as directory/<name>.npy '''
+    for name, array in bars.items():
+        np.save(os.path.join(directory, name + '.npy'), array)
+
+def load_bars(directory, names):
+    ''' Read only memory maps of the bar arrays saved by save_bars '''
+    return {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in names}
+
+def init_worker(directory, names):
+    ''' Runs once in every worker process '''
+    global worker_bars, worker_cache
+    worker_bars = load_bars(directory, names)
+    worker_cache = {} # SuperTrend directions and daily ATR, reused across the combinations of this worker
+
+def run_chunk(chunk):
+    ''' Backtest a list of parameter dicts in a worker. Returns one result row per combination '''
+    rows = []
+    for params in chunk:
+        params = with_defaults(params)
+        trades = run_backtest(worker_bars, worker_cache, **params)
+        rows.append(dict(params, **trade_stats(trades, params['quantity'], params['slippage'])))
+    return rows
+
+def sweep(bars, grid, processes=None, chunk_size=64):
+    ''' Backtest every combination of the grid across a pool of processes. Returns the result table as a DataFrame '''
+    combinations = expand_grid(grid)
+    chunks = [combinations[i:i + chunk_size] for i in range(0, len(combinations), chunk_size)]
+    processes = processes or cpu_count()
+    print('Combinations: {}, chunks: {}, processes: {}'.format(len(combinations), len(chunks), processes))
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        save_bars(bars, directory)
+        with Pool(processes, initializer=init_worker, initargs=(directory, list(bars))) as pool:
+            for i, chunk_rows in enumerate(pool.imap(run_chunk, chunks)):
+                rows.extend(chunk_rows)
+                if (i + 1) % 20 == 0:
+                    print('Combinations done: {} of {}'.format(len(rows), len(combinations)))
+    return pd.DataFrame(rows)
+
+def main():
+    df_minute = load_minute_data(sys.argv[1] if len(sys.argv) > 1 else None)
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    print('Number of candles: {}, days: {}'.format(len(df_minute), df_minute['Date'].dt.date.nunique()))
+    if df_minute.empty:
+        print('No 5 minute candles between 9:15 and 15:25. Terminating Application')
+        return
+
+    t0 = time.perf_counter()
+    table = sweep(prepare_bars(df_minute), GRID, processes)
+    elapsed = time.perf_counter() - t0
+    print('Sweep of {} combinations: {:.1f} sec ({:.2f} millisec per combination)'.format(len(table), elapsed, elapsed / len(table) * 1000))
+
+    table = table.sort_values('net_pnl', ascending=False).reset_index(drop=True)
+    table.to_csv(RESULTS_FILE, index=False)
+    print('Result table written to {}'.format(RESULTS_FILE))
+    columns = list(GRID) + ['trades', 'win_rate', 'net_pnl', 'profit_factor', 'max_drawdown', 'sharpe']
+    print(table[columns].head(10).to_string())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Order lifecycle tracking for the TWS API.
+
+One OrderState per orderId is fed by the callbacks openOrder, orderStatus, execDetails,
+commissionReport and error, in whatever order they arrive. The state moves
+
+    PendingSubmit -> PreSubmitted / Submitted -> Filled | Cancelled | Rejected
+
+and the terminal state resolves a concurrent.futures.Future with the OrderState. Nothing is cleared or
+drained: a fill which arrives late still resolves the future, and still counts in filled / avg_fill_price.
+
+    tracker = OrderTracker()
+    state = tracker.track(order_id, contract, order) # before placeOrder
+    client.placeOrder(order_id, contract, order)
+    state.wait() # blocks until Filled, Cancelled or Rejected. Or asyncio.wrap_future(state.future) in asyncio
+    if state.outcome == FILLED: ...
+
+tracker.live is a dict orderId : OrderState of the orders not yet filled, cancelled or rejected.
+
+The order IDs come from an OrderIdAllocator, seeded once by nextValidId, instead of a reqIds round trip
+to TWS before every order:
+
+    order_ids = OrderIdAllocator()
+    order_ids.seed(orderId) # in nextValidId
+    parent_id = order_ids.allocate(2) # parent_id and parent_id + 1, for a bracket of 2
+    order_ids.invalidate() # on error 103 Duplicate order id, then reqIds. allocate waits for the next nextValidId
+"""
+# Imports used in the program
+from concurrent.futures import Future
+from threading import Lock, Event
+
+FILLED, CANCELLED, REJECTED = 'Filled', 'Cancelled', 'Rejected'
+TERMINAL = {'Filled': FILLED, 'Cancelled': CANCELLED, 'ApiCancelled': CANCELLED, 'Inactive': REJECTED} # orderStatus status : outcome
+REJECT_CODES = {103, 110, 200, 201, 203, 321, 382, 383, 504} # errors for an orderId which end the order
+
+class OrderState:
+    ''' State of one order, from track (or its first callback) to Filled, Cancelled or Rejected '''
+
+    def __init__(self, order_id, contract=None, order=None):
+        self.order_id = order_id
+        self.contract = contract
+        self.order = order
+        self.status = 'PendingSubmit' # the last status of orderStatus / openOrder
+        self.outcome = None # FILLED, CANCELLED or REJECTED once the order is done
+        self.filled = 0.0
+        self.remaining = order.totalQuantity if order is not None else None
+        self.avg_fill_price = 0.0
+        self.perm_id = 0
+        self.parent_id = order.parentId if order is not None else 0
+        self.executions = {} # execId : Execution
+        self.commission = 0.0
+        self.error = None # (code, msg) of the last error for the order
+        self.future = Future() # resolves to this OrderState when the order is done
+
+    @property
+    def local_symbol(self):
+        return self.contract.localSymbol if self.contract is not None else None
+
+    @property
+    def error_code(self):
+        return self.error[0] if self.error is not None else None
+
+    def wait(self, timeout=None):
+        ''' Block until the order is done. Returns this OrderState '''
+        return self.future.result(timeout)
+
+    def __repr__(self):
+        return 'OrderState(orderId={}, {}, status={}, filled={}, avgFillPrice={})'.format(
+            self.order_id, self.local_symbol, self.status, self.filled, self.avg_fill_price)
+
+class OrderTracker:
+    ''' The OrderState of every order of the connection. The on_* methods are called from the callbacks '''
+
+    def __init__(self):
+        self.orders = {} # orderId : OrderState of all the orders seen
+        self.live = {} # orderId : OrderState of the orders not done yet
+        self.exec_orders = {} # execId : orderId, for commissionReport
+        self.lock = Lock()
+
+    def track(self, order_id, contract, order):
+        ''' Start tracking an order. Call before placeOrder, so no callback is missed '''
+        with self.lock:
+            state = self.orders.get(order_id)
+            if state is None or state.outcome is not None:
+                state = self.orders[order_id] = OrderState(order_id, contract, order)
+            else: # a modification of a live order
+                state.contract, state.order = contract, order
+            self.live[order_id] = state
+        return state
+
+    def get(self, order_id):
+        return self.orders.get(order_id)
+
+    def live_orders(self, local_symbol=None):
+        ''' The orders not done yet, of one localSymbol or all '''
+        with self.lock:
+            return [state for state in self.live.values() if local_symbol is None or state.local_symbol == local_symbol]
+
+    def _state(self, order_id):
+        ''' The OrderState of an orderId. Orders placed by an earlier session are tracked from their first callback '''
+        state = self.orders.get(order_id)
+        if state is None:
+            state = self.orders[order_id] = self.live[order_id] = OrderState(order_id)
+        elif state.outcome is None and order_id not in self.live: # followed again after a reconnect
+            state.future = Future()
+            self.live[order_id] = state
+        return state
+
+    def _finish(self, state, outcome):
+        if state.outcome is not None:
+            return
+        state.outcome = outcome
+        self.live.pop(state.order_id, None)
+        if not state.future.done():
+            state.future.set_result(state)
+
+    def on_open_order(self, order_id, contract, order, order_state):
+        with self.lock:
+            state = self._state(order_id)
+            state.contract, state.order = contract, order
+            state.parent_id = order.parentId
+            state.perm_id = order.permId
+            self._update_status(state, order_state.status)
+
+    def on_order_status(self, order_id, status, filled, remaining, avg_fill_price, perm_id, parent_id):
+        with self.lock:
+            state = self._state(order_id)
+            if filled >= state.filled: # orderStatus may arrive out of order with execDetails
+                state.filled, state.remaining, state.avg_fill_price = filled, remaining, avg_fill_price
+            state.perm_id, state.parent_id = perm_id, parent_id
+            self._update_status(state, status)
+
+    def _update_status(self, state, status):
+        if state.outcome is not None: # done. A late duplicate status does not change it
+            return
+        state.status = status
+        if status in TERMINAL:
+            self._finish(state, TERMINAL[status])
+
+    def on_exec_details(self, contract, execution):
+        ''' A fill. Completes the order when the fills add up to its quantity, even before its Filled orderStatus '''
+        with self.lock:
+            state = self._state(execution.orderId)
+            if state.contract is None:
+                state.contract = contract
+            self.exec_orders[execution.execId] = execution.orderId
+            state.executions[execution.execId] = execution
+            if execution.cumQty >= state.filled:
+                state.filled, state.avg_fill_price = execution.cumQty, execution.avgPrice
+            if state.order is not None:
+                state.remaining = state.order.totalQuantity - state.filled
+                if state.remaining <= 0 and state.outcome is None:
+                    state.status = 'Filled'
+                    self._finish(state, FILLED)
+
+    def on_commission_report(self, report):
+        with self.lock:
+            order_id = self.exec_orders.get(report.execId)
+            if order_id is not None:
+                self.orders[order_id].commission += report.commission
+
+    def on_error(self, req_id, code, msg):
+        ''' Returns True if the error is about a tracked order '''
+        with self.lock:
+            state = self.orders.get(req_id)
+            if state is None:
+                return False
+            state.error = (code, msg)
+            if code == 202: # Order Cancelled
+                state.status = 'Cancelled'
+                self._finish(state, CANCELLED)
+            elif code in REJECT_CODES and state.filled == 0:
+                state.status = 'Inactive'
+                self._finish(state, REJECTED)
+            return True
+
+    def on_connection_closed(self):
+        ''' The orders can no longer be followed. Their futures fail with ConnectionError '''
+        with self.lock:
+            for state in list(self.live.values()):
+                if not state.future.done():
+                    state.future.set_exception(ConnectionError('Connection to TWS closed with order {} {}'.format(state.order_id, state.status)))
+            self.live.clear()
+
+class OrderIdAllocator:
+    ''' Hands out order IDs locally. Thread safe, and a block of IDs for a bracket is contiguous '''
+
+    def __init__(self):
+        self.next_id = None
+        self.lock = Lock()
+        self.seeded = Event() # set while next_id is in sync with TWS
+
+    def seed(self, order_id):
+        ''' Called from nextValidId. The IDs never go back: an ID handed out is not handed out again '''
+        with self.lock:
+            if self.next_id is None or order_id > self.next_id:
+                self.next_id = order_id
+            self.seeded.set() #internal flag is set to True
+
+    def allocate(self, count=1, timeout=10):
+        ''' First of count contiguous order IDs. None if not seeded within timeout seconds '''
+        if not self.seeded.wait(timeout): # block thread until seeded by nextValidId
+            return None
+        with self.lock:
+            order_id = self.next_id
+            self.next_id += count
+        return order_id
+
+    def invalidate(self):
+        ''' TWS rejected an ID as a duplicate (error 103). allocate blocks until the next nextValidId '''
+        self.seeded.clear() # internal flag is set to False
@@ -9,6 +9,7 @@ Source of Technical indicator's :
 # Imports used
 import numpy as np
 import pandas as pd
+import copy
 
 # Tech Indicator functions
 def SMA(df, base, target, period):
@@ -107,6 +108,51 @@ def ATR(df, period, ohlc=['Open', 'High', 'Low', 'Close']):
     
     return df
 
+def SuperTrendArray(high, low, close, atr, period, multiplier):
+    """
+    Function to compute SuperTrend on plain NumPy arrays (no pandas indexing)
+    
+    Args :
+        high, low, close : 1-D float arrays of the High, Low and Close prices
+        atr : 1-D float array of the ATR for the same candles (as computed by ATR)
+        period : Integer indicates the period of computation in terms of number of candles
+        multiplier : Integer indicates value to multiply the ATR
+        
+    Returns :
+        st, final_ub, final_lb : 1-D float64 arrays of the SuperTrend and the final upper and lower bands
+    """
+
+    # Compute basic upper and lower bands in one vectorized step
+    hl2 = (np.asarray(high, dtype=np.float64) + np.asarray(low, dtype=np.float64)) / 2
+    atr = np.asarray(atr, dtype=np.float64)
+    basic_ub = (hl2 + multiplier * atr).tolist()
+    basic_lb = (hl2 - multiplier * atr).tolist()
+    closes = np.asarray(close, dtype=np.float64).tolist()
+
+    # The bands and the SuperTrend depend on the previous candle, so walk the candles once.
+    # Python floats from tolist() are much faster to index than pandas .iat or NumPy scalars
+    n = len(closes)
+    final_ub = [0.00] * n
+    final_lb = [0.00] * n
+    st = [0.00] * n
+    for i in range(period, n):
+        prev_ub = final_ub[i - 1]
+        prev_lb = final_lb[i - 1]
+        prev_close = closes[i - 1]
+        ub = basic_ub[i] if basic_ub[i] < prev_ub or prev_close > prev_ub else prev_ub
+        lb = basic_lb[i] if basic_lb[i] > prev_lb or prev_close < prev_lb else prev_lb
+        final_ub[i] = ub
+        final_lb[i] = lb
+
+        prev_st = st[i - 1]
+        c = closes[i]
+        st[i] = ub if prev_st == prev_ub and c <= ub else \
+                lb if prev_st == prev_ub and c >  ub else \
+                lb if prev_st == prev_lb and c >= lb else \
+                ub if prev_st == prev_lb and c <  lb else 0.00
+
+    return np.array(st), np.array(final_ub), np.array(final_lb)
+
 def SuperTrend(df, period, multiplier, ohlc=['Open', 'High', 'Low', 'Close']):
     """
     Function to compute SuperTrend
@@ -153,31 +199,133 @@ def SuperTrend(df, period, multiplier, ohlc=['Open', 'High', 'Low', 'Close']):
                                     Current FINAL UPPERBAND
     """
     
-    # Compute basic upper and lower bands
-    df['basic_ub'] = (df[ohlc[1]] + df[ohlc[2]]) / 2 + multiplier * df[atr]
-    df['basic_lb'] = (df[ohlc[1]] + df[ohlc[2]]) / 2 - multiplier * df[atr]
-
-    # Compute final upper and lower bands
-    df['final_ub'] = 0.00
-    df['final_lb'] = 0.00
-    for i in range(period, len(df)):
-        df['final_ub'].iat[i] = df['basic_ub'].iat[i] if df['basic_ub'].iat[i] < df['final_ub'].iat[i - 1] or df[ohlc[3]].iat[i - 1] > df['final_ub'].iat[i - 1] else df['final_ub'].iat[i - 1]
-        df['final_lb'].iat[i] = df['basic_lb'].iat[i] if df['basic_lb'].iat[i] > df['final_lb'].iat[i - 1] or df[ohlc[3]].iat[i - 1] < df['final_lb'].iat[i - 1] else df['final_lb'].iat[i - 1]
-       
-    # Set the Supertrend value
-    df[st] = 0.00
-    for i in range(period, len(df)):
-        df[st].iat[i] = df['final_ub'].iat[i] if df[st].iat[i - 1] == df['final_ub'].iat[i - 1] and df[ohlc[3]].iat[i] <= df['final_ub'].iat[i] else \
-                        df['final_lb'].iat[i] if df[st].iat[i - 1] == df['final_ub'].iat[i - 1] and df[ohlc[3]].iat[i] >  df['final_ub'].iat[i] else \
-                        df['final_lb'].iat[i] if df[st].iat[i - 1] == df['final_lb'].iat[i - 1] and df[ohlc[3]].iat[i] >= df['final_lb'].iat[i] else \
-                        df['final_ub'].iat[i] if df[st].iat[i - 1] == df['final_lb'].iat[i - 1] and df[ohlc[3]].iat[i] <  df['final_lb'].iat[i] else 0.00 
+    # Compute the final bands and the SuperTrend value on NumPy arrays
+    df[st], _, _ = SuperTrendArray(df[ohlc[1]].values, df[ohlc[2]].values, df[ohlc[3]].values, df[atr].values, period, multiplier)
                  
     # Mark the trend direction up/down
     df[stx] = np.where((df[st] > 0.00), np.where((df[ohlc[3]] < df[st]), 'down',  'up'), np.NaN)
 
-    # Remove basic and final bands from the columns
-    df.drop(['basic_ub', 'basic_lb', 'final_ub', 'final_lb'], inplace=True, axis=1)
-    
     df.fillna(0, inplace=True)
 
     return df
+
+
+# Streaming (incremental) Tech Indicators
+# Each class is updated with one new candle at a time in O(1) and returns the same value, candle by candle,
+# as the batch function above would return for the last row when run over all the candles fed so far.
+
+class StreamingEMA:
+    """
+    Class to compute Exponential Moving Average (EMA) one value at a time. Matches EMA()
+    
+    Args :
+        period : Integer indicates the period of computation in terms of number of candles
+        alpha : Boolean if True indicates to use the formula for computing EMA using alpha (default is False)
+    """
+
+    def __init__(self, period, alpha=False):
+        self.period = period
+        # Same smoothing factor as pandas ewm derives from alpha / span via the center of mass
+        com = (1 - 1 / period) / (1 / period) if alpha == True else (period - 1) / 2
+        self.smoothing = 1 / (1 + com)
+        self.count = 0 # number of values seen so far
+        self.seed_sum = 0.0 # sum of the first 'period' values (Kahan summation, as pandas rolling mean)
+        self.seed_comp = 0.0
+        self.value = 0.00 # 0 until 'period' values are seen, as EMA() after fillna(0)
+
+    def update(self, current_val):
+        ''' Add one new value and return the updated EMA '''
+        self.count += 1
+        if self.count < self.period:
+            self._add_to_seed(current_val)
+        elif self.count == self.period:
+            # The first EMA value is the SMA of the first 'period' values
+            self._add_to_seed(current_val)
+            self.value = self.seed_sum / self.period
+        elif self.value != current_val:
+            old_wt = 1 - self.smoothing
+            self.value = (old_wt * self.value + self.smoothing * current_val) / (old_wt + self.smoothing)
+        return self.value
+
+    def _add_to_seed(self, current_val):
+        ''' Kahan summation of the seed values '''
+        y = current_val - self.seed_comp
+        t = self.seed_sum + y
+        self.seed_comp = (t - self.seed_sum) - y
+        self.seed_sum = t
+
+class StreamingATR:
+    """
+    Class to compute Average True Range (ATR) one candle at a time. Matches ATR()
+    
+    Args :
+        period : Integer indicates the period of computation in terms of number of candles
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.ema = StreamingEMA(period, alpha=True) # Wilder smoothing of the True Range
+        self.prev_close = None
+        self.tr = 0.00
+        self.value = 0.00
+
+    def update(self, high, low, close):
+        ''' Add one new candle and return the updated ATR '''
+        if self.prev_close is None: # First candle has no previous close
+            self.tr = high - low
+        else:
+            self.tr = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+        self.value = self.ema.update(self.tr)
+        return self.value
+
+class StreamingSuperTrend:
+    """
+    Class to compute SuperTrend one candle at a time. Matches SuperTrend()
+    
+    Args :
+        period : Integer indicates the period of computation in terms of number of candles
+        multiplier : Integer indicates value to multiply the ATR
+    """
+
+    def __init__(self, period, multiplier):
+        self.period = period
+        self.multiplier = multiplier
+        self.atr = StreamingATR(period)
+        self.count = 0 # number of candles seen so far
+        self.prev_close = None
+        self.final_ub = 0.00
+        self.final_lb = 0.00
+        self.value = 0.00 # SuperTrend value
+        self.direction = 'nan' # 'up' / 'down'. Same 'nan' marker as SuperTrend() before the first value
+
+    def update(self, high, low, close):
+        ''' Add one new candle and return the updated (SuperTrend value, SuperTrend direction) '''
+        atr = self.atr.update(high, low, close)
+        self.count += 1
+
+        if self.count > self.period: # Same candles as range(period, len(df)) in SuperTrend()
+            basic_ub = (high + low) / 2 + self.multiplier * atr
+            basic_lb = (high + low) / 2 - self.multiplier * atr
+            prev_ub = self.final_ub
+            prev_lb = self.final_lb
+            ub = basic_ub if basic_ub < prev_ub or self.prev_close > prev_ub else prev_ub
+            lb = basic_lb if basic_lb > prev_lb or self.prev_close < prev_lb else prev_lb
+            prev_st = self.value
+            self.value = ub if prev_st == prev_ub and close <= ub else \
+                         lb if prev_st == prev_ub and close >  ub else \
+                         lb if prev_st == prev_lb and close >= lb else \
+                         ub if prev_st == prev_lb and close <  lb else 0.00
+            self.final_ub = ub
+            self.final_lb = lb
+
+        if self.value > 0.00:
+            self.direction = 'down' if close < self.value else 'up'
+        else:
+            self.direction = 'nan'
+        self.prev_close = close
+        return self.value, self.direction
+
+    def peek(self, high, low, close):
+        ''' (SuperTrend value, SuperTrend direction) if the candle were added, without adding it. Use for a forming candle '''
+        return copy.deepcopy(self).update(high, low, close)
@@ -4,13 +4,21 @@ from datetime import datetime, timedelta
 from threading import Thread, Event
 import time
 import pandas as pd
-import sys
+import sys, os
 import collections
 
 from ibapi.client import EClient, Contract
 from ibapi.wrapper import EWrapper
 from ibapi.utils import iswrapper
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'pandas and csv')) # for history_store
+from history_store import HistoryStore
+from historical_cache import HistoricalDataCache
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, error_level
+
+log = get_logger(__name__)
+
 class WriteFuturesToCSV(EWrapper, EClient):
     ''' Serves as the client and the wrapper '''
 
@@ -61,7 +69,7 @@ class WriteFuturesToCSV(EWrapper, EClient):
         self.local_symbol = details.contract.localSymbol
         self.multiplier = details.contract.multiplier
         self.conId = details.contract.conId
-        print ('From contractDetails Callback for local symbol {} , Multiplier is : {} Contract ID is : {}'.format(self.local_symbol, self.multiplier, self.conId))
+        log.info('From contractDetails Callback for local symbol %s , Multiplier is : %s Contract ID is : %s', self.local_symbol, self.multiplier, self.conId)
         
     @iswrapper    
     def contractDetailsEnd(self, req_id: int):
@@ -87,16 +95,19 @@ class WriteFuturesToCSV(EWrapper, EClient):
         self.historicalDataEnd_available.set() #internal flag is set to True
         
     def error(self, req_id, code, msg):
-        print('Error {}: {}'.format(code, msg))
+        log.log(error_level(code), 'Error %s: %s', code, msg)
 
 def main():
-    # Create the client and connect to TWS
+    # Create the client and connect to TWS. The callbacks log through a background writer thread
+    start_logging()
     client = WriteFuturesToCSV('127.0.0.1', 7497, 0)
     client.nextValidId_available.wait() # block thread until internal flag is set to True
     
     print ('\n   Good to Go Baba. We are Connected to TWS')
     print ('   The Order Id is: {}'.format(client.orderId))
     print ('   The Account Details are: {}\n'.format(client.accountsList))
+    history_store = HistoryStore() # columnar on-disk store shared by the programs in this repository
+    historical_cache = HistoricalDataCache(history_store) # request only the days not yet in the history store
 
     # Get expiration dates for contracts
     for count, symbol in enumerate(client.symbols):
@@ -122,38 +133,47 @@ def main():
             contract.localSymbol = client.local_symbol
             contract.multiplier = client.multiplier
             
-            # Initialize the deque
-            client.date_dq.clear()
-            client.open_dq.clear()
-            client.high_dq.clear()
-            client.low_dq.clear()
-            client.close_dq.clear()
-            client.volume_dq.clear()
-            
-            client.historicalDataEnd_available.clear() #internal flag is set to False
+            # 2 years till today. Request only the tail or gaps which are not in the history store yet
+            end_time = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+            start_time = end_time - timedelta(days=2*365)
+            for query_time, duration, gap_start, gap_end in historical_cache.missing_requests(client.local_symbol, '1 day', 'TRADES', start_time, end_time):
+                # Initialize the deque
+                client.date_dq.clear()
+                client.open_dq.clear()
+                client.high_dq.clear()
+                client.low_dq.clear()
+                client.close_dq.clear()
+                client.volume_dq.clear()
+                
+                client.historicalDataEnd_available.clear() #internal flag is set to False
+
+                # Request historical data
+                print ('Requesting {} of daily candles till {}'.format(duration, query_time))
+                client.reqHistoricalData(count, contract, query_time, duration, '1 day', 'TRADES', 1, 1, False, [])
+                client.historicalDataEnd_available.wait() # block thread until internal flag is set to True
+                
+                #  Create List
+                date_list = list(client.date_dq)
+                open_list = list(client.open_dq)
+                high_list = list(client.high_dq)
+                low_list = list(client.low_dq)
+                close_list = list(client.close_dq)
+                volume_list = list(client.volume_dq)
+                combined_list = [date_list, open_list, high_list, low_list, close_list, volume_list]
+                
+                # Add the new candles to the history store
+                df = pd.DataFrame(combined_list).transpose()
+                df.columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+                df['Date'] = pd.to_datetime(df['Date']) # Convert to pandas DateTime format
+                df = df[df.Volume != 0] # Drop all entries for which volume traded = 0
+                history_store.write(client.local_symbol, '1 day', df) # only the new partitions are written
+                historical_cache.mark_covered(client.local_symbol, '1 day', 'TRADES', gap_start, gap_end)
+                
+                combined_list = [] # Empty the List
 
-            # Request historical data
-            query_time = (datetime.today().date() - timedelta(days=0)).strftime("%Y%m%d %H:%M:%S")
-            client.reqHistoricalData(count, contract, query_time, '2 Y', '1 day', 'TRADES', 1, 1, False, [])
-            client.historicalDataEnd_available.wait() # block thread until internal flag is set to True
-            
-            #  Create List
-            date_list = list(client.date_dq)
-            open_list = list(client.open_dq)
-            high_list = list(client.high_dq)
-            low_list = list(client.low_dq)
-            close_list = list(client.close_dq)
-            volume_list = list(client.volume_dq)
-            combined_list = [date_list, open_list, high_list, low_list, close_list, volume_list]
-            
             # Write data to a CSV file
-            df = pd.DataFrame(combined_list).transpose()
-            df.columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
-            df['Date'] = pd.to_datetime(df['Date']) # Convert to pandas DateTime format
-            df = df[df.Volume != 0] # Drop all entries for which volume traded = 0
+            df = history_store.read(client.local_symbol, '1 day', start_time, end_time)
             df.to_csv(client.local_symbol + '.csv', encoding='utf-8', index=False)
-            
-            combined_list = [] # Empty the List
         else:
             print('Could not access contract data')
             sys.exit()
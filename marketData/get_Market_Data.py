@@ -1,4 +1,6 @@
 # Imports for the Program
+from tick_buffer import TickBuffers, TickBarAggregator, BID, ASK, LAST, LAST_SIZE, MIDPOINT, DELAYED_KINDS
+
 from ibapi.client import EClient
 from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract
@@ -8,7 +10,12 @@ from ibapi.utils import iswrapper
 import time
 import threading
 import datetime
-import sys
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, error_level
+
+log = get_logger(__name__)
 
 class TestTradingData(EWrapper, EClient):
     ''' Serves as the Client and the Wrapper '''
@@ -17,6 +24,14 @@ class TestTradingData(EWrapper, EClient):
         EWrapper.__init__(self)
         EClient.__init__(self, self)
         self.orderId = None
+        self.midpoint_ticks = 0 # number of ticks received from tickByTickMidPoint
+        self.ticks = TickBuffers(capacity=65536) # reqId : ring buffer of the ticks, fixed memory per instrument
+        self.bar_aggregators = {} # reqId : list of TickBarAggregator fed with the trades (or midpoints) of the reqId
+        self.last_trade_price = {} # reqId : price of the last LAST tickPrice, traded with the LAST_SIZE tickSize after it
+
+        self.nextValidId_available = threading.Event() # Initialize an Event object
+        self.midpoint_ticks_available = threading.Event() # set after the requested number of midpoint ticks
+        self.historicalDataEnd_available = threading.Event() # Initialize an Event object
 
         # Connect to TWS API
         self.connect(addr, port, client_id)
@@ -29,66 +44,76 @@ class TestTradingData(EWrapper, EClient):
     def nextValidId(self, orderId):
         ''' Provides the next order ID '''
         self.orderId = orderId
+        self.nextValidId_available.set() #internal flag is set to True
         # print('NextValidId: '.format(orderId))
-        print('The order id is: {}'.format(orderId))
+        log.info('The order id is: %s', orderId)
+
+    def record_trade(self, reqId, tick_timestamp, price, size):
+        ''' Store a trade in the ring buffer of the reqId and build the bars of the reqId with it '''
+        self.ticks[reqId].append(tick_timestamp, LAST, price, size)
+        for aggregator in self.bar_aggregators.get(reqId, ()):
+            aggregator.update(tick_timestamp, price, size)
 
     @iswrapper
     def tickByTickMidPoint(self, reqId, tick_timestamp, midpoint):
         ''' Callback to reqTickByTickData '''
-        print('\nThe Midpoint Tick from tickByTickMidPoint Callback: {}'.format(midpoint))
-        print('The timestamp of the realtime tick from tickByTickMidPoint: {}'.format(tick_timestamp))
+        self.ticks[reqId].append(tick_timestamp, MIDPOINT, midpoint)
+        for aggregator in self.bar_aggregators.get(reqId, ()):
+            aggregator.update(tick_timestamp, midpoint)
+        self.midpoint_ticks += 1
+        if self.midpoint_ticks >= 10:
+            self.midpoint_ticks_available.set() #internal flag is set to True
+
+    @iswrapper
+    def tickByTickAllLast(self, reqId, tickType, tick_timestamp, price, size, tickAttribLast, exchange, specialConditions):
+        ''' Callback to reqTickByTickData with 'Last' or 'AllLast'. One call per trade '''
+        self.record_trade(reqId, tick_timestamp, price, float(size))
 
     @iswrapper
     def tickPrice(self, reqId, field, price, attribs):
-        ''' Callback to reqMktData '''
-        print('\nFrom tickPrice callback - field is: {}'.format(field))
-        if field == 1:
-            self.bid_price = price
-            print('Bid Price is: {}'.format(price))
-        elif field == 2:
-            self.ask_price = price
-            print('Ask Price is: {}'.format(price))
-        elif field == 4:
-            self.last_price = price # Last price at which the contract traded
-            print('Last Price is: {}'.format(price))
-        elif field == 6:
-            self.high_price = price
-            print ('High Price is: {}'.format(price))
-        elif field == 7:
-            self.low_price = price
-            print ('Low Price is: {}'.format(price))
-        elif field == 9:
-            self.close_price = price # The last available closing price for the previous day
-            print('Close Price is: {}'.format(price))
-        elif (field == 66 or field == 67 or field == 68 or field == 72 or field == 73 or field == 75): # Codes used for delayed data
-            self.delayed_price = price 
-            print('Delayed  Price is: {}'.format(price))       
-    
+        ''' Callback to reqMktData. BID (1), ASK (2), HIGH (6), LOW (7), CLOSE (9), ... go to the ring buffer as they come '''
+        field = DELAYED_KINDS.get(field, field) # Codes used for delayed data are stored as their live codes
+        if field == LAST: # Last price at which the contract traded. Stored with its size, by tickSize
+            self.last_trade_price[reqId] = price
+        else:
+            self.ticks[reqId].append(time.time(), field, price)
+
     @iswrapper
     def tickSize(self, reqId, field, size):
-        ''' Callback to reqMktData '''
-        print('\nFrom tickSize callback - Requested field is: {} and Size is: {}'.format(field, size))
+        ''' Callback to reqMktData. A LAST_SIZE is one trade, at the last LAST price '''
+        field = DELAYED_KINDS.get(field, field)
+        if field == LAST_SIZE and reqId in self.last_trade_price:
+            self.record_trade(reqId, time.time(), self.last_trade_price[reqId], float(size))
 
     @iswrapper
     def realtimeBar(self, reqId, bar_timestamp, open, high, low, close, volume, WAP, count):
-        ''' Callback to reqMktData '''
-        print('\nOpen: {}, High: {}, Low: {}, Close: {} at Bar Timestamp: {}'.format(open, high, low, close, bar_timestamp))
+        ''' Callback to reqRealTimeBars. The 5 second bars are rolled up into the time bars of the reqId '''
+        for aggregator in self.bar_aggregators.get(reqId, ()):
+            aggregator.update_bar(bar_timestamp, open, high, low, close, float(volume))
 
     @iswrapper
     def historicalData(self, reqId, bar):
         ''' Callback to reqHistoricalData '''
-        print('\nOpen: {}, High: {}, Low: {}, Close: {}'.format(bar.open, bar.high, bar.low, bar.close))
+        log.info('Open: %s, High: %s, Low: %s, Close: %s', bar.open, bar.high, bar.low, bar.close)
+
+    @iswrapper
+    def historicalDataEnd(self, reqId, start, end):
+        '''Marks the ending of the historical bars reception.'''
+        self.historicalDataEnd_available.set() #internal flag is set to True
 
     @iswrapper    
     def error(self, reqId, code, msg):
-        print('Error Code: {}'.format(code))
-        print('Error Message: {}'.format(msg))
+        log.log(error_level(code), 'Error Code: %s, Error Message: %s', code, msg)
+        if reqId == 1: # No tick by tick data. Do not wait for the ticks
+            self.midpoint_ticks_available.set() #internal flag is set to True
+        elif reqId == 4: # The historical data request failed. There will be no historicalDataEnd
+            self.historicalDataEnd_available.set() #internal flag is set to True
 
 def main():
-    # Create the client and Connect to TWS API
+    # Create the client and Connect to TWS API. The callbacks log through a background writer thread
+    start_logging()
     client = TestTradingData('127.0.0.1', 7497, 7)
-    time.sleep(3) #Sleep interval to allow time for connection to server
-    client.orderId = None
+    client.nextValidId_available.wait(timeout=10) # block thread until we are connected to TWS
 
     # Define a Contract
     # contract = Contract()
@@ -103,9 +128,24 @@ def main():
     contract.currency = 'INR' 
     contract.primaryExchange = "NSE"
 
+    # Allocate the tick ring buffers, and build bars locally instead of waiting for the historical bars
+    for reqId in (1, 2, 5):
+        client.ticks.add(reqId)
+    client.bar_aggregators[1] = [TickBarAggregator('tick', 5)] # a bar every 5 midpoints
+    client.bar_aggregators[2] = [TickBarAggregator('time', 60), TickBarAggregator('volume', 1000)] # 1 minute and 1000 shares bars
+    client.bar_aggregators[3] = [TickBarAggregator('time', 60)] # 1 minute bars from the 5 second bars
+    client.bar_aggregators[5] = [TickBarAggregator('time', 60), TickBarAggregator('tick', 100)] # 1 minute and 100 trade bars
+    for reqId, aggregators in client.bar_aggregators.items():
+        for aggregator in aggregators:
+            aggregator.subscribe(lambda bar, reqId=reqId, aggregator=aggregator: log.info('ReqId: %s, %s %s bar: %s',
+                reqId, aggregator.size, aggregator.bar_type, bar))
+
     # Define 10 Ticks containing midpoint data
     client.reqTickByTickData(1, contract, 'MidPoint', 10, True)
 
+    # Stream every trade
+    client.reqTickByTickData(5, contract, 'AllLast', 0, False)
+
     # Request market data
     client.reqMarketDataType(4) # Switch to live (1) frozen (2) delayed (3) delayed frozen (4).
     client.reqMktData(2, contract, '', False, False, [])
@@ -117,8 +157,26 @@ def main():
     now = datetime.datetime.now().strftime("%Y%m%d, %H:%M:%S")
     client.reqHistoricalData(4, contract, now, '2 D', '5 mins', 'BID', False, 1, False, [])
 
-    # Disconnect from TWS
-    time.sleep(10)
+    # Wait until the historical bars and the 10 midpoint ticks have arrived, at most 10 seconds in all
+    deadline = time.monotonic() + 10
+    client.historicalDataEnd_available.wait(timeout=max(0, deadline - time.monotonic()))
+    client.midpoint_ticks_available.wait(timeout=max(0, deadline - time.monotonic()))
+
+    # Complete the bars whose time is up, and show what the ring buffers hold
+    for aggregators in client.bar_aggregators.values():
+        for aggregator in aggregators:
+            aggregator.flush()
+    for reqId in client.ticks:
+        ring = client.ticks[reqId]
+        print('ReqId: {}, ticks received: {}, held: {}, last bid: {}, last ask: {}, last trade: {}'.format(
+            reqId, ring.total, len(ring), ring.last(BID), ring.last(ASK), ring.last(LAST)))
+    print('Memory of the tick ring buffers: {:.1f} MB'.format(client.ticks.memory() / 1e6))
+
+    # Cancel the streaming requests and disconnect from TWS
+    client.cancelTickByTickData(1)
+    client.cancelTickByTickData(5)
+    client.cancelMktData(2)
+    client.cancelRealTimeBars(3)
     client.disconnect()
     
 if __name__ == "__main__":
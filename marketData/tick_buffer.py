@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed memory tick buffers and tick to bar aggregation.
+
+Every reqId (one instrument) gets a TickRing: preallocated NumPy arrays of time, kind, price and size,
+written round. When the ring is full the oldest tick is overwritten, so the memory per instrument
+stays capacity * 25 bytes however long the stream runs (65536 ticks, about 1.6 MB, by default).
+
+    ticks = TickBuffers(capacity=65536)
+    ticks[req_id].append(time.time(), LAST, price, size) # in tickPrice / tickSize / tickByTickAllLast ...
+    ticks[req_id].last(BID) # (time, price, size) of the latest bid
+    ticks[req_id].arrays() # copies of the ticks held, oldest first
+
+A TickBarAggregator builds bars from the trades of one instrument, without waiting for the HMDS
+(historical data) bars:
+
+    bars_1_min = TickBarAggregator('time', 60) # a bar every 60 seconds, counted from midnight UTC
+    bars_500 = TickBarAggregator('tick', 500) # a bar every 500 trades
+    bars_vol = TickBarAggregator('volume', 10000) # a bar every 10000 shares / lots traded
+    bars_1_min.subscribe(lambda bar: print(bar)) # callback(bar) with every completed TickBar
+    bars_1_min.update(time, price, size) # one trade
+    bars_1_min.flush() # complete the time bar once its end has passed, even if no trade came after it
+
+Times are epoch seconds (float), as in tickByTickAllLast. reqMktData ticks have no time of their own
+and are stamped with time.time() on arrival.
+"""
+# Imports used
+from ibapi.ticktype import TickTypeEnum
+
+import numpy as np
+import pandas as pd
+
+from threading import Lock
+
+import datetime
+import time
+
+# Kinds of tick: the TickType numbers of reqMktData (BID, ASK, LAST, HIGH, LOW, CLOSE, ...), and MIDPOINT which has no TickType
+BID, ASK, LAST, LAST_SIZE = TickTypeEnum.BID, TickTypeEnum.ASK, TickTypeEnum.LAST, TickTypeEnum.LAST_SIZE
+MIDPOINT = 255
+DELAYED_KINDS = {66: 1, 67: 2, 68: 4, 71: 5, 72: 6, 73: 7, 75: 9} # TickType of reqMarketDataType(3 or 4) : the live TickType
+
+class TickRing:
+    ''' Preallocated ring buffer of the ticks of one instrument. Safe to append from the client thread and read from the main thread '''
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64) # epoch seconds
+        self.kinds = np.zeros(capacity, dtype=np.uint8)
+        self.prices = np.zeros(capacity, dtype=np.float64)
+        self.sizes = np.zeros(capacity, dtype=np.float64) # float, as the sizes of some instruments are fractional
+        self.total = 0 # number of ticks ever appended. The next tick goes to total % capacity
+        self.latest = {} # kind : (time, price, size) of the latest tick of that kind
+        self.lock = Lock()
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, time_, kind, price, size=0.0):
+        with self.lock:
+            i = self.total % self.capacity
+            self.times[i] = time_
+            self.kinds[i] = kind
+            self.prices[i] = price
+            self.sizes[i] = size
+            self.total += 1
+            self.latest[kind] = (time_, price, size)
+
+    def last(self, kind=LAST):
+        ''' (time, price, size) of the latest tick of a kind, or None '''
+        return self.latest.get(kind)
+
+    def arrays(self, since=0):
+        '''
+        Copies of the ticks held, oldest first, as a dict with keys 'Time', 'Kind', 'Price', 'Size'.
+        since is a value of total from an earlier call: only the ticks appended after it are returned, as far as they are still held
+        '''
+        with self.lock:
+            start = max(since, self.total - self.capacity)
+            order = np.arange(start, self.total) % self.capacity
+            return {'Time': self.times[order], 'Kind': self.kinds[order], 'Price': self.prices[order], 'Size': self.sizes[order]}
+
+    def to_df(self, since=0):
+        ''' DataFrame with columns ['Time', 'Kind', 'Price', 'Size'] of the ticks held. Time as datetime64[ns] UTC '''
+        df = pd.DataFrame(self.arrays(since))
+        df['Time'] = pd.to_datetime(df['Time'], unit='s', utc=True)
+        df['Kind'] = df['Kind'].map({kind: 'MIDPOINT' if kind == MIDPOINT else TickTypeEnum.to_str(kind) for kind in df['Kind'].unique()})
+        return df
+
+class TickBuffers:
+    ''' One TickRing per reqId, created with the same capacity on the first tick of the reqId or by add '''
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.rings = {} # reqId : TickRing
+
+    def add(self, req_id, capacity=None):
+        ''' Allocate the ring of a reqId before its request, so no memory is allocated in the callbacks '''
+        ring = self.rings[req_id] = TickRing(capacity or self.capacity)
+        return ring
+
+    def __getitem__(self, req_id):
+        ring = self.rings.get(req_id)
+        return ring if ring is not None else self.add(req_id)
+
+    def __contains__(self, req_id):
+        return req_id in self.rings
+
+    def __iter__(self):
+        return iter(self.rings)
+
+    def memory(self):
+        ''' Bytes allocated by all the rings '''
+        return sum(r.times.nbytes + r.kinds.nbytes + r.prices.nbytes + r.sizes.nbytes for r in self.rings.values())
+
+class TickBar:
+    ''' One bar built from ticks. start / end are epoch seconds of the first and last tick (for time bars, of the bucket) '''
+    __slots__ = ['start', 'end', 'open', 'high', 'low', 'close', 'volume', 'count']
+
+    def __init__(self, start, price):
+        self.start = start
+        self.end = start
+        self.open = self.high = self.low = self.close = price
+        self.volume = 0.0
+        self.count = 0 # number of ticks in the bar
+
+    @property
+    def date(self):
+        ''' start as a local datetime '''
+        return datetime.datetime.fromtimestamp(self.start)
+
+    def __repr__(self):
+        return 'TickBar({}, O={}, H={}, L={}, C={}, V={}, ticks={})'.format(
+            self.date, self.open, self.high, self.low, self.close, self.volume, self.count)
+
+class TickBarAggregator:
+    ''' Builds time ('time', size seconds), tick count ('tick', size ticks) or volume ('volume', size) bars from trades '''
+
+    BAR_TYPES = ('time', 'tick', 'volume')
+
+    def __init__(self, bar_type='time', size=60):
+        if bar_type not in self.BAR_TYPES:
+            raise ValueError('bar_type must be one of {}, not {}'.format(self.BAR_TYPES, bar_type))
+        self.bar_type = bar_type
+        self.size = size
+        self.forming = None # the bar being built
+        self.subscribers = []
+        self.lock = Lock()
+
+    def subscribe(self, callback):
+        ''' callback(bar) is called with every completed TickBar '''
+        self.subscribers.append(callback)
+
+    def update(self, time_, price, size=0.0):
+        ''' Consume one trade (or midpoint tick, with size 0) '''
+        with self.lock:
+            if self.bar_type == 'time':
+                start = time_ - time_ % self.size
+                if self.forming is not None and self.forming.start != start: # a tick of a later bucket: the forming bar is complete
+                    self._emit()
+                self._add(start, time_, price, size)
+                self.forming.end = start + self.size
+            elif self.bar_type == 'tick':
+                self._add(time_, time_, price, size)
+                if self.forming.count >= self.size:
+                    self._emit()
+            else: # volume. A trade larger than what the bar lacks is split across the bars it completes
+                while True:
+                    self._add(time_, time_, price, 0.0)
+                    lacking = self.size - self.forming.volume
+                    if size < lacking:
+                        self.forming.volume += size
+                        break
+                    self.forming.volume = float(self.size)
+                    size -= lacking
+                    self._emit()
+                    if size <= 0:
+                        break
+
+    def update_bar(self, time_, open_, high, low, close, volume):
+        ''' Consume a smaller bar, e.g. the 5 second bars of realtimeBar, into time bars. time_ is the start of the bar '''
+        if self.bar_type != 'time':
+            raise ValueError('Only time bars can be built from bars')
+        with self.lock:
+            start = time_ - time_ % self.size
+            if self.forming is not None and self.forming.start != start:
+                self._emit()
+            if self.forming is None:
+                self.forming = TickBar(start, open_)
+                self.forming.end = start + self.size
+            bar = self.forming
+            bar.high = max(bar.high, high)
+            bar.low = min(bar.low, low)
+            bar.close = close
+            bar.volume += volume
+            bar.count += 1
+
+    def flush(self, now=None):
+        '''
+        Time bars: complete the forming bar if its end is at or before now (default time.time()).
+        Tick and volume bars: complete the forming bar as it is. Returns the completed bar or None
+        '''
+        with self.lock:
+            bar = self.forming
+            if bar is None:
+                return None
+            if self.bar_type == 'time' and bar.end > (time.time() if now is None else now):
+                return None
+            self._emit()
+            return bar
+
+    def _add(self, start, time_, price, size):
+        ''' Add a tick to the forming bar, or start one with it. Without taking the lock '''
+        bar = self.forming
+        if bar is None:
+            bar = self.forming = TickBar(start, price)
+        else:
+            if price > bar.high:
+                bar.high = price
+            elif price < bar.low:
+                bar.low = price
+            bar.close = price
+        bar.end = time_
+        bar.volume += size
+        bar.count += 1
+
+    def _emit(self):
+        bar, self.forming = self.forming, None
+        for callback in self.subscribers:
+            callback(bar)
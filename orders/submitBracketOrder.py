@@ -5,9 +5,13 @@ from ibapi.contract import Contract
 from ibapi.order import Order
 from ibapi.utils import iswrapper
 
-import time
 import threading
-import sys
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, error_level
+
+log = get_logger(__name__)
 
 class TestBracketOrder(EWrapper, EClient):
     ''' Serves as the Client and the Wrapper '''
@@ -16,6 +20,11 @@ class TestBracketOrder(EWrapper, EClient):
         EWrapper.__init__(self)
         EClient.__init__(self, self)
         self.orderId = None
+        self.max_wait_time = 10 # seconds to wait for the end of a request
+
+        self.nextValidId_available = threading.Event() # Initialize an Event object
+        self.openOrderEnd_available = threading.Event() # Initialize an Event object
+        self.positionEnd_available = threading.Event() # Initialize an Event object
 
         # Connect to TWS API
         self.connect(addr, port, client_id)
@@ -28,48 +37,50 @@ class TestBracketOrder(EWrapper, EClient):
     def nextValidId(self, orderId):
         ''' Provides the next order ID '''
         self.orderId = orderId
-        print('\nThe order id is: {}'.format(orderId))
+        self.nextValidId_available.set() #internal flag is set to True
+        log.info('The order id is: %s', orderId)
 
     @iswrapper
     def openOrder(self, orderId, contract, order, state):
         ''' Callback for the submitted order '''
-        print('Order Status: {}'.format(state.status))
-        print('The accounts current initail margin: {}'.format(state.initMarginBefore))
-        print('The accounts current maintanence margin: {}'.format(state.maintMarginBefore))
-        print('Comission Charged: {}'.format(state.commission))
-        print('Completed Time: {}'.format(state.completedTime))
-        print('Warning Text: {}'.format(state.warningText))
+        log.info('Order Status: %s, The accounts current initail margin: %s, The accounts current maintanence margin: %s, '
+                 'Comission Charged: %s, Completed Time: %s, Warning Text: %s', state.status, state.initMarginBefore,
+                 state.maintMarginBefore, state.commission, state.completedTime, state.warningText)
+
+    @iswrapper
+    def openOrderEnd(self):
+        ''' Marks the end of the open orders sent after reqOpenOrders '''
+        self.openOrderEnd_available.set() #internal flag is set to True
         
     @iswrapper
     def orderStatus(self, orderId, status, filled, remaining, avgFillPrice, permId, parentId, lastFillPrice, clientId, whyHeld, mktCapPrice):
         ''' Check the status of the submitted order '''
-        print('Status of Order: {}'.format(status))
-        print('No. of Filled Positions: {}'.format(filled))
-        print('No. of remaining positions: {}'.format(remaining))
-        print('Why Held: {}'.format(whyHeld)) # value 'locate'used when trying to locate shares for short sell
-        print('Average Fill Price: {}'.format(avgFillPrice))
-        print('permId: {}'.format(permId))
+        # Why Held value 'locate' used when trying to locate shares for short sell
+        log.info('Status of Order: %s, No. of Filled Positions: %s, No. of remaining positions: %s, Why Held: %s, Average Fill Price: %s, permId: %s',
+                 status, filled, remaining, whyHeld, avgFillPrice, permId)
 
     @iswrapper
     def position(self, account, contract, pos, avgCost):
         ''' Provides the portfolios Open Positions'''
-        print('No. of Positions held in {} : {} '.format(contract.symbol, pos))
-        print('The average cost of the position: {}'.format(avgCost))
+        log.info('No. of Positions held in %s : %s, The average cost of the position: %s', contract.symbol, pos, avgCost)
+
+    @iswrapper
+    def positionEnd(self):
+        ''' Marks the end of the positions sent after reqPositions '''
+        self.positionEnd_available.set() #internal flag is set to True
 
     @iswrapper
     def accountSummary(self, reqId, account, tag, value, currency):
         '''Read Information about the Account'''
-        print('Account {} : {} = {}'.format(account, tag, value))
-        print('The currency on which the Value is expressed: {}'.format(currency))
+        log.info('Account %s : %s = %s, The currency on which the Value is expressed: %s', account, tag, value, currency)
 
     @iswrapper    
     def error(self, reqId, code, msg):
-        print('Error Code: {}'.format(code))
-        print('Error Message: {}'.format(msg))
+        log.log(error_level(code), 'Error Code: %s, Error Message: %s', code, msg)
 
     @iswrapper
     def execDetails(self, req_id, contract, execution):
-        print('Order Executed: ', req_id, contract.symbol, contract.secType, contract.currency, execution.execId, execution.orderId, execution.shares, execution.lastLiquidity)
+        log.info('Order Executed: %s %s %s %s %s %s %s %s', req_id, contract.symbol, contract.secType, contract.currency, execution.execId, execution.orderId, execution.shares, execution.lastLiquidity)
     
     @staticmethod
     def BracketOrder(parentOrderId:int, action:str, quantity:float, limitPrice:float, takeProfitLimitPrice:float, stopLossPrice:float):
@@ -110,9 +121,10 @@ class TestBracketOrder(EWrapper, EClient):
         return bracketOrder
 
 def main():
-    # Create the client and Connect to TWS API
+    # Create the client and Connect to TWS API. The callbacks log through a background writer thread
+    start_logging()
     client = TestBracketOrder('127.0.0.1', 7497, 7)
-    time.sleep(3)
+    client.nextValidId_available.wait(timeout=client.max_wait_time) # block thread until we are connected to TWS
     client.orderId = None
 
     # Define a Contract
@@ -124,22 +136,26 @@ def main():
     contract.primaryExchange = "NSE"
 
     # Request from TWS, the next valid ID for the order
+    client.nextValidId_available.clear() #internal flag is set to False
     client.reqIds(1)
-    time.sleep(3)
+    client.nextValidId_available.wait(timeout=client.max_wait_time) # block thread until nextValidId
 
     # Place a Bracket Order
     if client.orderId:
         bracket = TestBracketOrder.BracketOrder(client.orderId, "BUY", 100, 30, 40, 20)
         for o in bracket:
             client.placeOrder(o.orderId, contract, o)
-        time.sleep(3)
+        # The open orders of this client, with the bracket, are sent back followed by openOrderEnd
+        client.reqOpenOrders()
+        client.openOrderEnd_available.wait(timeout=client.max_wait_time) # block thread until openOrderEnd
     else:
         print ('Order ID not received. Terminating Application')
         sys.exit()
     
     # Obtain information about open positions
     client.reqPositions()
-    time.sleep(3)
+    client.positionEnd_available.wait(timeout=client.max_wait_time) # block thread until positionEnd
+    client.cancelPositions()
 
     # Disconnect from TWS
     client.disconnect()
@@ -7,7 +7,12 @@ from ibapi.utils import iswrapper
 
 import time
 import threading
-import sys
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, error_level
+
+log = get_logger(__name__)
 
 class TestLimitOrder(EWrapper, EClient):
     ''' Serves as the Client and the Wrapper '''
@@ -28,47 +33,39 @@ class TestLimitOrder(EWrapper, EClient):
     def nextValidId(self, orderId):
         ''' Provides the next order ID '''
         self.orderId = orderId
-        print('\nThe order id is: {}'.format(orderId))
+        log.info('The order id is: %s', orderId)
 
     @iswrapper
     def openOrder(self, orderId, contract, order, state):
         ''' Callback for the submitted order '''
-        print('Order Status: {}'.format(state.status))
-        print('The accounts current initail margin: {}'.format(state.initMarginBefore))
-        print('The accounts current maintanence margin: {}'.format(state.maintMarginBefore))
-        print('Comission Charged: {}'.format(state.commission))
-        print('Completed Time: {}'.format(state.completedTime))
-        print('Warning Text: {}'.format(state.warningText))
+        log.info('Order Status: %s, The accounts current initail margin: %s, The accounts current maintanence margin: %s, '
+                 'Comission Charged: %s, Completed Time: %s, Warning Text: %s', state.status, state.initMarginBefore,
+                 state.maintMarginBefore, state.commission, state.completedTime, state.warningText)
         
     @iswrapper
     def orderStatus(self, orderId, status, filled, remaining, avgFillPrice, permId, parentId, lastFillPrice, clientId, whyHeld, mktCapPrice):
         ''' Check the status of the submitted order '''
-        print('Status of Order: {}'.format(status))
-        print('No. of Filled Positions: {}'.format(filled))
-        print('No. of remaining positions: {}'.format(remaining))
-        print('Why Held: {}'.format(whyHeld)) # value 'locate'used when trying to locate shares for short sell
-        print('Average Fill Price: {}'.format(avgFillPrice))
-        print('permId: {}'.format(permId))
+        # Why Held value 'locate' used when trying to locate shares for short sell
+        log.info('Status of Order: %s, No. of Filled Positions: %s, No. of remaining positions: %s, Why Held: %s, Average Fill Price: %s, permId: %s',
+                 status, filled, remaining, whyHeld, avgFillPrice, permId)
 
     @iswrapper
     def position(self, account, contract, pos, avgCost):
         ''' Provides the portfolios Open Positions'''
-        print('No. of Positions held in {} : {} '.format(contract.symbol, pos))
-        print('The average cost of the position: {}'.format(avgCost))
+        log.info('No. of Positions held in %s : %s, The average cost of the position: %s', contract.symbol, pos, avgCost)
 
     @iswrapper
     def accountSummary(self, reqId, account, tag, value, currency):
         '''Read Information about the Account'''
-        print('Account {} : {} = {}'.format(account, tag, value))
-        print('The currency on which the Value is expressed: {}'.format(currency))
+        log.info('Account %s : %s = %s, The currency on which the Value is expressed: %s', account, tag, value, currency)
 
     @iswrapper    
     def error(self, reqId, code, msg):
-        print('Error Code: {}'.format(code))
-        print('Error Message: {}'.format(msg))        
+        log.log(error_level(code), 'Error Code: %s, Error Message: %s', code, msg)
 
 def main():
-    # Create the client and Connect to TWS API
+    # Create the client and Connect to TWS API. The callbacks log through a background writer thread
+    start_logging()
     client = TestLimitOrder('127.0.0.1', 7497, 7)
     time.sleep(3)
     client.orderId = None
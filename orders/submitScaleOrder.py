@@ -21,7 +21,12 @@ from ibapi.utils import iswrapper
 
 import time
 import threading
-import sys
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, error_level
+
+log = get_logger(__name__)
 
 class TestScaleOrder(EWrapper, EClient):
     ''' Serves as the Client and the Wrapper '''
@@ -42,27 +47,23 @@ class TestScaleOrder(EWrapper, EClient):
     def nextValidId(self, orderId):
         ''' Provides the next order ID '''
         self.orderId = orderId
-        print('\nThe order id is: {}'.format(orderId))
+        log.info('The order id is: %s', orderId)
 
     @iswrapper
     def openOrder(self, orderId, contract, order, state):
         ''' Callback for the submitted order '''
-        print('Order Status from openOrder callback: {}'.format(state.status))
+        log.info('Order Status from openOrder callback: %s', state.status)
         
     @iswrapper
     def orderStatus(self, orderId, status, filled, remaining, avgFillPrice, permId, parentId, lastFillPrice, clientId, whyHeld, mktCapPrice):
         ''' Check the status of the submitted order '''
-        print('Status of Order: {}'.format(status))
-        print('No. of Filled Positions: {}'.format(filled))
-        print('No. of remaining positions: {}'.format(remaining))
-        print('Why Held: {}'.format(whyHeld)) # value 'locate'used when trying to locate shares for short sell
-        print('Average Fill Price: {}'.format(avgFillPrice))
-        print('permId: {}'.format(permId))
+        # Why Held value 'locate' used when trying to locate shares for short sell
+        log.info('Status of Order: %s, No. of Filled Positions: %s, No. of remaining positions: %s, Why Held: %s, Average Fill Price: %s, permId: %s',
+                 status, filled, remaining, whyHeld, avgFillPrice, permId)
 
     @iswrapper    
     def error(self, reqId, code, msg):
-        print('Error Code: {}'.format(code))
-        print('Error Message: {}'.format(msg))
+        log.log(error_level(code), 'Error Code: %s, Error Message: %s', code, msg)
     
     @staticmethod
     def ScaleBracketOrder(parentOrderId:int, action:str, quantity:float, limitPrice:float, takeProfitLimitPrice1:float, takeProfitLimitPrice2:float, stopLossPrice:float, triggerPrice:float, adjustedStopPrice:float):
@@ -108,7 +109,8 @@ class TestScaleOrder(EWrapper, EClient):
         return ScaleBracketOrder
 
 def main():
-    # Create the client and Connect to TWS API
+    # Create the client and Connect to TWS API. The callbacks log through a background writer thread
+    start_logging()
     client = TestScaleOrder('127.0.0.1', 7497, 7)
     time.sleep(3)
     client.orderId = None
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Gap aware cache in front of reqHistoricalData.
+
+For every contract, whatToShow and bar size the cache remembers which time ranges were already
+downloaded into the HistoryStore (coverage.json next to the partitions). A program asks the cache
+which requests are needed for the range it wants (e.g. the last 2 years of daily bars) and only the
+missing tail or gaps are requested from TWS, each with the smallest legal durationStr.
+
+Typical use :
+
+    cache = HistoricalDataCache(history_store)
+    for end_date_time, duration, gap_start, gap_end in cache.missing_requests(key, '1 day', 'TRADES', start, now):
+        client.reqHistoricalData(req_id, contract, end_date_time, duration, '1 day', 'TRADES', 1, 1, False, [])
+        ... wait for historicalDataEnd and write the bars to the history store ...
+        cache.mark_covered(key, '1 day', 'TRADES', gap_start, gap_end)
+    df = history_store.read(key, '1 day', start, now)
+
+"""
+# Imports used
+import os
+import json
+import math
+import datetime
+
+from history_store import is_intraday
+
+def duration_str(start, end, bar_size):
+    ''' Smallest legal IB durationStr ('N S', 'N D' or 'N Y') which covers start to end '''
+    seconds = max(int(math.ceil((end - start).total_seconds())), 1)
+    if is_intraday(bar_size) and seconds <= 86400: # Seconds are only allowed up to 1 day
+        return '{} S'.format(seconds)
+    days = int(math.ceil(seconds / 86400))
+    if days <= 365:
+        return '{} D'.format(days)
+    # More than 365 days has to be in years. 'N Y' goes back N calendar years from the endDateTime
+    years = 1
+    while years_before(end.date(), years) > start.date():
+        years += 1
+    return '{} Y'.format(years)
+
+def years_before(day, years):
+    ''' The same calendar day, 'years' years before. 29 Feb becomes 28 Feb '''
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+class HistoricalDataCache:
+    ''' Tracks the downloaded time ranges per contract, whatToShow and bar size of a HistoryStore '''
+
+    def __init__(self, history_store):
+        self.history_store = history_store
+
+    def _coverage_file(self, key, bar_size, what_to_show):
+        return os.path.join(self.history_store.directory(key, bar_size, what_to_show), 'coverage.json')
+
+    def coverage(self, key, bar_size, what_to_show='TRADES'):
+        ''' Sorted, non overlapping list of (start, end) datetime ranges already downloaded '''
+        file_name = self._coverage_file(key, bar_size, what_to_show)
+        if not os.path.exists(file_name):
+            return []
+        with open(file_name) as f:
+            return [(datetime.datetime.fromisoformat(s), datetime.datetime.fromisoformat(e)) for s, e in json.load(f)]
+
+    def mark_covered(self, key, bar_size, what_to_show, start, end):
+        ''' Record that the bars from start to end are in the history store. Call after historicalDataEnd '''
+        ranges = sorted(self.coverage(key, bar_size, what_to_show) + [(start, end)])
+        merged = [ranges[0]]
+        for s, e in ranges[1:]:
+            if s <= merged[-1][1]: # Overlapping or touching ranges
+                merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+            else:
+                merged.append((s, e))
+        file_name = self._coverage_file(key, bar_size, what_to_show)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name + '.tmp', 'w') as f:
+            json.dump([[s.isoformat(), e.isoformat()] for s, e in merged], f)
+        os.replace(file_name + '.tmp', file_name)
+
+    def gaps(self, key, bar_size, what_to_show, start, end):
+        ''' List of (gap_start, gap_end) ranges between start and end which are not yet downloaded '''
+        gaps = []
+        cursor = start
+        for s, e in self.coverage(key, bar_size, what_to_show):
+            if e <= cursor:
+                continue
+            if s >= end:
+                break
+            if s > cursor:
+                gaps.append((cursor, s))
+            cursor = max(cursor, e)
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def missing_requests(self, key, bar_size, what_to_show, start, end):
+        '''
+        The reqHistoricalData requests needed to fill the gaps between start and end, as a list of
+        (endDateTime, durationStr, gap_start, gap_end). Pass gap_start and gap_end to mark_covered once the bars are stored
+        '''
+        requests = []
+        for gap_start, gap_end in self.gaps(key, bar_size, what_to_show, start, end):
+            # Start the gap at midnight, so the bar (or day) which was still forming at the last download is fetched again
+            gap_start = gap_start.replace(hour=0, minute=0, second=0, microsecond=0)
+            requests.append((gap_end.strftime('%Y%m%d %H:%M:%S'), duration_str(gap_start, gap_end, bar_size), gap_start, gap_end))
+        return requests
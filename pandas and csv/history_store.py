@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar on-disk store of historical OHLCV bars, shared by the programs in this repository.
+
+Instead of every program re-writing a whole CSV file per symbol, the bars are appended to
+Arrow IPC (Feather V2) files, one partition file per trading day (per year for daily bars):
+
+    <root>/<conId or localSymbol>/<whatToShow>/<bar size>/<partition>.arrow
+    e.g. history_store/NIFTY20OCTFUT/TRADES/5_mins/2020-10-01.arrow
+
+Range reads only open the partitions that overlap the requested range (partition pruning),
+and the Arrow files are memory-mapped instead of being parsed as text.
+
+Requires pyarrow (pip install pyarrow)
+"""
+# Imports used
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+SCHEMA = pa.schema([('Date', pa.timestamp('ns')), ('Open', pa.float64()), ('High', pa.float64()),
+                    ('Low', pa.float64()), ('Close', pa.float64()), ('Volume', pa.int64())])
+
+DEFAULT_ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'history_store')
+
+def is_intraday(bar_size):
+    ''' True for bar sizes below 1 day, e.g. '5 mins', '1 hour' '''
+    return not any(unit in bar_size for unit in ('day', 'week', 'month'))
+
+class HistoryStore:
+    ''' Append and range read OHLCV bars per contract, whatToShow and bar size '''
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+
+    def directory(self, key, bar_size, what_to_show='TRADES'):
+        ''' Directory holding the partitions of one contract (conId or localSymbol), whatToShow and bar size '''
+        return os.path.join(self.root, str(key), what_to_show, bar_size.replace(' ', '_'))
+
+    def partitions(self, key, bar_size, what_to_show='TRADES'):
+        ''' Sorted list of partition names ('YYYY-MM-DD' for intraday bars, 'YYYY' for daily bars) '''
+        directory = self.directory(key, bar_size, what_to_show)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(f[:-len('.arrow')] for f in os.listdir(directory) if f.endswith('.arrow'))
+
+    def write(self, key, bar_size, df, what_to_show='TRADES'):
+        '''
+        Append the bars in df (columns ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']) to the store.
+        Bars already stored with the same Date are replaced. Partitions which do not change are not rewritten.
+        Returns the number of partition files written
+        '''
+        if len(df) == 0:
+            return 0
+        directory = self.directory(key, bar_size, what_to_show)
+        os.makedirs(directory, exist_ok=True)
+
+        df = df[['Date', 'Open', 'High', 'Low', 'Close', 'Volume']]
+        dates = pd.to_datetime(df['Date'])
+        partition_names = dates.dt.strftime('%Y-%m-%d' if is_intraday(bar_size) else '%Y')
+        files_written = 0
+        for name, df_part in df.groupby(partition_names.values, sort=True):
+            file_name = os.path.join(directory, name + '.arrow')
+            new_table = self._to_table(df_part)
+            if os.path.exists(file_name):
+                old_table = self._read_file(file_name, memory_map=False) # A mapped file cannot be replaced on Windows
+                merged = self._merge(old_table, new_table)
+                if merged.equals(old_table): # Nothing new for this partition
+                    continue
+                new_table = merged
+            self._write_file(file_name, new_table)
+            files_written += 1
+        return files_written
+
+    def read(self, key, bar_size, start=None, end=None, what_to_show='TRADES'):
+        '''
+        Read the bars with start <= Date <= end as a DataFrame (start / end can be None, a date or a datetime).
+        Only the partitions overlapping the range are opened.
+        '''
+        directory = self.directory(key, bar_size, what_to_show)
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        if end is not None and end == end.normalize() and is_intraday(bar_size):
+            end = end + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns') # include the whole end day
+
+        tables = []
+        for name in self.partitions(key, bar_size, what_to_show):
+            first_day = pd.Timestamp(name if len(name) > 4 else name + '-01-01')
+            last_day = first_day + (pd.Timedelta(days=1) if len(name) > 4 else pd.DateOffset(years=1))
+            if start is not None and last_day <= start.normalize():
+                continue
+            if end is not None and first_day > end:
+                continue
+            tables.append(self._read_file(os.path.join(directory, name + '.arrow')))
+
+        if not tables:
+            return SCHEMA.empty_table().to_pandas()
+        df = pa.concat_tables(tables).to_pandas()
+        mask = np.ones(len(df), dtype=bool)
+        if start is not None:
+            mask &= (df['Date'] >= start).values
+        if end is not None:
+            mask &= (df['Date'] <= end).values
+        return df[mask].reset_index(drop=True)
+
+    def read_last(self, key, bar_size, days, what_to_show='TRADES'):
+        ''' Read the bars of the last 'days' stored partitions, e.g. the last 45 days of 5 minute bars '''
+        names = self.partitions(key, bar_size, what_to_show)
+        if not names:
+            return SCHEMA.empty_table().to_pandas()
+        if is_intraday(bar_size):
+            return self.read(key, bar_size, start=names[-days:][0], what_to_show=what_to_show)
+        last = self.last_date(key, bar_size, what_to_show)
+        return self.read(key, bar_size, start=last - pd.Timedelta(days=days), what_to_show=what_to_show)
+
+    def last_date(self, key, bar_size, what_to_show='TRADES'):
+        ''' Date of the last stored bar as a pandas Timestamp, or None if nothing is stored '''
+        names = self.partitions(key, bar_size, what_to_show)
+        if not names:
+            return None
+        table = self._read_file(os.path.join(self.directory(key, bar_size, what_to_show), names[-1] + '.arrow'))
+        return pd.Timestamp(table.column('Date')[-1].as_py())
+
+    @staticmethod
+    def _to_table(df):
+        ''' DataFrame to an Arrow table with the store schema '''
+        return pa.Table.from_pandas(pd.DataFrame({
+            'Date': pd.to_datetime(df['Date']).astype('datetime64[ns]').values,
+            'Open': df['Open'].astype(np.float64).values,
+            'High': df['High'].astype(np.float64).values,
+            'Low': df['Low'].astype(np.float64).values,
+            'Close': df['Close'].astype(np.float64).values,
+            'Volume': df['Volume'].astype(np.int64).values}), schema=SCHEMA, preserve_index=False)
+
+    @staticmethod
+    def _merge(old_table, new_table):
+        ''' Union of two partitions sorted by Date. For the same Date the new bar wins '''
+        df = pa.concat_tables([old_table, new_table]).to_pandas()
+        df = df.drop_duplicates(subset='Date', keep='last').sort_values('Date')
+        return pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False)
+
+    @staticmethod
+    def _read_file(file_name, memory_map=True):
+        ''' Read an Arrow IPC file. Memory-mapped by default: no text parsing and no copy of the column buffers '''
+        with (pa.memory_map(file_name, 'r') if memory_map else pa.OSFile(file_name, 'rb')) as source:
+            return ipc.open_file(source).read_all()
+
+    @staticmethod
+    def _write_file(file_name, table):
+        ''' Write to a temporary file and rename, so readers never see a half written partition '''
+        tmp_file = file_name + '.tmp'
+        with pa.OSFile(tmp_file, 'wb') as sink:
+            with ipc.new_file(sink, SCHEMA) as writer:
+                writer.write_table(table)
+        os.replace(tmp_file, file_name)
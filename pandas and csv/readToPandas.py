@@ -7,13 +7,17 @@ from ibapi.contract import Contract
 from ibapi.order import Order
 from ibapi.utils import iswrapper
 
-import time
 import threading
 import datetime
-import sys
+import sys, os
 
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, error_level
+
+log = get_logger(__name__)
+
 class TestHistoricalData(EWrapper, EClient):
     ''' Serves as the Client and the Wrapper '''
 
@@ -21,6 +25,8 @@ class TestHistoricalData(EWrapper, EClient):
         EWrapper.__init__(self)
         EClient.__init__(self, self)
         self.candle_data = [] #Initialize variable to store candle stick data
+        self.nextValidId_available = threading.Event() # Initialize an Event object
+        self.historicalDataEnd_available = threading.Event() # Initialize an Event object
 
         # Connect to TWS API
         self.connect(addr, port, client_id)
@@ -29,21 +35,33 @@ class TestHistoricalData(EWrapper, EClient):
         thread = threading.Thread(target=self.run)
         thread.start()
 
+    @iswrapper
+    def nextValidId(self, orderId):
+        ''' Sent by TWS on connection '''
+        self.nextValidId_available.set() #internal flag is set to True
+
     @iswrapper
     def historicalData(self, reqId, bar):
         ''' Callback to reqHistoricalData '''
         #self.candle_data.clear()
         self.candle_data.append([bar.date, bar.open, bar.high, bar.low, bar.close]) # only the ohlcv data is of interest to us.
 
+    @iswrapper
+    def historicalDataEnd(self, reqId, start, end):
+        '''Marks the ending of the historical bars reception.'''
+        self.historicalDataEnd_available.set() #internal flag is set to True
+
     @iswrapper    
     def error(self, reqId, code, msg):
-        print('Error Code: {}'.format(code))
-        print('Error Message: {}'.format(msg))
+        log.log(error_level(code), 'Error Code: %s, Error Message: %s', code, msg)
+        if reqId == 4: # The historical data request failed. There will be no historicalDataEnd
+            self.historicalDataEnd_available.set() #internal flag is set to True
 
 def main():
-    # Create the client and Connect to TWS API
+    # Create the client and Connect to TWS API. The callbacks log through a background writer thread
+    start_logging()
     client = TestHistoricalData('127.0.0.1', 7497, 7)
-    time.sleep(3) #Sleep interval to allow time for connection to server
+    client.nextValidId_available.wait(timeout=10) # block thread until we are connected to TWS
 
     # Define a Contract
     contract = Contract()
@@ -56,7 +74,7 @@ def main():
     # Request Historical Bars
     now = datetime.datetime.now().strftime("%Y%m%d, %H:%M:%S")
     client.reqHistoricalData(4, contract, now, '2 D', '15 mins', 'BID', False, 1, False, [])
-    time.sleep(5) # Allow enough time for data to be returned.
+    client.historicalDataEnd_available.wait(timeout=30) # block thread until historicalDataEnd
     df = pd.DataFrame(client.candle_data, columns=['DateTime', 'Open', 'High', 'Low', 'Close'])
     df['DateTime'] = pd.to_datetime(df['DateTime']) # Convert to pandas DateTime format
     print(df.tail())
@@ -64,7 +82,6 @@ def main():
     df.to_csv('infy.csv')
 
     # Disconnect from TWS
-    time.sleep(5)
     client.disconnect()
 
 if __name__ == "__main__":
@@ -5,9 +5,15 @@ from ibapi.wrapper import EWrapper
 from ibapi.utils import iswrapper
 
 from datetime import datetime
-from threading import Thread
-import time
+from threading import Thread, Event
 import pandas as pd
+import sys, os
+
+from history_store import HistoryStore
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, error_level
+
+log = get_logger(__name__)
 
 class ReadTicker(EWrapper, EClient):
     ''' Serves as the client and the wrapper '''
@@ -18,6 +24,10 @@ class ReadTicker(EWrapper, EClient):
         # Initialize properties
         self.symbols = {'ACC':'44652144','INFY':'44652017', 'WIPRO':'44652030'} # IB symbol could be different from NSE symbol, so use conId
         self.candle_dict = {}
+        self.max_wait_time = 30 # seconds to wait for historicalDataEnd
+
+        self.nextValidId_available = Event() # Initialize an Event object
+        self.historicalDataEnd_available = Event() # Initialize an Event object
 
         # Connect to TWS
         self.connect(addr, port, client_id)
@@ -26,6 +36,11 @@ class ReadTicker(EWrapper, EClient):
         thread = Thread(target=self.run)
         thread.start()
 
+    @iswrapper
+    def nextValidId(self, orderId):
+        ''' Sent by TWS on connection '''
+        self.nextValidId_available.set() #internal flag is set to True
+
     @iswrapper
     def historicalData(self, req_id, bar):
         ''' Callback to reqHistoricalData '''
@@ -38,14 +53,23 @@ class ReadTicker(EWrapper, EClient):
         self.candle_dict['Close'].append(bar.close)
         self.candle_dict['Volume'].append(bar.volume) # whatToShow in reqHistoricalData should be TRADES
 
+    @iswrapper
+    def historicalDataEnd(self, req_id, start, end):
+        '''Marks the ending of the historical bars reception.'''
+        self.historicalDataEnd_available.set() #internal flag is set to True
+
     def error(self, req_id, code, msg):
-        print('Error Code: {} & Error Message: {}'.format(code, msg))
+        log.log(error_level(code), 'Error Code: %s & Error Message: %s', code, msg)
+        if req_id == 4: # The historical data request failed. There will be no historicalDataEnd
+            self.historicalDataEnd_available.set() #internal flag is set to True
 
 def main():
 
-    # Create the client and connect to TWS
+    # Create the client and connect to TWS. The callbacks log through a background writer thread
+    start_logging()
     client = ReadTicker('127.0.0.1', 7497, 7)
-    time.sleep(3) #Sleep interval to allow time for connection to server
+    client.nextValidId_available.wait(timeout=10) # block thread until we are connected to TWS
+    history_store = HistoryStore() # columnar on-disk store shared by the programs in this repository
 
     # Get expiration dates for contracts
     for symbol in client.symbols:
@@ -65,13 +89,17 @@ def main():
 
         # Request OHLCV data
         now = datetime.now().strftime("%Y%m%d %H:%M:%S")
+        client.historicalDataEnd_available.clear() #internal flag is set to False
         client.reqHistoricalData(4, contract, now, '2 D', '5 mins', 'TRADES', False, 1, False, [])
-        time.sleep(3) # Allow enough time for data to be returned.
+        if not client.historicalDataEnd_available.wait(timeout=client.max_wait_time): # block thread until historicalDataEnd
+            print('No historicalDataEnd for {} within {} seconds'.format(symbol, client.max_wait_time))
+            client.cancelHistoricalData(4)
         df = pd.DataFrame(client.candle_dict, columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
         df['Date'] = pd.to_datetime(df['Date']) # Convert to pandas DateTime format
         # print(df.tail())
         # print(df.columns)                
         df.to_csv(symbol + '.csv', encoding='utf-8', index=False)
+        history_store.write(symbol, '5 mins', df) # only the new days are written
         client.candle_dict.clear()
 
     # Disconnect from TWS
@@ -8,18 +8,25 @@ from ibapi.utils import iswrapper
 from ibapi.scanner import ScannerSubscription
 from ibapi.tag_value import TagValue
 
-import time
 import threading
 import datetime
-import sys
+import sys, os
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, error_level
+
+log = get_logger(__name__)
+
 class StockScanner(EWrapper, EClient):
     ''' Serves as the Client and the Wrapper '''
 
     def __init__(self, addr, port, client_id):
         EClient. __init__(self, self)
 
+        self.nextValidId_available = threading.Event() # Initialize an Event object
+        self.scannerDataEnd_available = threading.Event() # Initialize an Event object
+
         # Connect to TWS API
         self.connect(addr, port, client_id)
         self.count = 0
@@ -27,26 +34,35 @@ class StockScanner(EWrapper, EClient):
         # Launch the client thread
         thread = threading.Thread(target=self.run)
         thread.start()
+
+    @iswrapper
+    def nextValidId(self, orderId):
+        ''' Sent by TWS on connection '''
+        self.nextValidId_available.set() #internal flag is set to True
     
     @iswrapper
     def scannerData(self, reqId, rank, details, distance, benchmark, projection, legsStr):
         # Print the symbols in the returned results
-        print('{}: {} : {}'.format(rank, details.contract.symbol, details.contract.secType))
+        log.info('%s: %s : %s', rank, details.contract.symbol, details.contract.secType)
         self.count += 1
         
     @iswrapper
     def scannerDataEnd(self, reqId):
         # Print the number of results
-        print('Number of results: {}'.format(self.count))
+        log.info('Number of results: %s', self.count)
+        self.scannerDataEnd_available.set() #internal flag is set to True
     
     def error(self, reqId, code, msg):
-        print('Error {}: {}'.format(code, msg))
+        log.log(error_level(code), 'Error %s: %s', code, msg)
+        if reqId == 7: # The scanner subscription failed. There will be no scannerDataEnd
+            self.scannerDataEnd_available.set() #internal flag is set to True
 
 def main():
 
-    # Create the client and connect to TWS
+    # Create the client and connect to TWS. The callbacks log through a background writer thread
+    start_logging()
     client = StockScanner('127.0.0.1', 7497, 7)
-    time.sleep(3)
+    client.nextValidId_available.wait(timeout=10) # block thread until we are connected to TWS
 
     # Create the object ScannerSubscription
     scanSub = ScannerSubscription() # Defines a market scanner request
@@ -64,9 +80,10 @@ def main():
 
     # Request the scanner subscription
     client.reqScannerSubscription(7, scanSub, [], tagvalues)
+    client.scannerDataEnd_available.wait(timeout=10) # block thread until scannerDataEnd
 
     # Disconnect from TWS
-    time.sleep(5)
+    client.cancelScannerSubscription(7)
     client.disconnect()
 
 if __name__ == '__main__':
@@ -6,7 +6,12 @@ from ibapi.wrapper import EWrapper
 from ibapi.utils import iswrapper
 
 import threading
-import time
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Handle callback messages')) # for callback_logger
+from callback_logger import get_logger, start_logging, error_level
+
+log = get_logger(__name__)
 
 class StockScanner(EWrapper, EClient):
     ''' Serves as the Client and the Wrapper '''
@@ -14,6 +19,9 @@ class StockScanner(EWrapper, EClient):
     def __init__(self, addr, port, client_id):
         EClient. __init__(self, self)
 
+        self.nextValidId_available = threading.Event() # Initialize an Event object
+        self.scannerParameters_available = threading.Event() # Initialize an Event object
+
         # Connect to TWS API
         self.connect(addr, port, client_id)
         self.count = 0
@@ -21,9 +29,14 @@ class StockScanner(EWrapper, EClient):
         # Launch the client thread
         thread = threading.Thread(target=self.run)
         thread.start()
+
+    @iswrapper
+    def nextValidId(self, orderId):
+        ''' Sent by TWS on connection '''
+        self.nextValidId_available.set() #internal flag is set to True
     
     def error(self, reqId, code, msg):
-        print('Error {}: {}'.format(code, msg))
+        log.log(error_level(code), 'Error %s: %s', code, msg)
 
     @iswrapper
     def scannerParameters(self, xml: str):
@@ -31,20 +44,22 @@ class StockScanner(EWrapper, EClient):
         super().scannerParameters(xml)
         #open('log/scanner.xml', 'w').write(xml)
         open('scanner.xml', 'w').write(xml)
-        print("ScannerParameters received.")
+        log.info('ScannerParameters received.')
+        self.scannerParameters_available.set() #internal flag is set to True
 
 def main():
 
-    # Create the client and connect to TWS
+    # Create the client and connect to TWS. The callbacks log through a background writer thread
+    start_logging()
     client = StockScanner('127.0.0.1', 7497, 7)
-    time.sleep(3)
+    client.nextValidId_available.wait(timeout=10) # block thread until we are connected to TWS
 
-    # Request the scanner parameters
+    # Request the scanner parameters. The XML is large, allow enough time
     client.reqScannerParameters()
-    time.sleep(3)
+    if not client.scannerParameters_available.wait(timeout=30): # block thread until scannerParameters
+        print("ScannerParameters not received within 30 seconds")
     
     # Disconnect from TWS
-    time.sleep(5)       
     client.disconnect()
 
 if __name__ == '__main__':
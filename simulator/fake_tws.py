@@ -0,0 +1,765 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated TWS / IB Gateway for offline, load and latency testing.
+
+Speaks the TWS API socket protocol (server version 151, as TWS API 9.79) on 127.0.0.1:7497, so the
+programs of this repository connect to it unchanged. Supported:
+
+    handshake, startApi          -> nextValidId, managedAccounts and the data farm messages (2104, 2106, 2158)
+    reqIds, reqCurrentTime       -> nextValidId, currentTime
+    reqContractDetails           -> one synthetic ContractDetails (STK, FUT, CONTFUT), error 200 for reject_symbols
+    reqHistoricalData            -> synthetic random walk bars, or the bars of a CSV file (Date, Open, High, Low, Close, Volume)
+                                    keepUpToDate=True streams historicalDataUpdate of the forming bar
+    reqMktData                   -> BID / ASK / LAST ticks every tick_interval, or one round and tickSnapshotEnd
+    placeOrder, cancelOrder      -> MKT, LMT, STP, STP LMT orders filled against the simulated price, with
+                                    parent / child (bracket) and OCA handling, transmit=False orders held
+                                    openOrder, orderStatus, execDetails, commissionReport, error 103 / 202
+    reqPositions, reqAllOpenOrders, reqOpenOrders, reqExecutions, reqAccountSummary, reqCompletedOrders (end only)
+
+Responses are delayed by latency + uniform(0, jitter) seconds, in order per connection.
+Pacing violations are simulated as TWS does: error 162 for reqHistoricalData above hist_pacing requests
+(60 per 600 sec at IB) and error 420 for reqMktData above mkt_pacing requests per second. error_rate makes
+that fraction of the requests fail with the same errors at random.
+
+    server = FakeTWS(port=7497, latency=0.002)
+    server.start() # in a background thread. Or server.serve_forever()
+    ...
+    server.stop()
+
+Usage :
+    python fake_tws.py [--port 7497] [--latency 0.002] [--jitter 0.001] [--hist-pacing 60/600] [--mkt-pacing 50]
+                       [--error-rate 0.01] [--csv NIFTY50=NIFTY_Minute.csv] [--price NIFTY50=11500]
+"""
+# Imports used in the program
+from ibapi.message import IN, OUT
+from ibapi.common import UNSET_DOUBLE, UNSET_INTEGER
+from ibapi.contract import Contract
+from ibapi.order import Order
+
+from collections import Counter, deque
+
+import numpy as np
+import pandas as pd
+import argparse
+import asyncio
+import datetime
+import itertools
+import threading
+import random
+import struct
+import math
+import time
+import zlib
+
+SERVER_VERSION = 151 # MIN_SERVER_VER_PRICE_MGMT_ALGO, the highest of TWS API 9.79. All the messages below are encoded for it
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+SESSION_START = datetime.time(9,15)
+SESSION_END = datetime.time(15,30)
+ACCOUNT = 'DU1234567'
+ACCOUNT_VALUES = {'NetLiquidation': 1000000.0, 'TotalCashValue': 1000000.0, 'AvailableFunds': 1000000.0, 'BuyingPower': 4000000.0,
+                  'ExcessLiquidity': 1000000.0, 'InitMarginReq': 0.0, 'MaintMarginReq': 0.0, 'GrossPositionValue': 0.0}
+MULTIPLIERS = {'NIFTY': '75', 'BANKNIFTY': '25'} # futures lot sizes by trading class
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+BID, ASK, LAST, VOLUME = 1, 2, 4, 8 # tick types
+WORKING = ('PreSubmitted', 'Submitted')
+BAR_FORMAT = '\0'.join(['{}'] * 8) # date, open, high, low, close, volume, average, barCount
+
+def field_text(value):
+    ''' Text of one field. None and the UNSET values are sent empty '''
+    cls = value.__class__
+    if cls is str:
+        return value
+    if cls is float:
+        return '' if value == UNSET_DOUBLE else str(value)
+    if cls is int:
+        return '' if value == UNSET_INTEGER else str(value)
+    if cls is bool:
+        return str(int(value))
+    return '' if value is None else str(value)
+
+def make_message(fields):
+    ''' Length prefixed message of null terminated fields '''
+    text = ('\0'.join(map(field_text, fields)) + '\0').encode()
+    return struct.pack('!I', len(text)) + text
+
+def read_contract(f, i):
+    ''' Contract from the 12 fields conId ... tradingClass starting at f[i], as sent by reqMktData, reqContractDetails, reqHistoricalData and placeOrder '''
+    c = Contract()
+    c.conId = int(f[i] or 0)
+    c.symbol, c.secType, c.lastTradeDateOrContractMonth = f[i + 1], f[i + 2], f[i + 3]
+    c.strike = float(f[i + 4] or 0)
+    c.right, c.multiplier, c.exchange, c.primaryExchange = f[i + 5], f[i + 6], f[i + 7], f[i + 8]
+    c.currency, c.localSymbol, c.tradingClass = f[i + 9], f[i + 10], f[i + 11]
+    return c
+
+def contract_fields(c):
+    ''' conId, symbol, secType, lastTradeDate, strike, right, multiplier, exchange, currency, localSymbol, tradingClass '''
+    return [c.conId, c.symbol, c.secType, c.lastTradeDateOrContractMonth, c.strike, c.right, c.multiplier, c.exchange,
+            c.currency, c.localSymbol, c.tradingClass]
+
+def last_thursday(year, month):
+    ''' Expiry of the NSE monthly futures '''
+    day = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+    return day - datetime.timedelta(days=(day.weekday() - 3) % 7)
+
+def bar_size_seconds(bar_size):
+    ''' '5 mins' -> 300. Daily and longer bars -> 86400 '''
+    count, unit = bar_size.split()[:2]
+    seconds = {'sec': 1, 'min': 60, 'hou': 3600}.get(unit[:3], 86400)
+    return int(count) * seconds
+
+def now_ist():
+    return datetime.datetime.now(IST).replace(tzinfo=None)
+
+def parse_end(end, default):
+    ''' endDateTime of reqHistoricalData: 'YYYYMMDD HH:MM:SS' (optional time zone), or '' for default '''
+    end = end.strip()
+    if not end:
+        return default
+    return datetime.datetime.strptime(end.replace('-', ' ')[:17], '%Y%m%d %H:%M:%S')
+
+def trading_days(end_date, count):
+    ''' The last count weekdays up to end_date, oldest first '''
+    days = []
+    day = end_date
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day -= datetime.timedelta(days=1)
+    return days[::-1]
+
+def duration_days(duration):
+    ''' Trading days of a duration '3 D', '2 W', '1 M', '1 Y'. None for seconds '''
+    count, unit = duration.split()[:2]
+    return None if unit == 'S' else int(count) * {'D': 1, 'W': 5, 'M': 22, 'Y': 252}[unit]
+
+def format_bar_date(date, daily, format_date):
+    if daily:
+        return date.strftime('%Y%m%d')
+    if format_date == 2: # epoch seconds
+        return str(int(date.replace(tzinfo=IST).timestamp()))
+    return date.strftime('%Y%m%d  %H:%M:%S')
+
+def round_tick(price, tick=0.05):
+    return round(round(price / tick) * tick, 2)
+
+class SimOrder:
+    ''' An order of the simulated order book '''
+
+    def __init__(self, session, order_id, contract, order, perm_id):
+        self.session = session
+        self.order_id = order_id
+        self.contract = contract
+        self.order = order
+        self.perm_id = perm_id
+        self.status = 'Inactive' # until it is transmitted
+        self.filled = 0.0
+        self.avg_fill_price = 0.0
+        self.triggered = False # for STP and STP LMT
+
+class Session:
+    ''' One client connection '''
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.client_id = None
+        self.mkt_data = {} # reqId : (conId, snapshot)
+        self.live_bars = {} # reqId of keepUpToDate reqHistoricalData : [conId, bar seconds, start, open, high, low, close, volume, count]
+        self.out_queue = None # (due time, message) when responses are delayed
+        self.last_due = 0.0
+
+    def send(self, fields):
+        message = make_message(fields)
+        self.server.stats['messages_out'] += 1
+        if self.out_queue is None:
+            self.writer.write(message)
+            return
+        loop = asyncio.get_running_loop()
+        due = max(loop.time() + self.server.latency + random.uniform(0, self.server.jitter), self.last_due) # keep the order
+        self.last_due = due
+        self.out_queue.put_nowait((due, message))
+
+    async def delayed_writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            due, message = await self.out_queue.get()
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.writer.write(message)
+
+    def error(self, req_id, code, msg):
+        self.send([IN.ERR_MSG, 2, req_id, code, msg])
+
+    async def run(self):
+        ''' Handshake, then read and handle the requests until the client disconnects '''
+        if await self.reader.readexactly(4) != b'API\0':
+            return
+        size = struct.unpack('!I', await self.reader.readexactly(4))[0]
+        versions = (await self.reader.readexactly(size)).decode().strip('\0').split()[0] # 'v100..157'
+        low, high = (int(v) for v in versions.lstrip('v').split('..'))
+        if not low <= SERVER_VERSION <= high:
+            print('Client versions {} do not include server version {}'.format(versions, SERVER_VERSION))
+            return
+        self.writer.write(make_message([SERVER_VERSION, now_ist().strftime('%Y%m%d %H:%M:%S') + ' IST']))
+        if self.server.latency > 0 or self.server.jitter > 0:
+            self.out_queue = asyncio.Queue()
+            writer_task = asyncio.ensure_future(self.delayed_writer())
+        try:
+            while True:
+                size = struct.unpack('!I', await self.reader.readexactly(4))[0]
+                fields = (await self.reader.readexactly(size)).decode(errors='replace').split('\0')[:-1]
+                self.server.stats['requests'] += 1
+                handler = self.server.handlers.get(int(fields[0]))
+                if handler is None:
+                    self.server.stats['unsupported'] += 1
+                    continue
+                if handler(self, fields) is False: # e.g. client id already in use
+                    break
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self.out_queue is not None:
+                while not self.out_queue.empty(): # let the queued responses go out before closing
+                    await asyncio.sleep(0.001)
+                writer_task.cancel()
+
+class FakeTWS:
+    ''' The simulated TWS. Runs an asyncio server, in the calling thread (serve_forever) or a background thread (start) '''
+
+    def __init__(self, host='127.0.0.1', port=7497, latency=0.0, jitter=0.0, hist_pacing=None, mkt_pacing=None,
+                 error_rate=0.0, tick_interval=0.25, volatility=0.0003, csv_files=None, prices=None, reject_symbols=(), seed=7):
+        self.host = host
+        self.port = port # 0 picks a free port. The port is set once the server listens
+        self.latency = latency # seconds added to every response
+        self.jitter = jitter # up to this many seconds more, at random
+        self.hist_pacing = hist_pacing # (requests, seconds), e.g. (60, 600). None for no limit
+        self.mkt_pacing = mkt_pacing # reqMktData per second. None for no limit
+        self.error_rate = error_rate # fraction of reqHistoricalData / reqMktData failing with 162 / 420 at random
+        self.tick_interval = tick_interval
+        self.volatility = volatility # of the price, per square root of a second
+        self.bar_files = {symbol: self.load_bars(file_name) for symbol, file_name in (csv_files or {}).items()}
+        self.base_prices = dict(prices or {})
+        self.reject_symbols = set(reject_symbols)
+        self.random = random.Random(seed)
+
+        self.sessions = set()
+        self.client_ids = set()
+        self.contracts = {} # conId : Contract of the contracts seen
+        self.prices = {} # conId : last price
+        self.orders = {} # (clientId, orderId) : SimOrder
+        self.open_orders = {} # the orders neither filled nor cancelled, held ones included
+        self.next_order_id = {} # clientId : next valid order id
+        self.positions = {} # conId : [position, avgCost]
+        self.executions = [] # (clientId, execution fields without the reqId)
+        self.exec_ids = itertools.count(1)
+        self.perm_ids = itertools.count(1000001)
+        self.hist_times = deque() # times of the recent reqHistoricalData, for the pacing
+        self.mkt_times = deque() # times of the recent reqMktData, for the pacing
+        self.stats = Counter()
+
+        self.handlers = {OUT.START_API: FakeTWS.start_api, OUT.REQ_IDS: FakeTWS.req_ids, OUT.REQ_CURRENT_TIME: FakeTWS.req_current_time,
+                         OUT.REQ_CONTRACT_DATA: FakeTWS.req_contract_details, OUT.REQ_HISTORICAL_DATA: FakeTWS.req_historical_data,
+                         OUT.CANCEL_HISTORICAL_DATA: FakeTWS.cancel_historical_data, OUT.REQ_MKT_DATA: FakeTWS.req_mkt_data,
+                         OUT.CANCEL_MKT_DATA: FakeTWS.cancel_mkt_data, OUT.PLACE_ORDER: FakeTWS.place_order, OUT.CANCEL_ORDER: FakeTWS.cancel_order,
+                         OUT.REQ_OPEN_ORDERS: FakeTWS.req_open_orders, OUT.REQ_ALL_OPEN_ORDERS: FakeTWS.req_open_orders,
+                         OUT.REQ_POSITIONS: FakeTWS.req_positions, OUT.REQ_EXECUTIONS: FakeTWS.req_executions,
+                         OUT.REQ_ACCOUNT_SUMMARY: FakeTWS.req_account_summary, OUT.REQ_COMPLETED_ORDERS: FakeTWS.req_completed_orders,
+                         OUT.CANCEL_POSITIONS: FakeTWS.ignore, OUT.CANCEL_ACCOUNT_SUMMARY: FakeTWS.ignore, OUT.REQ_MARKET_DATA_TYPE: FakeTWS.ignore}
+        self.handlers = {msg_id: (lambda handler: lambda session, fields: handler(self, session, fields))(handler)
+                         for msg_id, handler in self.handlers.items()}
+
+        self.loop = None
+        self.thread = None
+        self.listening = threading.Event()
+
+    # ------------------------------------------------------------------ running the server
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        server = await asyncio.start_server(self.on_connect, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        ticker = asyncio.ensure_future(self.ticker())
+        print('Fake TWS listening on {}:{}'.format(self.host, self.port))
+        self.listening.set() #internal flag is set to True
+        async with server:
+            await self.stopped.wait()
+            for session in list(self.sessions): # the sessions end on the closed connection
+                session.writer.close()
+            await asyncio.sleep(0.1)
+        ticker.cancel()
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            pass
+        print('Requests: {}, responses: {}, unsupported requests: {}'.format(self.stats['requests'], self.stats['messages_out'], self.stats['unsupported']))
+
+    def start(self, timeout=10):
+        ''' Run the server in a daemon thread. Returns once it listens '''
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.main()), daemon=True)
+        self.thread.start()
+        self.listening.wait(timeout=timeout) # block thread until the server listens
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+    async def on_connect(self, reader, writer):
+        session = Session(self, reader, writer)
+        self.sessions.add(session)
+        try:
+            await session.run()
+        finally:
+            self.sessions.discard(session)
+            self.client_ids.discard(session.client_id)
+            writer.close()
+
+    # ------------------------------------------------------------------ prices and contracts
+
+    @staticmethod
+    def load_bars(file_name):
+        df = pd.read_csv(file_name)
+        df['Date'] = pd.to_datetime(df['Date']) # Convert to pandas DateTime format
+        return df.sort_values('Date').reset_index(drop=True)
+
+    def resolve(self, c):
+        ''' Complete a requested contract as TWS would: secType, expiry, localSymbol, tradingClass, multiplier and conId '''
+        c.secType = 'FUT' if c.secType == 'CONTFUT' else (c.secType or 'STK')
+        c.exchange = c.exchange or 'NSE'
+        c.currency = c.currency or 'INR'
+        if c.secType == 'FUT':
+            if c.localSymbol and not c.symbol: # e.g. NIFTY20SEPFUT
+                c.tradingClass = c.tradingClass or c.localSymbol[:-8]
+                year, month = 2000 + int(c.localSymbol[-8:-6]), MONTHS.index(c.localSymbol[-6:-3]) + 1
+                c.symbol = c.tradingClass + ('50' if c.tradingClass == 'NIFTY' else '')
+            else:
+                c.tradingClass = c.tradingClass or c.symbol.rstrip('0123456789') or c.symbol
+                today = now_ist().date()
+                if c.lastTradeDateOrContractMonth:
+                    year, month = int(c.lastTradeDateOrContractMonth[:4]), int(c.lastTradeDateOrContractMonth[4:6])
+                else: # front month
+                    year, month = today.year, today.month
+                    if today > last_thursday(year, month):
+                        year, month = year + month // 12, month % 12 + 1
+            c.lastTradeDateOrContractMonth = last_thursday(year, month).strftime('%Y%m%d')
+            c.localSymbol = '{}{:02d}{}FUT'.format(c.tradingClass, year % 100, MONTHS[month - 1])
+            c.multiplier = c.multiplier or MULTIPLIERS.get(c.tradingClass, '1')
+        else:
+            c.localSymbol = c.localSymbol or c.symbol
+            c.tradingClass = c.tradingClass or c.symbol
+            c.primaryExchange = c.primaryExchange or c.exchange
+        if not c.conId:
+            c.conId = zlib.crc32('{}:{}'.format(c.secType, c.localSymbol).encode()) & 0x7fffffff
+        if c.conId not in self.contracts:
+            self.contracts[c.conId] = c
+        return self.contracts[c.conId]
+
+    def price(self, c):
+        ''' Last price of a resolved contract. Starts at the configured price, the CSV file's last close or a price from the symbol '''
+        if c.conId not in self.prices:
+            if c.symbol in self.base_prices or c.localSymbol in self.base_prices:
+                price = float(self.base_prices.get(c.localSymbol, self.base_prices.get(c.symbol)))
+            elif c.symbol in self.bar_files:
+                price = float(self.bar_files[c.symbol]['Close'].iloc[-1])
+            else:
+                price = 100 + zlib.crc32(c.symbol.encode()) % 4900
+            self.prices[c.conId] = round_tick(price)
+        return self.prices[c.conId]
+
+    async def ticker(self):
+        ''' Every tick_interval: move the prices in use, send the market data and bar updates, and work the orders '''
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            volatility = self.volatility * math.sqrt(self.tick_interval)
+            active = {con_id for s in self.sessions for con_id, _ in s.mkt_data.values()}
+            active |= {bar[0] for s in self.sessions for bar in s.live_bars.values()}
+            active |= {o.contract.conId for o in self.open_orders.values() if o.status in WORKING}
+            for con_id in active:
+                self.prices[con_id] = round_tick(self.prices[con_id] * math.exp(self.random.gauss(0, volatility)))
+            for session in list(self.sessions):
+                for req_id, (con_id, _) in session.mkt_data.items():
+                    self.send_ticks(session, req_id, con_id)
+                for req_id, bar in session.live_bars.items():
+                    self.update_live_bar(session, req_id, bar)
+            for o in list(self.open_orders.values()):
+                if o.status in WORKING:
+                    self.work_order(o)
+
+    # ------------------------------------------------------------------ connection and ids
+
+    def start_api(self, session, f):
+        client_id = int(f[2])
+        if client_id in self.client_ids:
+            session.error(-1, 326, 'Unable to connect as the client id is already in use. Retry with a unique client id.')
+            return False
+        session.client_id = client_id
+        self.client_ids.add(client_id)
+        session.send([IN.NEXT_VALID_ID, 1, self.next_order_id.setdefault(client_id, 1)])
+        session.send([IN.MANAGED_ACCTS, 1, ACCOUNT])
+        session.error(-1, 2104, 'Market data farm connection is OK:hfarm')
+        session.error(-1, 2106, 'HMDS data farm connection is OK:hkhmds')
+        session.error(-1, 2158, 'Sec-def data farm connection is OK:secdefhk')
+
+    def req_ids(self, session, f):
+        session.send([IN.NEXT_VALID_ID, 1, self.next_order_id.setdefault(session.client_id, 1)])
+
+    def req_current_time(self, session, f):
+        session.send([IN.CURRENT_TIME, 1, int(time.time())])
+
+    def ignore(self, session, f):
+        pass
+
+    # ------------------------------------------------------------------ contract details
+
+    def req_contract_details(self, session, f):
+        req_id = int(f[2])
+        c = read_contract(f, 3)
+        if c.symbol in self.reject_symbols or c.localSymbol in self.reject_symbols:
+            session.error(req_id, 200, 'No security definition has been found for the request')
+            return
+        c = self.resolve(c)
+        day = now_ist().strftime('%Y%m%d')
+        hours = '{}:0915-{}:1530'.format(day, day)
+        session.send([IN.CONTRACT_DATA, 8, req_id, c.symbol, c.secType, c.lastTradeDateOrContractMonth, c.strike, c.right,
+                      c.exchange, c.currency, c.localSymbol, c.tradingClass, c.tradingClass, c.conId, 0.05, 1, c.multiplier,
+                      'LMT,MKT,STP,STP LMT', c.exchange, 1, 0, c.symbol, c.primaryExchange or c.exchange, c.lastTradeDateOrContractMonth[:6],
+                      '', '', '', 'Asia/Calcutta', hours, hours, '', '', 0, 0, '', '', '', c.lastTradeDateOrContractMonth])
+        session.send([IN.CONTRACT_DATA_END, 1, req_id])
+
+    # ------------------------------------------------------------------ historical data
+
+    def paced(self, times, limit, window):
+        ''' True if a request now exceeds limit requests in the last window seconds. Else counts it '''
+        now = time.monotonic()
+        while times and times[0] <= now - window:
+            times.popleft()
+        if len(times) >= limit:
+            return True
+        times.append(now)
+        return False
+
+    def req_historical_data(self, session, f):
+        req_id = int(f[1])
+        self.stats['historical_data'] += 1
+        if (self.hist_pacing and self.paced(self.hist_times, *self.hist_pacing)) or self.random.random() < self.error_rate:
+            session.error(req_id, 162, 'Historical Market Data Service error message:Historical data request pacing violation')
+            return
+        c = self.resolve(read_contract(f, 2))
+        end, bar_size, duration, format_date = f[15], f[16], f[17], int(f[20] or 1)
+        keep_up_to_date = f[-2] == '1'
+        seconds = bar_size_seconds(bar_size)
+        daily = seconds >= 86400
+        if c.symbol in self.bar_files:
+            bars = self.file_bars(self.bar_files[c.symbol], end, duration)
+            self.price(c) # the live bars and ticks of a keepUpToDate request move on from the file's last Close
+        else:
+            bars = self.synthetic_bars(c, parse_end(end, now_ist()), duration, seconds)
+        # The bars are formatted as one block of null separated fields, the bulk of the message
+        block = '\0'.join(BAR_FORMAT.format(format_bar_date(date, daily, format_date), o, h, l, cl, v, round((h + l + cl) / 3, 2), max(1, v // 10))
+                           for date, o, h, l, cl, v in bars)
+        fields = [IN.HISTORICAL_DATA, req_id, '', '', len(bars)] + ([block] if bars else [])
+        if bars:
+            fields[2], fields[3] = format_bar_date(bars[0][0], daily, 1), format_bar_date(bars[-1][0], daily, 1)
+        session.send(fields)
+        if keep_up_to_date and not daily:
+            date, o, h, l, cl, v = bars[-1] if bars else (None, 0, 0, 0, 0, 0)
+            session.live_bars[req_id] = [c.conId, seconds, date, o, h, l, cl, v, format_date]
+
+    def synthetic_bars(self, c, end, duration, seconds):
+        ''' Random walk bars ending at the current price of the contract, the same for the same request '''
+        daily = seconds >= 86400
+        days = duration_days(duration)
+        if daily:
+            dates = [datetime.datetime.combine(day, datetime.time()) for day in trading_days(end.date(), days or 1)]
+        else:
+            dates = []
+            start = end - datetime.timedelta(seconds=int(duration.split()[0])) if days is None else None
+            for day in trading_days(end.date(), days or 1):
+                t = datetime.datetime.combine(day, SESSION_START)
+                close = datetime.datetime.combine(day, SESSION_END)
+                while t < close and t < end:
+                    if start is None or t >= start:
+                        dates.append(t)
+                    t += datetime.timedelta(seconds=seconds)
+        rng = np.random.default_rng(zlib.crc32('{}:{}:{}:{}'.format(c.conId, end, duration, seconds).encode()))
+        step = self.volatility * math.sqrt(seconds) if not daily else 0.012
+        n = len(dates)
+        if n == 0:
+            return []
+        returns = rng.normal(0, step, n)
+        # The close of the last bar is the current price, and the open of a bar is the close of the bar before
+        log_close = math.log(self.price(c)) - np.concatenate([np.cumsum(returns[:0:-1])[::-1], [0.0]])
+        close = np.exp(log_close)
+        open_ = np.exp(log_close - returns)
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, step / 2, n)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, step / 2, n)))
+        volume = rng.integers(1000, 50000, n)
+        return list(zip(dates, *(np.round(np.round(x * 20) / 20, 2).tolist() for x in (open_, high, low, close)), volume.tolist()))
+
+    def file_bars(self, df, end, duration):
+        ''' Bars of the CSV file in the duration up to end. end '' is the last bar of the file '''
+        end = parse_end(end, df['Date'].iloc[-1].to_pydatetime())
+        days = duration_days(duration)
+        if days is None:
+            start = end - datetime.timedelta(seconds=int(duration.split()[0]))
+        else:
+            start = datetime.datetime.combine(trading_days(end.date(), days)[0], datetime.time())
+        df = df[(df['Date'] >= start) & (df['Date'] <= end)]
+        return list(zip([d.to_pydatetime() for d in df['Date']], df['Open'].tolist(), df['High'].tolist(), df['Low'].tolist(),
+                        df['Close'].tolist(), df['Volume'].astype(int).tolist()))
+
+    def update_live_bar(self, session, req_id, bar):
+        ''' Update the forming bar of a keepUpToDate request with the current price and send it '''
+        con_id, seconds, start, o, h, l, c, v, format_date = bar
+        now = now_ist()
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        bar_start = midnight + datetime.timedelta(seconds=(now - midnight).total_seconds() // seconds * seconds)
+        price = self.prices[con_id]
+        if start != bar_start: # a new bar
+            start, o, h, l, v = bar_start, price, price, price, 0
+        h, l, c, v = max(h, price), min(l, price), price, v + self.random.randint(1, 100)
+        bar[2:8] = [start, o, h, l, c, v]
+        session.send([IN.HISTORICAL_DATA_UPDATE, req_id, max(1, v // 10), format_bar_date(start, False, format_date),
+                      o, c, h, l, round((h + l + c) / 3, 2), v])
+
+    def cancel_historical_data(self, session, f):
+        session.live_bars.pop(int(f[2]), None)
+
+    # ------------------------------------------------------------------ market data
+
+    def req_mkt_data(self, session, f):
+        req_id = int(f[2])
+        self.stats['mkt_data'] += 1
+        if (self.mkt_pacing and self.paced(self.mkt_times, self.mkt_pacing, 1.0)) or self.random.random() < self.error_rate:
+            session.error(req_id, 420, 'Invalid Real-time Query:Pacing violation')
+            return
+        c = self.resolve(read_contract(f, 3))
+        self.price(c)
+        if f[-3] == '1': # snapshot
+            self.send_ticks(session, req_id, c.conId)
+            session.send([IN.TICK_SNAPSHOT_END, 1, req_id])
+        else:
+            session.mkt_data[req_id] = (c.conId, False)
+
+    def send_ticks(self, session, req_id, con_id):
+        price = self.prices[con_id]
+        spread = 0.05 * self.random.randint(1, 3)
+        session.send([IN.TICK_PRICE, 6, req_id, BID, round_tick(price - spread), self.random.randint(1, 500) * 25, 0])
+        session.send([IN.TICK_PRICE, 6, req_id, ASK, round_tick(price + spread), self.random.randint(1, 500) * 25, 0])
+        session.send([IN.TICK_PRICE, 6, req_id, LAST, price, self.random.randint(1, 20) * 25, 0])
+
+    def cancel_mkt_data(self, session, f):
+        session.mkt_data.pop(int(f[2]), None)
+
+    # ------------------------------------------------------------------ orders
+
+    def place_order(self, session, f):
+        order_id = int(f[1])
+        key = (session.client_id, order_id)
+        existing = self.orders.get(key)
+        if existing is None and order_id < self.next_order_id.get(session.client_id, 1) or \
+           existing is not None and existing.status not in WORKING + ('Inactive',):
+            session.error(order_id, 103, 'Duplicate order id')
+            return
+        order = Order()
+        order.orderId = order_id
+        order.action, order.orderType = f[16], f[18]
+        order.totalQuantity = float(f[17])
+        order.lmtPrice = float(f[19]) if f[19] else UNSET_DOUBLE
+        order.auxPrice = float(f[20]) if f[20] else UNSET_DOUBLE
+        order.tif, order.ocaGroup, order.account, order.orderRef = f[21], f[22], f[23] or ACCOUNT, f[26]
+        order.transmit = f[27] == '1'
+        order.parentId = int(f[28] or 0)
+        order.clientId = session.client_id
+        self.next_order_id[session.client_id] = max(self.next_order_id.get(session.client_id, 1), order_id + 1)
+        self.stats['orders'] += 1
+
+        if existing is not None: # modification of a working order
+            existing.order.totalQuantity, existing.order.lmtPrice, existing.order.auxPrice = order.totalQuantity, order.lmtPrice, order.auxPrice
+            if existing.status in WORKING:
+                self.send_order_status(existing)
+                self.work_order(existing)
+            return
+        o = SimOrder(session, order_id, self.resolve(read_contract(f, 2)), order, next(self.perm_ids))
+        order.permId = o.perm_id
+        self.orders[key] = self.open_orders[key] = o
+        self.price(o.contract)
+        if order.transmit: # transmits the orders of its group held with transmit=False, parent first
+            root = order.parentId or order_id
+            group = [x for (cid, oid), x in sorted(self.open_orders.items())
+                     if cid == session.client_id and x.status == 'Inactive' and (oid == root or x.order.parentId == root)]
+            for x in group:
+                self.activate(x)
+
+    def parent_of(self, o):
+        return self.orders.get((o.session.client_id, o.order.parentId)) if o.order.parentId else None
+
+    def activate(self, o):
+        parent = self.parent_of(o)
+        o.status = 'PreSubmitted' if (parent is not None and parent.status != 'Filled') or o.order.orderType.startswith('STP') else 'Submitted'
+        self.send_open_order(o)
+        self.send_order_status(o)
+        self.work_order(o)
+
+    def work_order(self, o):
+        ''' Fill the order if the simulated price allows it '''
+        parent = self.parent_of(o)
+        if parent is not None and parent.status != 'Filled': # children wait for the parent fill
+            return
+        price = self.prices[o.contract.conId]
+        buy = o.order.action == 'BUY'
+        order_type = o.order.orderType
+        if order_type.startswith('STP') and not o.triggered:
+            if (buy and price >= o.order.auxPrice) or (not buy and price <= o.order.auxPrice):
+                o.triggered = True
+            else:
+                if o.status != 'PreSubmitted':
+                    o.status = 'PreSubmitted'
+                    self.send_order_status(o)
+                return
+        if order_type in ('LMT', 'STP LMT'):
+            if (buy and price > o.order.lmtPrice) or (not buy and price < o.order.lmtPrice):
+                if o.status != 'Submitted':
+                    o.status = 'Submitted'
+                    self.send_order_status(o)
+                return
+        self.fill(o, price)
+
+    def fill(self, o, price):
+        o.status, o.filled, o.avg_fill_price = 'Filled', o.order.totalQuantity, price
+        del self.open_orders[(o.session.client_id, o.order_id)]
+        quantity = o.order.totalQuantity if o.order.action == 'BUY' else -o.order.totalQuantity
+        multiplier = float(o.contract.multiplier or 1)
+        position = self.positions.setdefault(o.contract.conId, [0.0, 0.0])
+        old = position[0]
+        new = old + quantity
+        if new == 0:
+            position[1] = 0.0
+        elif old == 0 or (old > 0) != (new > 0): # opened or reversed
+            position[1] = price * multiplier
+        elif abs(new) > abs(old): # added to
+            position[1] = (position[1] * abs(old) + price * multiplier * abs(quantity)) / abs(new)
+        position[0] = new
+
+        exec_id = '0000{:08x}.01.01'.format(next(self.exec_ids))
+        execution = [o.order_id] + contract_fields(o.contract) + [exec_id, now_ist().strftime('%Y%m%d  %H:%M:%S'), o.order.account,
+                     o.contract.exchange, 'BOT' if quantity > 0 else 'SLD', abs(quantity), price, o.perm_id, o.session.client_id,
+                     0, abs(quantity), price, o.order.orderRef, '', '', '', 1]
+        self.executions.append((o.session.client_id, execution))
+        o.session.send([IN.EXECUTION_DATA, -1] + execution)
+        self.send_order_status(o)
+        self.send_open_order(o)
+        o.session.send([IN.COMMISSION_REPORT, 1, exec_id, 20.0, o.contract.currency, UNSET_DOUBLE, UNSET_DOUBLE, UNSET_INTEGER])
+
+        # The other children of the parent, and the orders of the same OCA group, are cancelled
+        for x in list(self.open_orders.values()):
+            if x is not o and x.status in WORKING and x.session is o.session and \
+               ((o.order.parentId and x.order.parentId == o.order.parentId) or (o.order.ocaGroup and x.order.ocaGroup == o.order.ocaGroup)):
+                self.cancel(x)
+        for x in list(self.open_orders.values()): # children of this order become active
+            if x.order.parentId == o.order_id and x.session is o.session and x.status in WORKING:
+                x.status = 'Submitted' if not x.order.orderType.startswith('STP') else 'PreSubmitted'
+                self.send_order_status(x)
+                self.work_order(x)
+
+    def cancel(self, o):
+        o.status = 'Cancelled'
+        del self.open_orders[(o.session.client_id, o.order_id)]
+        self.send_order_status(o)
+        o.session.error(o.order_id, 202, 'Order Canceled - reason:')
+        for x in list(self.open_orders.values()): # and its children
+            if x.order.parentId == o.order_id and x.session is o.session and x.status in WORKING + ('Inactive',):
+                self.cancel(x)
+
+    def cancel_order(self, session, f):
+        order_id = int(f[2])
+        o = self.orders.get((session.client_id, order_id))
+        if o is None or o.status not in WORKING + ('Inactive',):
+            session.error(order_id, 135, "Can't find order with id = {}".format(order_id))
+            return
+        self.cancel(o)
+
+    def send_order_status(self, o):
+        o.session.send([IN.ORDER_STATUS, o.order_id, o.status, o.filled, o.order.totalQuantity - o.filled, o.avg_fill_price,
+                        o.perm_id, o.order.parentId, o.avg_fill_price, o.session.client_id, '', 0])
+
+    def send_open_order(self, o, session=None):
+        ''' OPEN_ORDER with the fields of a simulated order. The other order fields are sent empty '''
+        order, c = o.order, o.contract
+        (session or o.session).send(
+            [IN.OPEN_ORDER, o.order_id] + contract_fields(c) +
+            [order.action, order.totalQuantity, order.orderType, order.lmtPrice, order.auxPrice, order.tif, order.ocaGroup,
+             order.account, order.openClose, order.origin, order.orderRef, o.session.client_id, o.perm_id] +
+            [''] * 32 + # outsideRth ... nbboPriceCap
+            [order.parentId] +
+            [''] * 26 + # triggerMethod ... solicited
+            [0, o.status] + [''] * 14 + # whatIf, status, margins, commissions, warningText
+            [''] * 19) # randomizeSize ... usePriceMgmtAlgo
+
+    def req_open_orders(self, session, f):
+        for o in self.open_orders.values():
+            if o.session is session and o.status in WORKING:
+                self.send_open_order(o)
+                self.send_order_status(o)
+        session.send([IN.OPEN_ORDER_END, 1])
+
+    def req_completed_orders(self, session, f):
+        session.send([IN.COMPLETED_ORDERS_END])
+
+    # ------------------------------------------------------------------ portfolio
+
+    def req_positions(self, session, f):
+        for con_id, (position, avg_cost) in self.positions.items():
+            c = self.contracts[con_id]
+            session.send([IN.POSITION_DATA, 3, ACCOUNT] + contract_fields(c) + [position, avg_cost])
+        session.send([IN.POSITION_END, 1])
+
+    def req_executions(self, session, f):
+        req_id = int(f[2])
+        for client_id, execution in self.executions:
+            if client_id == session.client_id:
+                session.send([IN.EXECUTION_DATA, req_id] + execution)
+        session.send([IN.EXECUTION_DATA_END, 1, req_id])
+
+    def req_account_summary(self, session, f):
+        req_id, tags = int(f[2]), [tag.strip() for tag in f[4].split(',')]
+        for tag in tags:
+            if tag in ACCOUNT_VALUES:
+                session.send([IN.ACCOUNT_SUMMARY, 1, req_id, ACCOUNT, tag, ACCOUNT_VALUES[tag], 'INR'])
+        session.send([IN.ACCOUNT_SUMMARY_END, 1, req_id])
+
+def parse_assignments(values):
+    ''' ['NIFTY50=11500', ...] -> {'NIFTY50': '11500', ...} '''
+    return dict(value.split('=', 1) for value in values or [])
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated TWS / IB Gateway')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7497)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many seconds more, at random')
+    parser.add_argument('--hist-pacing', default=None, help='reqHistoricalData limit as requests/seconds, e.g. 60/600 (error 162)')
+    parser.add_argument('--mkt-pacing', type=int, default=None, help='reqMktData per second limit (error 420)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of data requests failing with 162 / 420')
+    parser.add_argument('--tick-interval', type=float, default=0.25, help='seconds between market data ticks')
+    parser.add_argument('--csv', action='append', help='SYMBOL=file.csv of bars for reqHistoricalData of the symbol')
+    parser.add_argument('--price', action='append', help='SYMBOL=price to start the simulated price at')
+    parser.add_argument('--reject', action='append', default=[], help='symbol answered with error 200')
+    args = parser.parse_args()
+
+    hist_pacing = tuple(int(x) for x in args.hist_pacing.split('/')) if args.hist_pacing else None
+    server = FakeTWS(args.host, args.port, args.latency, args.jitter, hist_pacing, args.mkt_pacing, args.error_rate,
+                     args.tick_interval, csv_files=parse_assignments(args.csv), prices=parse_assignments(args.price), reject_symbols=args.reject)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()